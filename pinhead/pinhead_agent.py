@@ -1,5 +1,3 @@
-from mesa import Agent
-
 import random
 import numpy as np
 
@@ -15,9 +13,17 @@ class Strategy(Enum):
     STATIC = 7
 
 
-class PinheadAgent(Agent):
+class PinheadAgent:
+    # fixed attribute layout, so agents carry no __dict__
+    __slots__ = (
+        "id", "model", "strategy", "fitness", "avg_fitness", "observed", "cooperates", "new_epoch",
+        "p_obs", "base_fitness", "erred", "default_choice", "pi", "avg_pi", "p_coop", "migrated_epoch",
+        "partner", "partner_epoch", "s_prob", "r_prob"
+    )
+
     def __init__(self, unique_id, model, strategy, group, starting_fitness=0, pi=0):
-        super().__init__(unique_id, model)
+        self.unique_id = unique_id
+        self.model = model
 
         self.strategy = strategy
         self.fitness = starting_fitness
@@ -32,15 +38,63 @@ class PinheadAgent(Agent):
         self.pi = pi
         self.avg_pi = pi
 
-        self.model.curr_indiv_id = int(self.unique_id[1:]) + 1
-        self.add_to_group(group)
+        self.model.curr_indiv_id = max(self.model.curr_indiv_id, self.id + 1)
+        if group is not None: # otherwise the caller adds it, as PinheadModel.add_indivs does
+            self.add_to_group(group)
         
         self.p_coop = 0 # testing purposes only
-        self.migrated = False
-        self.migration_partner = None
+        self.migrated_epoch = -1
+        self.partner = None
+        self.partner_epoch = -1
         self.s_prob = 0 # testing purposes only
         self.r_prob = 0 # testing purposes only
     
+    """
+    PinheadAgent -> String
+    label of the agent, only built when the logger or a print helper asks for it
+    """
+    @property
+    def unique_id(self):
+        return "i" + str(self.id)
+
+    @unique_id.setter
+    def unique_id(self, unique_id):
+        self.id = int(unique_id[1:]) if isinstance(unique_id, str) else int(unique_id)
+
+    @property
+    def random(self):
+        return self.model.random
+
+    """
+    PinheadAgent -> Boolean
+    the per-year flags only hold in the epoch they were set in, so the scheduler clears
+    them all by starting a new epoch instead of visiting every agent
+    """
+    @property
+    def is_new_agent(self):
+        return self.new_epoch == self.model.schedule.epoch
+
+    @is_new_agent.setter
+    def is_new_agent(self, is_new_agent):
+        self.new_epoch = self.model.schedule.epoch if is_new_agent else -1
+
+    @property
+    def migrated(self):
+        return self.migrated_epoch == self.model.schedule.epoch
+
+    @migrated.setter
+    def migrated(self, migrated):
+        self.migrated_epoch = self.model.schedule.epoch if migrated else -1
+
+    @property
+    def migration_partner(self):
+        return self.partner if self.partner_epoch == self.model.schedule.epoch else None
+
+    @migration_partner.setter
+    def migration_partner(self, partner):
+        self.partner = partner
+        self.partner_epoch = self.model.schedule.epoch
+
     """
     PinheadAgent -> 
     modifies variables so that the agent gets added to the group it's been assigned to
@@ -51,8 +105,6 @@ class PinheadAgent(Agent):
         self.model.group_table[group].append(self)
         group.inc_strategy_count(self.strategy)
         # self.model.schedule.add(self)
-
-        self.model.agent_counts[self.strategy] += 1
     """
     PinheadAgent ->
     asks every agent to cooperate or defect, and decides if the agent gets caught
@@ -0,0 +1,496 @@
+from pinhead_agent import Strategy
+from pinhead_scheduler import ArrayActivationByLevel
+from pinhead_logging import Logger
+from pinhead_detectors import default_detectors, run_detectors
+from pinhead_kernels import group_payoffs, select_survivors, select_parents, shuffle_and_pair, segment_counts, choice_probabilities, civic_update, selfish_update, conflict_outcomes
+
+import numpy as np
+
+# strategies are stored in the population arrays by their enum value
+STRATEGY_VALUES = np.array([strat.value for strat in Strategy], dtype=np.int8)
+N_STRATEGY_VALUES = int(STRATEGY_VALUES.max()) + 1
+
+class PinheadArrayModel:
+    """
+    Same model as PinheadModel, but the population is kept as parallel NumPy arrays instead
+    of PinheadAgent and PinheadGroup objects. Agent i belongs to the group in slot group[i];
+    every group always holds exactly n agents, so a group that is replaced by a copy of a
+    conflict winner reuses the slot (and the agent rows) of the loser.
+    """
+    def __init__(
+                    self,
+                    n=100, # agents per group
+                    g=20, # number of groups
+                    distrib={"miscreant": 0.25, "deceiver": 0.25, "citizen": 0.25, "saint": 0.25, "civic": 0, "selfish": 0, "static": 0}, # percentage of each strategy
+                    mut_distrib=None,
+                    benefit=3.5, # benefit of cooperating
+                    cost=1, # cost of cooperating
+                    fitness=3, # base amt of fitness received by each agent
+                    p_mutation=0.01, # probability of an agent born switching strategy
+                    p_con=0.1, # probability of conflict
+                    p_mig=0.1, # probability of migration
+                    p_survive=0.8, # probability of surviving for agent of average fitness
+                    epsilon=0.05, # probability of going against strategy
+                    threshold=0.5, # level of cooperation necessary for citizens to cooperate
+                    saintly_group=False, # should it have a single group that has high numbers of cooperators
+                    years=1,
+                    rand=True, # should random functions be random
+                    print_stuff=False,
+                    log_basic=False,
+                    log_groups=False,
+                    log_columns=False, # also write the population-wide stats as a .npy file
+                    log_group_every=1, # keep the group stats every this many years
+                    log_ring_years=0, # years of group stats to write out when cooperation crosses a threshold
+                    until_high=True,
+                    until_low=False,
+                    learning_rate=0.5,
+                    present_weight=0.2,
+                    seed=None, # seed for the model's random generator
+                    detectors=None, # when to stop early, see pinhead_detectors. until_high and until_low by default
+                    debug_counts=False # recount the strategies every year to check strategy_totals
+                ):
+
+        param_dict = {
+            "n": n,
+            "g": g,
+            "distrib": distrib,
+            "benefit": benefit,
+            "cost": cost,
+            "fitness": fitness,
+            "p_mutation": p_mutation,
+            "p_con": p_con,
+            "p_mig": p_mig,
+            "p_survive": p_survive,
+            "epsilon": epsilon,
+            "threshold": threshold,
+            "saintly_group": saintly_group,
+            "years": years,
+            "rand": rand
+        }
+
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        # population
+        self.n = n
+        self.g = g
+        self.num_groups = g - saintly_group
+        self.num_indivs = n * self.num_groups
+
+        # cost and payoff
+        self.benefit = benefit
+        self.cost = cost
+        self.base_fitness = fitness
+        self.learning_rate = learning_rate
+        self.present_weight = present_weight
+
+        # current id number we're on
+        self.curr_group_id = 0
+        self.curr_indiv_id = 0
+
+        # probabilities of various events
+        self.p_mutation = p_mutation
+        self.p_con = p_con
+        self.p_mig = p_mig
+        self.p_survive = p_survive
+        self.epsilon = epsilon
+        self.threshold = threshold
+
+        self.schedule = ArrayActivationByLevel(self)
+        self.years = years
+
+        # logging
+        self.log_basic = log_basic
+        self.log_groups = log_groups
+        self.log_columns = log_columns
+        self.log_group_every = log_group_every
+        self.log_ring_years = log_ring_years
+
+        if self.log_basic:
+            if p_con != 1/13:
+                config = f'y{years}_n{n}_g{g}_c{cost}_b{benefit}_pc{p_con}_pm{p_mutation}_ps{p_mig}_r{fitness}_t{threshold}_distrib{distrib["civic"]}_{distrib["saint"]}'
+            else:
+                config = f'y{years}_n{n}_g{g}_c{cost}_b{benefit}_pm{p_mutation}_ps{p_mig}_r{fitness}_t{threshold}_distrib{distrib["civic"]}_{distrib["saint"]}'
+            self.initialize_logging(config, param_dict)
+
+        for strategy in ["saint", "citizen", "deceiver", "miscreant", "civic", "static", "selfish"]:
+            if strategy not in distrib:
+                distrib[strategy] = 0
+            if mut_distrib is not None and strategy not in mut_distrib:
+                mut_distrib[strategy] = 0
+
+        self.distrib = distrib
+        self.mut_distrib = self.distrib if mut_distrib is None else mut_distrib
+
+        mut_weights = np.array([self.mut_distrib[strat.name.lower()] for strat in Strategy], dtype=float)
+        self.mut_cum_weights = np.cumsum(mut_weights / mut_weights.sum()) if mut_weights.sum() > 0 else None
+
+        self.strategies = self.initialize_strategies(distrib, rand)
+        self.initialize_groups(saintly_group)
+        self.refresh_agent_total_counts()
+        self.debug_counts = debug_counts
+
+        self.print_stuff = print_stuff
+
+        # termination fields. if until_low, runs until cooperation gets low, and the opposite for until_high
+        self.until_low = until_low
+        self.until_high = until_high
+        self.can_terminate = False # set to true when ready to terminate
+        self.detectors = default_detectors(until_high, until_low) if detectors is None else list(detectors)
+        self.stopped_by = None # the detector that made the model ready to terminate
+
+    """
+    PinheadArrayModel Boolean Boolean -> NdArray
+    creates an array of strategy values from the distribution of probabilities given
+    **tested**
+    """
+    def initialize_strategies(self, distrib, rand):
+        weights = np.array([distrib[strat.name.lower()] for strat in Strategy], dtype=float)
+
+        if rand:
+            strategies = self.rng.choice(STRATEGY_VALUES, size=self.n * self.g, p=weights / weights.sum())
+        else:
+            counts = [round(weight * self.n) for weight in weights]
+            strategies = np.tile(np.repeat(STRATEGY_VALUES, counts), self.g)
+
+        return strategies.astype(np.int8)
+
+    """
+    PinheadArrayModel Boolean ->
+    allocates the population arrays and fills each group slot with n agents.
+    if saintly_group is true, the group in slot 0 is all citizens and saints
+    **tested**
+    """
+    def initialize_groups(self, saintly_group):
+        size = self.num_indivs
+
+        # per-agent arrays
+        self.group = np.repeat(np.arange(self.num_groups), self.n)
+        self.indiv_id = np.arange(size)
+        self.strategy = self.strategies[:size].copy()
+        self.fitness = np.full(size, self.base_fitness, dtype=float)
+        self.avg_fitness = self.fitness.copy()
+        self.pi = np.zeros(size)
+        self.avg_pi = np.zeros(size)
+        self.p_obs = np.zeros(size)
+        self.p_coop = np.zeros(size)
+        self.cooperates = np.zeros(size, dtype=bool)
+        self.default_choice = np.zeros(size, dtype=bool)
+        self.observed = np.zeros(size, dtype=bool)
+        self.is_new_agent = np.ones(size, dtype=bool)
+        self.migrated = np.zeros(size, dtype=bool)
+        self.migration_partner = -np.ones(size, dtype=np.int64)
+        self.s_prob = np.zeros(size)
+
+        if saintly_group:
+            self.strategy[0:self.n:2] = Strategy.CITIZEN.value
+            self.strategy[1:self.n:2] = Strategy.SAINT.value
+
+        # per-group arrays
+        self.group_id = np.arange(self.num_groups)
+        self.num_cooperated = np.zeros(self.num_groups, dtype=np.int64)
+        self.average_benefit = np.zeros(self.num_groups)
+        self.average_fitness = np.zeros(self.num_groups)
+        self.fought = np.zeros(self.num_groups, dtype=bool)
+        self.enemy = -np.ones(self.num_groups, dtype=np.int64) # id of the enemy group, -1 if none
+
+        self.curr_indiv_id = size
+        self.curr_group_id = self.num_groups
+
+    def initialize_logging(self, config, param_dict):
+        self.logger = Logger(self, config, param_dict, seed=self.seed, columns=self.log_columns,
+                             group_every=self.log_group_every, ring_years=self.log_ring_years)
+
+    def log_stats(self):
+        self.logger.log_array_stats()
+
+    """
+    PinheadArrayModel [Maybe NdArray] [Maybe NdArray] -> Generator
+    Returns the generator to use for a batch of draws with one number per agent (or per
+    agent in indivs, given as indices or a mask, or per group slot in groups), in order
+    """
+    def streams(self, indivs=None, groups=None):
+        return self.rng
+
+    """
+    PinheadArrayModel Boolean -> NdArray NdArray
+    Pairs up the group slots (or the agent rows) for conflicts (or migration)
+    """
+    def pair_groups(self, rand=True):
+        return shuffle_and_pair(self.num_groups, self.rng, rand)
+
+    def pair_indivs(self, rand=True):
+        return shuffle_and_pair(self.num_indivs, self.rng, rand)
+
+    """
+    PinheadArrayModel -> None
+    Runs the model until the last year, or until it is ready to terminate
+    """
+    def main(self):
+        while self.schedule.year < self.years:
+            self.loop()
+
+            if self.can_terminate:
+                break
+
+    def loop(self):
+        self.schedule.step()
+
+    """
+    PinheadArrayModel -> None
+    runs the detectors on the strategy counts and this year's cooperation, and makes the
+    model ready to terminate if one of them fires
+    **tested**
+    """
+    def check_detectors(self):
+        coop = self.num_cooperated.sum() / max(self.num_indivs, 1)
+
+        fired = run_detectors(self.detectors, self, self.agent_counts, coop)
+        if fired is not None:
+            self.stopped_by = fired
+            self.can_terminate = True
+
+        if self.debug_counts:
+            self.check_agent_counts()
+
+    """
+    PinheadArrayModel -> None
+    clears the flags that only last for a single year
+    """
+    def reset_agent_flags(self):
+        self.is_new_agent[:] = False
+        self.migrated[:] = False
+        self.migration_partner[:] = -1
+
+    """
+    PinheadArrayModel -> NdArray
+    Returns an (num_groups, n) array, the ith row of which holds the indices of the members
+    of the group in slot i
+    **tested**
+    """
+    def group_members(self):
+        return np.argsort(self.group, kind="stable").reshape(self.num_groups, self.n)
+
+    """
+    PinheadArrayModel -> None
+    Every agent decides whether to cooperate and whether it gets observed. Learners update
+    their pi first, based on the outcome of the previous year
+    **tested**
+    """
+    def make_choices(self):
+        self.p_obs = self.streams().random(self.num_indivs)
+        self.p_coop = self.choice_probabilities()
+        self.default_choice = self.p_coop > 0.5
+        self.cooperates = self.streams().random(self.num_indivs) < self.p_coop
+
+        # need the fitness from the last round to be preserved for the learning step
+        self.fitness[:] = self.base_fitness
+
+        self.observed = self.streams().random(self.num_indivs) < self.p_obs
+
+    """
+    PinheadArrayModel -> NdArray
+    Returns the probability that each agent cooperates, dispatching on strategy. Updates the
+    pi of civic and selfish learners on the way
+    **tested**
+    """
+    def choice_probabilities(self):
+        strategy = self.strategy
+        average_benefit = self.average_benefit[self.group]
+        prop_cooperators = self.num_cooperated[self.group] / self.n
+
+        civic = strategy == Strategy.CIVIC.value
+        selfish = strategy == Strategy.SELFISH.value
+        self.civic_learn(civic, prop_cooperators[civic])
+        self.selfish_learn(selfish)
+
+        return choice_probabilities(strategy, self.p_obs, self.pi, average_benefit, prop_cooperators, self.base_fitness, self.cost, self.threshold, self.epsilon)
+
+    """
+    PinheadArrayModel NdArray NdArray -> None
+    civic learners move their pi towards 1 if enough of their group cooperated, towards 0 otherwise
+    **tested**
+    """
+    def civic_learn(self, mask, prop_cooperators):
+        self.pi[mask], self.avg_pi[mask] = civic_update(self.pi[mask], self.avg_pi[mask], prop_cooperators, self.threshold, self.learning_rate, self.present_weight)
+
+    """
+    PinheadArrayModel NdArray -> None
+    selfish learners move their pi in the direction that has been increasing their fitness
+    **tested**
+    """
+    def selfish_learn(self, mask, rand=True):
+        noise = self.streams(indivs=mask).standard_normal(mask.sum()) if rand else None
+        self.pi[mask], self.avg_pi[mask] = selfish_update(self.pi[mask], self.avg_pi[mask], self.fitness[mask], self.avg_fitness[mask], self.present_weight, noise)
+
+    """
+    PinheadArrayModel -> None
+    Every group shares the benefits of cooperation among its agents except those who were
+    caught defecting
+    **tested**
+    """
+    def distribute(self):
+        self.num_cooperated, _, self.average_benefit, fitness_delta = group_payoffs(
+            self.group, self.cooperates, self.observed, self.num_groups, self.benefit, self.cost)
+
+        self.fitness += fitness_delta
+        self.avg_fitness = 0.8 * self.avg_fitness + 0.2 * self.fitness
+        self.average_fitness = self.base_fitness + self.num_cooperated * (self.benefit - self.cost) / self.n
+
+    """
+    PinheadArrayModel -> None
+    In every group, agents survive with probability proportional to their fitness, and
+    the dead are replaced by the offspring of survivors chosen in proportion to fitness
+    **tested**
+    """
+    def reproduce(self):
+        survives, self.s_prob = select_survivors(self.fitness, self.group, self.num_groups, self.p_survive, self.streams())
+        dead = np.flatnonzero(~survives)
+        parents = select_parents(self.fitness, self.group, survives, self.group[dead], self.num_groups, self.streams(indivs=dead))
+
+        strategy = self.strategy[parents]
+        if self.mut_cum_weights is not None:
+            mutate = self.streams(indivs=dead).random(len(dead)) < self.p_mutation
+            picks = np.searchsorted(self.mut_cum_weights, self.streams(indivs=dead[mutate]).random(mutate.sum()), side="right")
+            strategy[mutate] = STRATEGY_VALUES[np.minimum(picks, len(STRATEGY_VALUES) - 1)]
+        pi = self.streams(indivs=dead).normal(loc=self.pi[parents], scale=0.05)
+
+        self.add_indivs(dead, strategy, self.fitness[parents], pi)
+
+    """
+    PinheadArrayModel NdArray NdArray NdArray NdArray -> None
+    writes newborn agents into the rows given by slots, keeping their current group
+    """
+    def add_indivs(self, slots, strategy, fitness, pi):
+        self.strategy_totals += np.bincount(strategy, minlength=N_STRATEGY_VALUES) - np.bincount(self.strategy[slots], minlength=N_STRATEGY_VALUES)
+        self.strategy[slots] = strategy
+        self.fitness[slots] = fitness
+        self.avg_fitness[slots] = fitness
+        self.pi[slots] = pi
+        self.avg_pi[slots] = pi
+        self.p_obs[slots] = 0
+        self.p_coop[slots] = 0
+        self.cooperates[slots] = False
+        self.default_choice[slots] = False
+        self.observed[slots] = False
+        self.is_new_agent[slots] = True
+        self.migrated[slots] = False
+
+        self.indiv_id[slots] = np.arange(self.curr_indiv_id, self.curr_indiv_id + len(slots))
+        self.curr_indiv_id += len(slots)
+
+    """
+    PinheadArrayModel -> None
+    Pairs all groups, has them fight with probability p_con, and replaces the loser with the
+    winner
+    **tested**
+    """
+    def fight_groups(self, rand=True):
+        self.fought[:] = False
+        self.enemy[:] = -1
+
+        groups1, groups2 = self.pair_groups(rand)
+        fight = self.streams(groups=groups1).random(len(groups1)) < self.p_con if rand else np.ones(len(groups1), dtype=bool)
+        groups1 = groups1[fight]
+        groups2 = groups2[fight]
+
+        w = conflict_outcomes(self.average_fitness[groups1], self.average_fitness[groups2], self.streams(groups=groups1) if rand else None)
+
+        winners = np.where(w, groups1, groups2)
+        losers = np.where(w, groups2, groups1)
+
+        # store whether groups fought for datacollector
+        self.fought[winners] = True
+        self.enemy[winners] = self.group_id[losers]
+        self.replace_groups(winners, losers)
+
+    """
+    PinheadArrayModel NdArray NdArray -> None
+    Replaces each loser with a new group with exactly the same agent strategy
+    distribution as its winner. The new group takes over the slot of the loser
+    **tested**
+    """
+    def replace_groups(self, winners, losers):
+        members = self.group_members()
+        sources = members[winners].ravel()
+        slots = members[losers].ravel()
+
+        self.add_indivs(slots, self.strategy[sources], self.fitness[sources], np.zeros(len(slots)))
+
+        self.group_id[losers] = self.new_group_ids(losers)
+        self.num_cooperated[losers] = self.num_cooperated[winners]
+        self.average_benefit[losers] = self.average_benefit[winners]
+        self.average_fitness[losers] = 0
+
+    """
+    PinheadArrayModel NdArray -> NdArray
+    Hands out ids for the new groups that take over the slots in losers
+    """
+    def new_group_ids(self, losers):
+        ids = np.arange(self.curr_group_id, self.curr_group_id + len(losers))
+        self.curr_group_id += len(losers)
+        return ids
+
+    """
+    PinheadArrayModel -> None
+    Pairs individuals randomly, and then with probability p, switches their group
+    membership
+    **tested**
+    """
+    def recombine_groups(self, rand=True):
+        indivs1, indivs2 = self.pair_indivs(rand)
+
+        self.migration_partner[indivs1] = self.indiv_id[indivs2]
+        self.migration_partner[indivs2] = self.indiv_id[indivs1]
+
+        # if they're already in the same group, they don't move by swapping
+        move = self.group[indivs1] != self.group[indivs2]
+        if rand:
+            move &= self.streams(indivs=indivs1).random(len(indivs1)) < self.p_mig
+        indivs1 = indivs1[move]
+        indivs2 = indivs2[move]
+
+        self.group[indivs1], self.group[indivs2] = self.group[indivs2], self.group[indivs1]
+        self.is_new_agent[indivs1] = True
+        self.is_new_agent[indivs2] = True
+        self.migrated[indivs1] = True
+        self.migrated[indivs2] = True
+
+    """
+    PinheadArrayModel -> NdArray
+    Returns a (num_groups, N_STRATEGY_VALUES) array with the number of agents of each
+    strategy in each group, indexed by strategy value
+    **tested**
+    """
+    def group_strategy_counts(self):
+        return segment_counts(self.group, self.strategy, self.num_groups, N_STRATEGY_VALUES)
+
+    """
+    PinheadArrayModel -> Dictionary
+    the number of agents of each strategy, read from strategy_totals, which add_indivs keeps
+    up to date as agents are replaced
+    """
+    @property
+    def agent_counts(self):
+        return {strat: int(self.strategy_totals[strat.value]) for strat in Strategy}
+
+    def refresh_agent_total_counts(self):
+        self.strategy_totals = np.bincount(self.strategy, minlength=N_STRATEGY_VALUES)
+
+    """
+    PinheadArrayModel -> None
+    Recounts the strategies of every agent, and raises an exception if strategy_totals has
+    drifted from the recount
+    **tested**
+    """
+    def check_agent_counts(self):
+        counts = np.bincount(self.strategy, minlength=N_STRATEGY_VALUES)
+        if (counts != self.strategy_totals).any():
+            raise Exception(f"strategy totals are {self.strategy_totals.tolist()}, recount gives {counts.tolist()}")
+
+    def print_overall_composition(self):
+        self.refresh_agent_total_counts()
+
+        print("Overall:")
+        for strat in Strategy:
+            print(strat.name.lower() + ":", self.agent_counts[strat], ",", self.agent_counts[strat]/self.num_indivs)
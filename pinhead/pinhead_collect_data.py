@@ -1,6 +1,6 @@
 import pandas as pd
 # from simulation import EvoModel
-from pinhead_model import PinheadModel
+from pinhead_sweep import expand_grid, run_sweep
 
 from datetime import datetime
 import os
@@ -26,37 +26,22 @@ center = {
 # next up, see how low the proliferation goes for 
 distribs = [{"miscreant": 0, "deceiver": 0, "citizen": 0, "saint": 0.02, "civic": 0, "selfish": 0.49, "static": 0.49}]
 
-for benefit in [3.5]:
-    for mig in [0.6]:
-        for distrib in distribs:
-            for i in range(6):
+def mut_distrib_for(distrib):
+    if distrib["civic"] == 0:
+        return {"miscreant": 0, "deceiver": 0, "citizen": 0, "saint": 1/3, "civic": 0, "selfish": 1/3, "static": 1/3}
+    elif distrib["saint"] == 0:
+        return {"miscreant": 0, "deceiver": 0, "citizen": 0, "saint": 0, "civic": 1/3, "selfish": 1/3, "static": 1/3}
 
-                if distrib["civic"] == 0:
-                    mut_distrib = {"miscreant": 0, "deceiver": 0, "citizen": 0, "saint": 1/3, "civic": 0, "selfish": 1/3, "static": 1/3}
-                elif distrib["saint"] == 0:
-                    mut_distrib = {"miscreant": 0, "deceiver": 0, "citizen": 0, "saint": 0, "civic": 1/3, "selfish": 1/3, "static": 1/3}
-                
-                print(benefit, "\n distrib", distrib, "\n mut", mut_distrib, i)
-                
-                pm = PinheadModel(
-                    n=center["n"],
-                    g=center["g"],
-                    distrib=distrib,
-                    mut_distrib=mut_distrib,
-                    benefit=benefit,
-                    cost=center["cost"],
-                    fitness=center["fitness"],
-                    p_mutation=center["p_mutation"],
-                    p_con=center["p_con"],
-                    p_mig=mig,
-                    p_survive=center["p_survive"],
-                    epsilon=center["epsilon"],
-                    saintly_group=center["saintly_group"],
-                    years=center["years"],
-                    rand=center["rand"],
-                    print_stuff=True,
-                    log_basic=True,
-                    log_groups=False
-                )
+# every cell of the grid runs 6 replicates, each with its own seed, batched into ensembles
+# spread over the cores. Runs that already finished are skipped, so the sweep can be started
+# again after an interruption
+if __name__ == "__main__":
+    cells = expand_grid(center, {
+        "benefit": [3.5],
+        "p_mig": [0.6],
+        ("distrib", "mut_distrib"): [(distrib, mut_distrib_for(distrib)) for distrib in distribs]
+    })
+    entries = run_sweep(cells, replicates=6, seed=0, manifest_path=f'data/manifest_{datetime.now().strftime("%m%d_%H%M%S")}.jsonl')
 
-                pm.main()
\ No newline at end of file
+    for entry in entries:
+        print(entry["params"]["benefit"], entry["params"]["p_mig"], entry["seed"][2], entry.get("stats"), entry.get("error"))
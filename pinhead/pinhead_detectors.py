@@ -0,0 +1,79 @@
+from collections import deque
+
+import numpy as np
+
+# A detector is called once a year, after the groups have shared out their benefits and
+# before the year is logged, as detector(model, counts, coop): counts maps each Strategy to
+# its number of agents and coop is the fraction of all agents that cooperated. It returns
+# True once the run can stop. Any function with that signature can be used as a detector
+
+class CoopYears:
+    """
+    Stops the run once total cooperation has been above `above` (or below `below`) for more
+    than `years` years, counted over the whole run. This is what until_high and until_low
+    have always done
+    """
+    def __init__(self, above=None, below=None, years=1000):
+        self.above = above
+        self.below = below
+        self.years = years
+        self.counter = 0
+
+    def __call__(self, model, counts, coop):
+        if self.above is not None:
+            self.counter += (coop > self.above)
+        if self.below is not None:
+            self.counter += (coop < self.below)
+        return self.counter > self.years
+
+class Fixation:
+    """
+    Stops the run once a single strategy is left and nothing can mutate into another one
+    """
+    def __call__(self, model, counts, coop):
+        return model.p_mutation == 0 and sum(count > 0 for count in counts.values()) == 1
+
+class Extinction:
+    """
+    Stops the run once there are no agents left
+    """
+    def __call__(self, model, counts, coop):
+        return sum(counts.values()) == 0
+
+class Stationary:
+    """
+    Stops the run once total cooperation has stayed within `tolerance` of itself for the
+    last `window` years
+    """
+    def __init__(self, window=500, tolerance=0.01):
+        self.tolerance = tolerance
+        self.history = deque(maxlen=window)
+
+    def __call__(self, model, counts, coop):
+        self.history.append(coop)
+        return len(self.history) == self.history.maxlen and np.ptp(self.history) <= self.tolerance
+
+"""
+[List-of Detector] Model Dictionary Float -> Maybe Detector
+calls every detector, so the ones that keep count see every year, and returns the first
+one that fired
+"""
+def run_detectors(detectors, model, counts, coop):
+    fired = None
+    for detector in detectors:
+        if detector(model, counts, coop) and fired is None:
+            fired = detector
+    return fired
+
+"""
+Boolean Boolean -> [List-of Detector]
+the detectors a model gets when it isn't given any, which stop it the way until_high and
+until_low always have
+"""
+def default_detectors(until_high, until_low):
+    detectors = []
+    if until_high:
+        detectors.append(CoopYears(above=0.9))
+    if until_low:
+        detectors.append(CoopYears(below=0.25))
+    return detectors
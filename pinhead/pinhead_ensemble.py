@@ -0,0 +1,267 @@
+from pinhead_agent import Strategy
+from pinhead_array_model import PinheadArrayModel, STRATEGY_VALUES, N_STRATEGY_VALUES
+from pinhead_logging import Logger
+from pinhead_detectors import run_detectors
+from pinhead_kernels import segment_offsets, segment_counts
+
+import copy
+import numpy as np
+
+# arrays with one entry per agent row and per group slot, which have to be cut down when a
+# replicate finishes
+AGENT_ARRAYS = ["group", "indiv_id", "strategy", "fitness", "avg_fitness", "pi", "avg_pi", "p_obs", "p_coop", "cooperates",
+                "default_choice", "observed", "is_new_agent", "migrated", "migration_partner", "s_prob"]
+GROUP_ARRAYS = ["group_id", "num_cooperated", "average_benefit", "average_fitness", "fought", "enemy"]
+
+class PinheadEnsemble(PinheadArrayModel):
+    """
+    Runs independent replicates of a PinheadArrayModel side by side. The population arrays
+    hold every replicate back to back, so reshaping them to (replicates, -1) gives a leading
+    replicate axis: replicate r owns agent rows r*N..(r+1)*N - 1 and group slots
+    r*G..(r+1)*G - 1, and group[i] is a slot of the replicate that owns row i. The segmented
+    kernels then handle all replicates in one call, while pairing for conflicts and
+    migration stays inside each replicate.
+
+    Each replicate draws from its own generator, spawned from seed unless replicate_seeds
+    gives a seed for each one, and has its own logger and output file. A replicate that is
+    ready to terminate is written out and removed from the arrays, and the rest carry on.
+    """
+    def __init__(self, replicates=6, seed=None, replicate_seeds=None, **params):
+        self.replicates = replicates
+        if replicate_seeds is None:
+            self.rngs = [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(replicates)]
+            self.replicate_seeds = [[seed, r] for r in range(replicates)]
+        else:
+            self.rngs = [np.random.default_rng(replicate_seed) for replicate_seed in replicate_seeds]
+            self.replicate_seeds = list(replicate_seeds)
+        self.views = [ReplicateView(self, r) for r in range(replicates)]
+        self.loggers = []
+        super().__init__(seed=seed, **params)
+        self.replicate_detectors = [copy.deepcopy(self.detectors) for r in range(replicates)]
+
+    """
+    PinheadEnsemble Boolean Boolean -> NdArray
+    creates a (replicates, n * g) array of strategy values, one row per replicate
+    **tested**
+    """
+    def initialize_strategies(self, distrib, rand):
+        weights = np.array([distrib[strat.name.lower()] for strat in Strategy], dtype=float)
+
+        if rand:
+            strategies = np.stack([rng.choice(STRATEGY_VALUES, size=self.n * self.g, p=weights / weights.sum()) for rng in self.rngs])
+        else:
+            counts = [round(weight * self.n) for weight in weights]
+            strategies = np.tile(np.repeat(STRATEGY_VALUES, counts), (self.replicates, self.g))
+
+        return strategies.astype(np.int8)
+
+    """
+    PinheadEnsemble Boolean ->
+    allocates the population arrays for every replicate. If saintly_group is true, slot 0
+    of every replicate is all citizens and saints
+    **tested**
+    """
+    def initialize_groups(self, saintly_group):
+        self.groups_per_replicate = self.g - saintly_group
+        self.indivs_per_replicate = self.n * self.groups_per_replicate
+        self.num_groups = self.replicates * self.groups_per_replicate
+        self.num_indivs = self.replicates * self.indivs_per_replicate
+
+        strategies = self.strategies
+        self.strategies = strategies[:, :self.indivs_per_replicate].ravel()
+        super().initialize_groups(False)
+        self.strategies = strategies
+
+        if saintly_group:
+            strategy = self.strategy.reshape(self.replicates, -1)
+            strategy[:, 0:self.n:2] = Strategy.CITIZEN.value
+            strategy[:, 1:self.n:2] = Strategy.SAINT.value
+
+        # group ids are counted per replicate, so every output file looks like a single run
+        self.group_id = np.tile(np.arange(self.groups_per_replicate), self.replicates)
+        self.curr_group_id = np.full(self.replicates, self.groups_per_replicate)
+
+    def initialize_logging(self, config, param_dict):
+        for r, view in enumerate(self.views):
+            self.loggers.append(Logger(view, config, param_dict, seed=self.replicate_seeds[r],
+                                       columns=self.log_columns, group_every=self.log_group_every, ring_years=self.log_ring_years))
+
+    """
+    PinheadEnsemble -> None
+    runs each replicate's own copy of the detectors on that replicate's counts and
+    cooperation, and makes its view ready to terminate if one of them fires
+    **tested**
+    """
+    def check_detectors(self):
+        self.replicate_counts = self.replicate_strategy_counts()
+        counts = self.replicate_counts.tolist()
+        coop = (self.num_cooperated.reshape(self.replicates, -1).sum(axis=1) / self.indivs_per_replicate).tolist()
+
+        for view, detectors, replicate_counts, replicate_coop in zip(self.views, self.replicate_detectors, counts, coop):
+            fired = run_detectors(detectors, view, {strat: replicate_counts[strat.value] for strat in Strategy}, replicate_coop)
+            if fired is not None:
+                view.stopped_by = fired
+                view.can_terminate = True
+
+    def log_stats(self):
+        for logger in self.loggers:
+            logger.log_array_stats()
+
+    """
+    PinheadEnsemble [Maybe NdArray] [Maybe NdArray] -> ReplicateStreams
+    Returns a generator that draws the numbers of each replicate from that replicate's own
+    generator. indivs (indices or a mask) and groups must be in increasing replicate order
+    """
+    def streams(self, indivs=None, groups=None):
+        if groups is not None:
+            counts = np.bincount(groups // self.groups_per_replicate, minlength=self.replicates)
+        elif indivs is None:
+            counts = np.full(self.replicates, self.indivs_per_replicate)
+        elif indivs.dtype == bool:
+            counts = indivs.reshape(self.replicates, -1).sum(axis=1)
+        else:
+            counts = np.bincount(indivs // self.indivs_per_replicate, minlength=self.replicates)
+
+        return ReplicateStreams(self.rngs, counts)
+
+    """
+    PinheadEnsemble Boolean -> NdArray NdArray
+    Pairs up the group slots (or agent rows) of each replicate among themselves
+    """
+    def pair_groups(self, rand=True):
+        return self.pair_within_replicates(self.groups_per_replicate, rand)
+
+    def pair_indivs(self, rand=True):
+        return self.pair_within_replicates(self.indivs_per_replicate, rand)
+
+    def pair_within_replicates(self, size, rand=True):
+        midpoint = size // 2
+        decks = np.stack([rng.permutation(size) if rand else np.arange(size) for rng in self.rngs])
+        decks += (np.arange(self.replicates) * size)[:, None]
+        return decks[:, :midpoint].ravel(), decks[:, midpoint:2 * midpoint].ravel()
+
+    """
+    PinheadEnsemble NdArray -> NdArray
+    Hands out ids for the new groups in losers from the counter of their own replicate.
+    losers must be in increasing replicate order
+    **tested**
+    """
+    def new_group_ids(self, losers):
+        replicate = losers // self.groups_per_replicate
+        offsets = segment_offsets(replicate, self.replicates)
+        ids = self.curr_group_id[replicate] + np.arange(len(losers)) - offsets[replicate]
+        self.curr_group_id = self.curr_group_id + np.diff(offsets)
+        return ids
+
+    """
+    PinheadEnsemble -> None
+    Runs every replicate until the last year, or until it is ready to terminate
+    """
+    def main(self):
+        while self.schedule.year < self.years and self.replicates > 0:
+            self.loop()
+
+            finished = np.array([view.can_terminate for view in self.views], dtype=bool)
+            if finished.any():
+                self.drop_replicates(~finished)
+
+    """
+    PinheadEnsemble NdArray ->
+    removes the replicates not in keep from the population arrays, along with their
+    generators, views and loggers
+    **tested**
+    """
+    def drop_replicates(self, keep):
+        # group slots are stored relative to the first slot of the replicate
+        replicate_start = np.repeat(np.arange(self.replicates) * self.groups_per_replicate, self.indivs_per_replicate)
+        self.group = self.group - replicate_start
+
+        for name in AGENT_ARRAYS:
+            array = getattr(self, name)
+            setattr(self, name, array.reshape(self.replicates, -1)[keep].ravel())
+        for name in GROUP_ARRAYS:
+            array = getattr(self, name)
+            setattr(self, name, array.reshape(self.replicates, -1)[keep].ravel())
+
+        self.curr_group_id = self.curr_group_id[keep]
+        self.rngs = [rng for rng, kept in zip(self.rngs, keep) if kept]
+        self.views = [view for view, kept in zip(self.views, keep) if kept]
+        self.replicate_detectors = [detectors for detectors, kept in zip(self.replicate_detectors, keep) if kept]
+        self.loggers = [logger for logger, kept in zip(self.loggers, keep) if kept]
+        for r, view in enumerate(self.views):
+            view.replicate = r
+
+        self.replicates = int(keep.sum())
+        self.num_groups = self.replicates * self.groups_per_replicate
+        self.num_indivs = self.replicates * self.indivs_per_replicate
+        self.group = self.group + np.repeat(np.arange(self.replicates) * self.groups_per_replicate, self.indivs_per_replicate)
+        self.refresh_agent_total_counts()
+
+    """
+    PinheadEnsemble -> NdArray
+    Returns a (replicates, N_STRATEGY_VALUES) array with the number of agents of each
+    strategy in each replicate, indexed by strategy value
+    **tested**
+    """
+    def replicate_strategy_counts(self):
+        replicate = np.arange(self.num_indivs) // self.indivs_per_replicate
+        return segment_counts(replicate, self.strategy, self.replicates, N_STRATEGY_VALUES)
+
+
+class ReplicateStreams:
+    """
+    Stands in for a Generator in the kernels. A batch of draws is split into consecutive
+    runs of counts[r] numbers, and run r is drawn from the generator of replicate r
+    """
+    def __init__(self, rngs, counts):
+        self.rngs = rngs
+        self.counts = counts.tolist()
+
+    def draw(self, method, size):
+        if size is not None and np.prod(size) != sum(self.counts):
+            raise ValueError(f"expected {sum(self.counts)} draws, got {size}")
+        return np.concatenate([getattr(rng, method)(size=count) for rng, count in zip(self.rngs, self.counts)])
+
+    def random(self, size=None):
+        return self.draw("random", size)
+
+    def gumbel(self, size=None):
+        return self.draw("gumbel", size)
+
+    def standard_normal(self, size=None):
+        return self.draw("standard_normal", size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        return loc + scale * self.draw("standard_normal", size if size is not None else np.shape(loc) or None)
+
+
+class ReplicateView:
+    """
+    Looks like a PinheadArrayModel holding a single replicate of an ensemble, for its
+    Logger. Every array is sliced out of the ensemble when it is read, so the view stays
+    current as the ensemble replaces its arrays
+    """
+    def __init__(self, ensemble, replicate):
+        self.ensemble = ensemble
+        self.replicate = replicate
+        self.can_terminate = False
+        self.stopped_by = None
+
+    def __getattr__(self, name):
+        ensemble = self.ensemble
+        if name in AGENT_ARRAYS:
+            size = ensemble.indivs_per_replicate
+            rows = getattr(ensemble, name)[self.replicate * size:(self.replicate + 1) * size]
+            return rows - self.replicate * ensemble.groups_per_replicate if name == "group" else rows
+        if name in GROUP_ARRAYS:
+            size = ensemble.groups_per_replicate
+            return getattr(ensemble, name)[self.replicate * size:(self.replicate + 1) * size]
+        if name == "num_groups":
+            return ensemble.groups_per_replicate
+        if name == "num_indivs":
+            return ensemble.indivs_per_replicate
+        if name == "agent_counts":
+            # counted for the detectors earlier in the year
+            counts = ensemble.replicate_counts[self.replicate].tolist()
+            return {strat: counts[strat.value] for strat in Strategy}
+        return getattr(ensemble, name)
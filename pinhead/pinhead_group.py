@@ -1,22 +1,26 @@
-from mesa import Agent
-import copy
-
 from pinhead_agent import PinheadAgent, Strategy
 import random
 import numpy as np
 
 import math
 
-class PinheadGroup(Agent):
+class PinheadGroup:
+    # fixed attribute layout, so groups carry no __dict__
+    __slots__ = (
+        "id", "model", "num_cooperated", "num_seen_cooperating", "average_benefit", "average_fitness",
+        "agent_counts", "fought", "enemy"
+    )
+
     def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
+        self.unique_id = unique_id
+        self.model = model
 
         self.num_cooperated = 0
         self.num_seen_cooperating = 0
         self.average_benefit = 0
         self.average_fitness = 0
 
-        self.model.curr_group_id = int(unique_id[1:]) + 1
+        self.model.curr_group_id = max(self.model.curr_group_id, self.id + 1)
         self.model.group_table[self] = []
         # self.model.schedule.add(self)
 
@@ -25,6 +29,22 @@ class PinheadGroup(Agent):
         self.fought = False
         self.enemy = None
     
+    """
+    PinheadGroup -> String
+    label of the group, only built when the logger or a print helper asks for it
+    """
+    @property
+    def unique_id(self):
+        return "g" + str(self.id)
+
+    @unique_id.setter
+    def unique_id(self, unique_id):
+        self.id = int(unique_id[1:]) if isinstance(unique_id, str) else int(unique_id)
+
+    @property
+    def random(self):
+        return self.model.random
+
     def step_distrib(self):
         n_indivs = self.model.n
         self.cooperation()
@@ -68,7 +88,9 @@ class PinheadGroup(Agent):
     """
     PinheadGroup ->
     Some agents are chosen to survive, and the rest die off. Agents survive according to 
-    the survival rate, and are chosen to survive with a probability proportional to their fitness
+    the survival rate, and are chosen to survive with a probability proportional to their fitness.
+    The survivors are the agents with the largest log(s_prob) + Gumbel noise, which is the
+    same as drawing them one at a time without replacement
     **tested**
     """
     def death(self):
@@ -84,7 +106,9 @@ class PinheadGroup(Agent):
             s_probs.append(indiv.s_prob)
 
         # decide whether each agent dies or survives
-        surviving_indices = set(np.random.choice(range(n), size=math.floor(n*self.model.p_survive), replace=False, p=s_probs))
+        with np.errstate(divide="ignore"):
+            keys = np.log(s_probs) + np.random.gumbel(size=n)
+        surviving_indices = set(np.argsort(-keys)[:math.floor(n*self.model.p_survive)].tolist())
 
         n_deaths = 0
         for i, indiv in enumerate(indivs):
@@ -138,28 +162,40 @@ class PinheadGroup(Agent):
 
             new_pi = np.random.normal(loc=reproducing_indiv.pi, scale=0.05)
             
-            new_indiv = PinheadAgent("i" + str(self.model.curr_indiv_id), self.model, strategy, self, reproducing_indiv.fitness, pi=new_pi)
+            new_indiv = PinheadAgent(self.model.reserve_indiv_ids(), self.model, strategy, self, reproducing_indiv.fitness, pi=new_pi)
     
+    """
+    PinheadGroup ->
+    recounts the strategies of the group's members, and moves the model-wide counts by the
+    difference
+    """
     def initialize_strategy_counts(self):
+        old_counts = self.agent_counts
         self.agent_counts = {strat: 0 for strat in Strategy}
 
         for indiv in self.model.group_table[self]:
             self.agent_counts[indiv.strategy] += 1
 
-    def inc_strategy_count(self, strategy):
-        self.agent_counts[strategy] += 1
+        for strat in Strategy:
+            self.model.agent_counts[strat] += self.agent_counts[strat] - old_counts[strat]
+
+    # the model-wide counts are kept in step with every change to a group's counts
+    def inc_strategy_count(self, strategy, count=1):
+        self.agent_counts[strategy] += count
+        self.model.agent_counts[strategy] += count
 
-    def dec_strategy_count(self, strategy):
-        self.agent_counts[strategy] -= 1
+    def dec_strategy_count(self, strategy, count=1):
+        self.agent_counts[strategy] -= count
+        self.model.agent_counts[strategy] -= count
     
     def print_agents(self):
         indivs = self.model.group_table[self]
         print([indiv.unique_id for indiv in indivs])
 
     def kill_group(self):
-        dead_indivs = copy.copy(self.model.group_table[self])
-
-        for dead_indiv in dead_indivs:
-            dead_indiv.kill_indiv(remove_from_group=False) # group is dying anyway
+        # the group is dying anyway, so its agents only have to leave the indiv table
+        for dead_indiv in self.model.group_table.pop(self):
+            self.model.indiv_table.pop(dead_indiv)
 
-        self.model.group_table.pop(self)
\ No newline at end of file
+        for strat in Strategy:
+            self.model.agent_counts[strat] -= self.agent_counts[strat]
\ No newline at end of file
@@ -0,0 +1,185 @@
+import numpy as np
+
+from pinhead_agent import Strategy
+
+# Whole-population routines for the array-backed pinhead engine. Every routine works on
+# flat per-agent arrays plus a group index array (group[i] is the slot of the group that
+# agent i belongs to), so that one call handles every group at once.
+
+"""
+NdArray Int -> NdArray
+offsets[k]:offsets[k + 1] is the range of group k in an array sorted by group
+**tested**
+"""
+def segment_offsets(group, n_groups):
+    offsets = np.zeros(n_groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(group, minlength=n_groups), out=offsets[1:])
+    return offsets
+
+"""
+NdArray NdArray Int Int -> NdArray
+Returns an (n_groups, n_values) array whose [k, v] entry is the number of agents in group
+k with value v
+**tested**
+"""
+def segment_counts(group, values, n_groups, n_values):
+    counts = np.bincount(group * n_values + values, minlength=n_groups * n_values)
+    return counts.reshape(n_groups, n_values)
+
+"""
+NdArray NdArray NdArray Int Float Float -> NdArray NdArray NdArray NdArray
+Shares the benefits of cooperation among every agent of every group except those caught
+defecting. Returns the number of cooperators, the number of rewarded agents and the
+average benefit of each group, along with the change in fitness of each agent
+**tested**
+"""
+def group_payoffs(group, cooperates, observed, n_groups, benefit, cost):
+    rewarded = cooperates | ~observed
+    num_cooperated = np.bincount(group[cooperates], minlength=n_groups)
+    num_rewarded = np.bincount(group[rewarded], minlength=n_groups)
+
+    average_benefit = np.zeros(n_groups)
+    np.divide(num_cooperated * benefit, num_rewarded, out=average_benefit, where=num_rewarded > 0)
+
+    fitness_delta = np.where(rewarded, average_benefit[group], 0.0) - cost * cooperates
+    return num_cooperated, num_rewarded, average_benefit, fitness_delta
+
+"""
+NdArray NdArray NdArray NdArray NdArray Float Float Float Float -> NdArray
+Returns the probability that each agent cooperates, from masks over its strategy value.
+Saints cooperate, deceivers cooperate if the EV of cooperating is at least that of
+defecting, citizens cooperate if enough of their group cooperated or else act as
+deceivers, and learners cooperate if p_obs * average_benefit >= cost * (1 - pi).
+Agents go against their choice with probability epsilon
+**tested**
+"""
+def choice_probabilities(strategy, p_obs, pi, average_benefit, prop_cooperators, fitness, cost, threshold, epsilon):
+    learner = (strategy == Strategy.CIVIC.value) | (strategy == Strategy.SELFISH.value) | (strategy == Strategy.STATIC.value)
+
+    ev_coop = fitness + average_benefit - cost
+    ev_def = p_obs * fitness + (1 - p_obs) * (fitness + average_benefit)
+    deceiver_coop = ev_coop >= ev_def
+
+    cooperates = (strategy == Strategy.SAINT.value) \
+        | ((strategy == Strategy.DECEIVER.value) & deceiver_coop) \
+        | ((strategy == Strategy.CITIZEN.value) & ((prop_cooperators >= threshold) | deceiver_coop)) \
+        | (learner & (p_obs * average_benefit >= cost * (1 - pi)))
+
+    return np.where(cooperates, 1 - epsilon, epsilon)
+
+"""
+NdArray NdArray NdArray Float Float Float -> NdArray NdArray
+Civic learners move their pi towards 1 if enough of their group cooperated, towards 0
+otherwise. Returns the new pi and avg_pi of every civic learner
+**tested**
+"""
+def civic_update(pi, avg_pi, prop_cooperators, threshold, learning_rate, present_weight):
+    pi = (1 - learning_rate) * pi + learning_rate * (prop_cooperators >= threshold)
+    avg_pi = (1 - present_weight) * avg_pi + present_weight * pi
+    return pi, avg_pi
+
+"""
+NdArray NdArray NdArray NdArray Float [Maybe NdArray] -> NdArray NdArray
+Selfish learners move their pi in the direction that has been increasing their fitness,
+by (pi - avg_pi) * (fitness - avg_fitness) / fitness. If noise holds a standard normal
+draw per learner, each step is perturbed by noise * |step| / 2. Returns the new pi and
+avg_pi of every selfish learner
+**tested**
+"""
+def selfish_update(pi, avg_pi, fitness, avg_fitness, present_weight, noise=None):
+    vec = np.zeros(len(pi))
+    np.divide((pi - avg_pi) * (fitness - avg_fitness), fitness, out=vec, where=fitness != 0)
+
+    if noise is not None:
+        vec += np.abs(vec) / 2 * noise
+
+    pi = pi + vec
+    avg_pi = (1 - present_weight) * avg_pi + present_weight * pi
+    return pi, avg_pi
+
+"""
+NdArray NdArray Int Float Generator -> NdArray NdArray
+Chooses floor(size * p_survive) survivors in every group without replacement, with
+probability proportional to fitness. Returns a mask of survivors and the survival weight
+of each agent. Uses Gumbel top-k keys sorted within each group, which gives the same
+distribution as drawing survivors one at a time
+**tested**
+"""
+def select_survivors(fitness, group, n_groups, p_survive, rng):
+    sizes = np.bincount(group, minlength=n_groups)
+    totals = np.bincount(group, weights=fitness, minlength=n_groups)
+    n_survivors = np.floor(sizes * p_survive).astype(np.int64)
+
+    group_totals = totals[group]
+    s_prob = np.empty(len(fitness))
+    np.divide(fitness, group_totals, out=s_prob, where=group_totals > 0)
+    s_prob[group_totals <= 0] = 1 / sizes[group[group_totals <= 0]]
+
+    with np.errstate(divide="ignore"):
+        keys = np.log(s_prob) + rng.gumbel(size=len(fitness))
+
+    # sort by descending key, then stably by group; the first n_survivors of each group survive
+    order = np.argsort(-keys)
+    order = order[np.argsort(group[order], kind="stable")]
+    offsets = segment_offsets(group, n_groups)
+    sorted_group = group[order]
+    rank = np.arange(len(order)) - offsets[sorted_group]
+
+    survives = np.zeros(len(fitness), dtype=bool)
+    survives[order] = rank < n_survivors[sorted_group]
+    return survives, s_prob
+
+"""
+NdArray NdArray NdArray NdArray Int Generator -> NdArray
+For each group in child_groups, picks a parent among the survivors of that group with
+probability proportional to fitness (uniformly if they all have zero fitness). Works by
+searching one cumulative weight array that holds every group back to back
+**tested**
+"""
+def select_parents(fitness, group, survives, child_groups, n_groups, rng):
+    survivors = np.flatnonzero(survives)
+    order = survivors[np.argsort(group[survivors], kind="stable")]
+    weights = fitness[order]
+
+    offsets = segment_offsets(group[order], n_groups)
+    starts = offsets[:-1][child_groups]
+    ends = offsets[1:][child_groups]
+
+    cum_weights = np.concatenate(([0.0], np.cumsum(weights)))
+    base = cum_weights[starts]
+    totals = cum_weights[ends] - base
+
+    u = rng.random(len(child_groups))
+    weighted = np.searchsorted(cum_weights[1:], base + u * totals, side="right")
+    uniform = starts + (u * (ends - starts)).astype(np.int64)
+    positions = np.where(totals > 0, weighted, uniform)
+    positions = np.clip(positions, starts, ends - 1)
+
+    return order[positions]
+
+"""
+NdArray NdArray [Maybe Generator] -> NdArray
+Decides the conflicts between pairs of groups: the first group of each pair wins with
+probability fitness1 / (fitness1 + fitness2), or 1/2 if both are 0. Without an rng, the
+first group wins if its fitness is at least the second's
+**tested**
+"""
+def conflict_outcomes(fitness1, fitness2, rng=None):
+    if rng is None:
+        return fitness1 >= fitness2
+
+    total = fitness1 + fitness2
+    p = np.full(len(total), 0.5)
+    np.divide(fitness1, total, out=p, where=total > 0)
+    return rng.random(len(p)) < p
+
+"""
+Int Generator Boolean -> NdArray NdArray
+Shuffles range(size) and pairs the first half with the second. Throws out one random
+element if size is odd. If rand is False, pairs them in order
+**tested**
+"""
+def shuffle_and_pair(size, rng, rand=True):
+    deck = rng.permutation(size) if rand else np.arange(size)
+    midpoint = size // 2
+    return deck[:midpoint], deck[midpoint:2 * midpoint]
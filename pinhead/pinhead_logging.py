@@ -1,4 +1,4 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 import csv
 import os
 from datetime import datetime
@@ -7,89 +7,345 @@ import csv
 import os
 from datetime import datetime
 import json
+import sqlite3
+import numpy as np
+
+# layout of the columnar stats files: entry [year, s, m] is metric COLUMN_METRICS[m] of the
+# agents with strategy COLUMN_STRATEGIES[s], NaN for fit and coop when there are none of them
+COLUMN_STRATEGIES = [strat.name.lower()[:3] for strat in Strategy]
+COLUMN_METRICS = ["pop", "fit", "coop"]
+
+# (strategy value, key in the stats) of each strategy, so the keys aren't rebuilt every year
+STRATEGY_KEYS = [(strat.value, strat.name.lower()[:3]) for strat in Strategy]
+N_STRATEGY_VALUES = max(strat.value for strat in Strategy) + 1
+
+"""
+String -> NdArray
+Memory-maps a columnar stats file, cut down to the years that were written, with axes
+(year, strategy, metric) as given by COLUMN_STRATEGIES and COLUMN_METRICS
+"""
+def load_columns(path):
+    columns = np.load(path, mmap_mode="r")
+    written = np.isnan(columns[:, 0, 0])
+    return columns[:written.argmax()] if written.any() else columns
+
+"""
+String -> Dictionary
+Reads a stats file back into the shape the old single json files had, {"params": ...,
+"0": {...}, "1": {...}, ...}. .jsonl files hold one chunk of years per line; a last line
+that was cut off by a crash is dropped, so the result ends at the last complete chunk. A
+year that shows up again in a later line, like the years of a dumped ring buffer, takes
+the later version
+"""
+def read_stats(path):
+    with open(path) as f:
+        if not path.endswith(".jsonl"):
+            return json.load(f)
+
+        stats = {}
+        for line in f:
+            try:
+                stats.update(json.loads(line))
+            except json.JSONDecodeError:
+                break
+        return stats
+
+class RunRegistry:
+    """
+    Hands out the trial numbers of the runs under a data directory and keeps a record of
+    each run in <root>/runs.sqlite: its config directory, stats file prefix, trial, params,
+    seed, start and end time, status ("running", "done", or whatever finish is given), and
+    how many years it ran and which detector stopped it, if any. A trial is taken inside a write transaction, so runs started at the same time from
+    different processes never get the same number, and taking one doesn't list the
+    directory. root is made if it isn't there yet
+    """
+    def __init__(self, root="data"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "runs.sqlite")
+        conn = self.connect()
+        try:
+            conn.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                directory TEXT, prefix TEXT, trial INTEGER, params TEXT, seed TEXT,
+                                started TEXT, ended TEXT, status TEXT, years INTEGER, stopped_by TEXT,
+                                PRIMARY KEY (directory, prefix, trial))""")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    """
+    RunRegistry String String Dictionary Any -> Integer
+    registers a new run in directory and returns its trial number, one past the highest so
+    far. Stats files written before the registry existed are skipped over
+    **tested**
+    """
+    def start(self, directory, prefix, params, seed=None):
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            last, = conn.execute("SELECT MAX(trial) FROM runs WHERE directory = ? AND prefix = ?", (directory, prefix)).fetchone()
+            trial = (last or 0) + 1
+            while any(os.path.exists(os.path.join(self.root, directory, f'{prefix}_{trial}{ext}')) for ext in (".json", ".jsonl")):
+                trial += 1
+
+            conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, NULL, 'running', NULL, NULL)",
+                         (directory, prefix, trial, json.dumps(params), json.dumps(seed), datetime.now().isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+        return trial
+
+    """
+    RunRegistry String String Integer String [Maybe Integer] [Maybe String] ->
+    records that the run has ended, with the given status, the number of years it ran and
+    the name of the detector that stopped it
+    **tested**
+    """
+    def finish(self, directory, prefix, trial, status="done", years=None, stopped_by=None):
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE runs SET ended = ?, status = ?, years = ?, stopped_by = ? WHERE directory = ? AND prefix = ? AND trial = ?",
+                         (datetime.now().isoformat(), status, years, stopped_by, directory, prefix, trial))
+            conn.commit()
+        finally:
+            conn.close()
+
+    """
+    RunRegistry [Maybe String] [Maybe String] -> [List-of Dictionary]
+    returns the records of the runs, optionally only those in directory or with status
+    **tested**
+    """
+    def runs(self, directory=None, status=None):
+        query, args = "SELECT * FROM runs WHERE 1", []
+        if directory is not None:
+            query, args = query + " AND directory = ?", args + [directory]
+        if status is not None:
+            query, args = query + " AND status = ?", args + [status]
+
+        conn = self.connect()
+        try:
+            cursor = conn.execute(query + " ORDER BY directory, prefix, trial", args)
+            names = [column[0] for column in cursor.description]
+            records = [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+        for record in records:
+            record["params"], record["seed"] = json.loads(record["params"]), json.loads(record["seed"])
+        return records
+
+    """
+    RunRegistry Dictionary -> String
+    the path of the stats file of a run, given its record
+    """
+    def stats_path(self, run):
+        return os.path.join(self.root, run["directory"], f'{run["prefix"]}_{run["trial"]}.jsonl')
 
 class Logger:
-    def __init__(self, model, directory, param_dict):  
+    # the stats of a year are held in datadict until chunk_years of them are appended to the
+    # stats file as one line, so memory stays flat however long the run is
+    # if columns is true, the population-wide stats also go into a .npy file with one row per
+    # year, see load_columns
+    # with log_groups, the group stats are only kept every group_every years. The last
+    # ring_years years of group stats are held in a ring buffer, which is written out when
+    # total cooperation rises above 0.9 or falls below 0.25, and the groups are then kept
+    # for the next ring_years years as well
+    # the trial number of the run comes from the RunRegistry of data/, which also records
+    # when the run started and ended along with its params and seed
+    def __init__(self, model, directory, param_dict, seed=None, chunk_years=100, columns=False, group_every=1, ring_years=0):  
         self.model = model
         self.datadict = {}
-        self.datadict["params"] = param_dict
-        self.big_coop_counter = 0
-        self.small_coop_counter = 0
-
-        new_directory = os.path.join("data", directory)
-        if not os.path.exists(new_directory):
-            os.mkdir(new_directory)
-        trial = 1
-        
-        # timestamp = datetime.now().strftime("%m%d_%H%M%S")
-        
-        if self.model.log_groups:
-            while os.path.exists(os.path.join(new_directory, f'deet_stats_{trial}.json')):
-                trial += 1
-            self.stats_json = f'data/{directory}/deet_stats_{trial}.json'
+        self.chunk_years = chunk_years
+
+        self.group_every = group_every
+        self.ring_years = ring_years
+        self.ring = deque(maxlen=ring_years) if ring_years > 0 else None
+        self.groups_until = -1 # last year of the window after a trigger
+        self.was_high = False
+        self.was_low = False
+
+        os.makedirs(os.path.join("data", directory), exist_ok=True)
+
+        self.registry = RunRegistry()
+        self.directory = directory
+        self.prefix = "deet_stats" if self.model.log_groups else "aggr_stats"
+        self.trial = self.registry.start(directory, self.prefix, param_dict, seed)
+        self.stats_json = f'data/{directory}/{self.prefix}_{self.trial}.jsonl'
+
+        self.write_chunk({"params": param_dict})
+
+        self.columns = None
+        if columns:
+            self.columns = np.lib.format.open_memmap(self.stats_json[:-len(".jsonl")] + ".npy", mode="w+", dtype=np.float64,
+                                                     shape=(self.model.years, len(COLUMN_STRATEGIES), len(COLUMN_METRICS)))
+            self.columns[:] = np.nan
+
+    # Appends chunk to the stats file as a single line, and makes sure it's on disk before
+    # moving on. A crash can only cut off the line being written, which read_stats drops
+    def write_chunk(self, chunk):
+        with open(self.stats_json, 'a') as f:
+            f.write(json.dumps(chunk) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Whether the group stats of year go into the stats file
+    def keeps_groups(self, year):
+        return year % self.group_every == 0 or year <= self.groups_until
+
+    # Writes the group stats held in the ring buffer into their years, and keeps the group
+    # stats of the next ring_years years. Years already written to the file are written
+    # again as a new chunk, which read_stats lets replace the old one
+    def dump_ring(self, year):
+        written = {}
+        for ring_year, year_stats, groups in self.ring:
+            if ring_year in self.datadict:
+                year_stats["groups"] = groups
+            else:
+                written[ring_year] = dict(year_stats, groups=groups)
+
+        if written:
+            self.write_chunk(written)
+        self.groups_until = year + self.ring_years
+
+    # a pickled logger, as in a checkpoint, carries how far its stats file had got and whether
+    # it had a columns file, rather than a copy of the columns. Loading it touches neither
+    # file; reopen picks them back up
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["stats_size"] = os.path.getsize(self.stats_json)
+        state["columns"] = self.columns is not None
+        return state
+
+    # cuts off anything written to the stats file after the logger was pickled, and maps the
+    # columns file again, so a resumed run writes on from where it was
+    def reopen(self):
+        with open(self.stats_json, "r+") as f:
+            f.truncate(self.stats_size)
+
+        if self.columns:
+            self.columns = np.load(self.stats_json[:-len(".jsonl")] + ".npy", mmap_mode="r+")
         else:
-            while os.path.exists(os.path.join(new_directory, f'aggr_stats_{trial}.json')):
-                trial += 1
-            self.stats_json = f'data/{directory}/aggr_stats_{trial}.json'
+            self.columns = None
+
+    def flush(self):
+        if self.datadict:
+            self.write_chunk(self.datadict)
+            self.datadict = {}
+        if self.columns is not None:
+            self.columns.flush()
 
     # Logs stats for each group
     def log_stats(self):
-        year = self.model.schedule.year
-        total_pop_by_strat = {strat: 0 for strat in Strategy}
-        total_fitness_by_strat = {strat: 0 for strat in Strategy}
-        total_coop_by_strat = {strat: 0 for strat in Strategy}
+        model = self.model
+        groups = list(model.group_table.items())
+        indivs = [indiv for group, members in groups for indiv in members]
+
+        group = np.repeat(np.arange(len(groups)), [len(members) for group, members in groups])
+        strategy = np.array([indiv.strategy.value for indiv in indivs], dtype=np.int64)
+        fitness = np.array([indiv.fitness for indiv in indivs], dtype=float)
+        cooperates = np.array([indiv.cooperates for indiv in indivs], dtype=bool)
+
+        if model.log_groups:
+            p_obs = np.array([indiv.p_obs for indiv in indivs], dtype=float)
+            default_choice = np.array([indiv.default_choice for indiv in indivs], dtype=bool)
+            labels = [group.unique_id for group, members in groups]
+            beats = [None if not group.fought else group.enemy.unique_id for group, members in groups]
+        else:
+            p_obs = default_choice = labels = beats = None
 
+        self.log_agent_arrays(model.schedule.year, len(groups), group, strategy, fitness, cooperates, p_obs, default_choice, labels, beats)
+
+    # Logs stats for each group of a PinheadArrayModel straight from its population arrays
+    def log_array_stats(self):
+        model = self.model
+
+        if model.log_groups:
+            labels = ["g" + str(group_id) for group_id in model.group_id.tolist()]
+            beats = ["g" + str(enemy) if fought else None for fought, enemy in zip(model.fought.tolist(), model.enemy.tolist())]
+        else:
+            labels = beats = None
+
+        self.log_agent_arrays(model.schedule.year, model.num_groups, model.group, model.strategy, model.fitness, model.cooperates,
+                              model.p_obs, model.default_choice, labels, beats)
+
+    # Logs the stats of the year from per-agent arrays, where agent i is in group group[i].
+    # Each stat is summed by (group, strategy) with one bincount, except the population-wide
+    # counts, which are read from model.agent_counts. p_obs, default_choice and the labels
+    # and beats of the groups are only needed when log_groups is on
+    def log_agent_arrays(self, year, n_groups, group, strategy, fitness, cooperates, p_obs, default_choice, labels, beats):
         self.datadict[year] = {}
         self.datadict[year]["groups"] = {}
-        for group, indivs in self.model.group_table.items():
-            # Initialize stats for this group
-            fitness_by_strat = {strat: 0 for strat in Strategy}
-            coop_by_strat = {strat: 0 for strat in Strategy}
-            obs_by_strat = {strat: 0 for strat in Strategy}
-            error_by_strat = {strat: 0 for strat in Strategy}
-
-            # Aggregate stats
-            for indiv in indivs:
-                fitness_by_strat[indiv.strategy] += indiv.fitness
-                coop_by_strat[indiv.strategy] += indiv.cooperates
-                obs_by_strat[indiv.strategy] += indiv.p_obs
-                error_by_strat[indiv.strategy] += (indiv.cooperates == indiv.default_choice)
-            
-            # Calculate values
-            group_stats = {}
-            for strat in Strategy:
-                group_stats[strat.name.lower()[:3]] = {'pop': group.agent_counts[strat]}
-                if group.agent_counts[strat] > 0:
-                    # all the average levels for a given strategy
-                    group_stats[strat.name.lower()[:3]]['fit'] = round(fitness_by_strat[strat] / group.agent_counts[strat], 2)
-                    group_stats[strat.name.lower()[:3]]['coop'] = round(coop_by_strat[strat] / group.agent_counts[strat], 3)
-                    group_stats[strat.name.lower()[:3]]['obs'] = round(obs_by_strat[strat] / group.agent_counts[strat], 2)
-                    group_stats[strat.name.lower()[:3]]['err'] = round(error_by_strat[strat] / group.agent_counts[strat], 3)
-
-                total_pop_by_strat[strat] += group.agent_counts[strat]
-                total_fitness_by_strat[strat] += fitness_by_strat[strat]
-                total_coop_by_strat[strat] += coop_by_strat[strat]
-
-            group_stats["beat"] = None if not group.fought else group.enemy.unique_id
-
-            if self.model.log_groups:
-                self.datadict[year]["groups"][group.unique_id] = group_stats
-        
+
+        if self.model.log_groups and (self.ring is not None or self.keeps_groups(year)):
+            n_cells = n_groups * N_STRATEGY_VALUES
+            cell = group * N_STRATEGY_VALUES + strategy
+            pop = np.bincount(cell, minlength=n_cells).reshape(n_groups, N_STRATEGY_VALUES)
+            fit = np.bincount(cell, weights=fitness, minlength=n_cells).reshape(n_groups, N_STRATEGY_VALUES)
+            coop = np.bincount(cell, weights=cooperates, minlength=n_cells).reshape(n_groups, N_STRATEGY_VALUES)
+            obs = np.bincount(cell, weights=p_obs, minlength=n_cells).reshape(n_groups, N_STRATEGY_VALUES)
+            err = np.bincount(cell, weights=(cooperates == default_choice), minlength=n_cells).reshape(n_groups, N_STRATEGY_VALUES)
+
+            groups_dict = {}
+            for label, beat, pops, fits, coops, obses, errs in zip(labels, beats, pop.tolist(), fit.tolist(), coop.tolist(), obs.tolist(), err.tolist()):
+                group_stats = {}
+                for v, key in STRATEGY_KEYS:
+                    n = pops[v]
+                    group_stats[key] = {'pop': n} if n == 0 else \
+                        {'pop': n, 'fit': round(fits[v] / n, 2), 'coop': round(coops[v] / n, 3), 'obs': round(obses[v] / n, 2), 'err': round(errs[v] / n, 3)}
+
+                group_stats["beat"] = beat
+                groups_dict[label] = group_stats
+
+            if self.keeps_groups(year):
+                self.datadict[year]["groups"] = groups_dict
+            if self.ring is not None:
+                self.ring.append((year, self.datadict[year], groups_dict))
+
+            total_fitness, total_coop = fit.sum(axis=0), coop.sum(axis=0)
+        else:
+            total_fitness = np.bincount(strategy, weights=fitness, minlength=N_STRATEGY_VALUES)
+            total_coop = np.bincount(strategy, weights=cooperates, minlength=N_STRATEGY_VALUES)
+
+        # the populations are the counts the model keeps up to date, which debug_counts checks
+        # against a recount
+        total_fitness, total_coop = total_fitness.tolist(), total_coop.tolist()
+        self.log_totals(year,
+                        dict(self.model.agent_counts),
+                        {strat: total_fitness[strat.value] for strat in Strategy},
+                        {strat: total_coop[strat.value] for strat in Strategy})
+
+    # Logs the population-wide stats for the year, checks whether the model can terminate
+    # and appends the years held so far to the file once there's a full chunk or the run ends
+    def log_totals(self, year, total_pop_by_strat, total_fitness_by_strat, total_coop_by_strat):
         zero_counter = 4
-        for strat in Strategy:
-            self.datadict[year][strat.name.lower()[:3]] = {}
-            self.datadict[year][strat.name.lower()[:3]]["pop"] = total_pop_by_strat[strat]
+        for strat, (v, key) in zip(Strategy, STRATEGY_KEYS):
+            self.datadict[year][key] = {}
+            self.datadict[year][key]["pop"] = total_pop_by_strat[strat]
             
             if total_pop_by_strat[strat] > 0:
                 zero_counter -= 1
-                self.datadict[year][strat.name.lower()[:3]]["fit"] = round(total_fitness_by_strat[strat] / total_pop_by_strat[strat], 2)
-                self.datadict[year][strat.name.lower()[:3]]["coop"] = round(total_coop_by_strat[strat] / total_pop_by_strat[strat], 3)
+                self.datadict[year][key]["fit"] = round(total_fitness_by_strat[strat] / total_pop_by_strat[strat], 2)
+                self.datadict[year][key]["coop"] = round(total_coop_by_strat[strat] / total_pop_by_strat[strat], 3)
+
+        if self.columns is not None:
+            pop = np.array([total_pop_by_strat[strat] for strat in Strategy], dtype=float)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.columns[year, :, 0] = pop
+                self.columns[year, :, 1] = np.array([total_fitness_by_strat[strat] for strat in Strategy]) / pop
+                self.columns[year, :, 2] = np.array([total_coop_by_strat[strat] for strat in Strategy]) / pop
         
         total_coop = sum([total_coop_by_strat[strat] for strat in Strategy])
         total_pop = sum([total_pop_by_strat[strat] for strat in Strategy])
         total_coop_pct = total_coop/total_pop
-        self.big_coop_counter += (total_coop_pct > 0.9)
-        self.small_coop_counter += (total_coop_pct < 0.25)
+
+        # crossing either threshold triggers a dump of the ring buffer
+        is_high, is_low = total_coop_pct > 0.9, total_coop_pct < 0.25
+        if self.ring is not None and ((is_high and not self.was_high) or (is_low and not self.was_low)):
+            self.dump_ring(year)
+        self.was_high, self.was_low = is_high, is_low
 
         if self.model.print_stuff:
             print(self.model.schedule.year)
@@ -98,14 +354,10 @@ class Logger:
                 if self.datadict[year][strat_name]["pop"] > 0:
                     print(strat_name, self.datadict[year][strat_name]["pop"] / (self.model.n * self.model.g), self.datadict[year][strat_name]["coop"])
 
-
-        # if only one agent type remains, then we can terminate the model
-        if self.model.until_high and self.big_coop_counter > 1000:
-            self.model.can_terminate = True
-        
-        if self.model.until_low and self.small_coop_counter > 1000:
-            self.model.can_terminate = True
-
         if year == self.model.years - 1 or self.model.can_terminate:
-            with open(self.stats_json, 'w') as f:
-                json.dump(self.datadict, f)
+            self.flush()
+            stopped_by = self.model.stopped_by
+            self.registry.finish(self.directory, self.prefix, self.trial, years=year + 1,
+                                 stopped_by=getattr(stopped_by, "__name__", type(stopped_by).__name__) if stopped_by is not None else None)
+        elif len(self.datadict) >= self.chunk_years:
+            self.flush()
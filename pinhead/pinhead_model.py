@@ -1,13 +1,18 @@
-from mesa import Model
 from pinhead_agent import PinheadAgent, Strategy
 from pinhead_group import PinheadGroup
 from pinhead_scheduler import RandomActivationByLevel
 from pinhead_logging import Logger
+from pinhead_detectors import default_detectors, run_detectors
+from pinhead_kernels import choice_probabilities, civic_update, selfish_update, conflict_outcomes, group_payoffs, select_survivors, select_parents, shuffle_and_pair, segment_offsets, segment_counts
 import random
+import os
+import gzip
+import pickle
+import numpy as np
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 
-class PinheadModel(Model):
+class PinheadModel:
     
     def __init__(
                     self, 
@@ -27,13 +32,21 @@ class PinheadModel(Model):
                     saintly_group=False, # should it have a single group that has high numbers of cooperators
                     years=1,
                     rand=True, # should random functions be random
+                    seed=None, # seed for self.random and np.random
                     print_stuff=False,
                     log_basic=False,
                     log_groups=False,
+                    log_columns=False, # also write the population-wide stats as a .npy file
+                    log_group_every=1, # keep the group stats every this many years
+                    log_ring_years=0, # years of group stats to write out when cooperation crosses a threshold
                     until_high=True,
                     until_low=False,
                     learning_rate=0.5,
-                    present_weight=0.2
+                    present_weight=0.2,
+                    detectors=None, # when to stop early, see pinhead_detectors. until_high and until_low by default
+                    debug_counts=False, # recount the strategies every year to check agent_counts
+                    checkpoint_every=0, # write a checkpoint every this many years, see resume
+                    checkpoint_path=None # where the checkpoint goes, under data/checkpoints by default
                 ):
         
         param_dict = {
@@ -75,7 +88,8 @@ class PinheadModel(Model):
         self.group_table = defaultdict(list)
         self.indiv_table = {}
         self.group_table_dead_indivs = defaultdict(list)
-        self.agent_counts = {strat: 0 for strat in Strategy}
+        self.agent_counts = {strat: 0 for strat in Strategy} # kept up to date by the groups as agents come and go
+        self.debug_counts = debug_counts
 
         # probabilities of various events 
         self.p_mutation = p_mutation
@@ -86,19 +100,26 @@ class PinheadModel(Model):
         self.threshold = threshold
 
         self.diff_sum = 0
+        self.seed = seed
+        self.random = random.Random(seed)
+        if seed is not None:
+            np.random.seed(seed)
         self.schedule = RandomActivationByLevel(self)
         self.years = years
 
         # logging
         self.log_basic = log_basic
         self.log_groups = log_groups
+        self.log_columns = log_columns
+        self.log_group_every = log_group_every
+        self.log_ring_years = log_ring_years
 
         if self.log_basic:
             if p_con != 1/13:
                 config = f'y{years}_n{n}_g{g}_c{cost}_b{benefit}_pc{p_con}_pm{p_mutation}_ps{p_mig}_r{fitness}_t{threshold}_distrib{distrib["civic"]}_{distrib["saint"]}'
             else:
                 config = f'y{years}_n{n}_g{g}_c{cost}_b{benefit}_pm{p_mutation}_ps{p_mig}_r{fitness}_t{threshold}_distrib{distrib["civic"]}_{distrib["saint"]}'
-            self.logger = Logger(self, config, param_dict)
+            self.logger = Logger(self, config, param_dict, seed=seed, columns=log_columns, group_every=log_group_every, ring_years=log_ring_years)
 
         
         for strategy in ["saint", "citizen", "deceiver", "miscreant", "civic", "static", "selfish"]:
@@ -110,6 +131,9 @@ class PinheadModel(Model):
         self.distrib = distrib
         self.mut_distrib = self.distrib if mut_distrib is None else mut_distrib
 
+        mut_weights = np.array([self.mut_distrib[strat.name.lower()] for strat in Strategy], dtype=float)
+        self.mut_cum_weights = np.cumsum(mut_weights / mut_weights.sum()) if mut_weights.sum() > 0 else None
+
         self.strategies = self.initialize_strategies(distrib, rand)
         self.initialize_groups(saintly_group)
 
@@ -119,6 +143,25 @@ class PinheadModel(Model):
         self.until_low = until_low
         self.until_high = until_high
         self.can_terminate = False # set to true when ready to terminate
+        self.detectors = default_detectors(until_high, until_low) if detectors is None else list(detectors)
+        self.stopped_by = None # the detector that made the model ready to terminate
+
+        self.checkpoint_every = checkpoint_every
+        if checkpoint_path is None and self.log_basic:
+            # kept out of the stats directory, which should only hold stats files
+            checkpoint_dir = os.path.join("data", "checkpoints", self.logger.directory)
+            checkpoint_path = os.path.join(checkpoint_dir, f'{self.logger.prefix}_{self.logger.trial}.ckpt')
+            if checkpoint_every:
+                os.makedirs(checkpoint_dir, exist_ok=True)
+        if checkpoint_every and checkpoint_path is None:
+            raise Exception("checkpoint_every needs a checkpoint_path when there's no logger")
+        if checkpoint_every:
+            # detectors go into the checkpoint, so a lambda or closure would only fail at the first one
+            try:
+                pickle.dumps(self.detectors)
+            except (pickle.PicklingError, AttributeError, TypeError) as error:
+                raise Exception(f"checkpoint_every needs detectors that can be pickled, like module-level functions or classes: {error}")
+        self.checkpoint_path = checkpoint_path
 
     """
     PinheadModel Boolean -> 
@@ -128,18 +171,17 @@ class PinheadModel(Model):
     """
     def initialize_groups(self, saintly_group):
         for i in range(self.g - saintly_group):
-            g_id = "g" + str(self.curr_group_id)
-            group_agent = PinheadGroup(g_id, self)
+            group_agent = PinheadGroup(self.reserve_group_ids(), self)
             # self.schedule.add(group_agent) # TODO does this ever get used
 
             for j in range(self.n):
-                i_id = "i" + str(self.curr_indiv_id)
+                i_id = self.reserve_indiv_ids()
                 if i == 0 and saintly_group and j % 2 == 0:
                     strategy = Strategy.CITIZEN
                 elif i == 0 and saintly_group and j % 2 == 1:
                     strategy = Strategy.SAINT
                 else:
-                    strategy = self.strategies[self.curr_indiv_id]
+                    strategy = self.strategies[i_id]
             
                 indiv_agent = PinheadAgent(i_id, self, strategy, group_agent, self.fitness)
         
@@ -165,6 +207,26 @@ class PinheadModel(Model):
         
         return strategies
     
+    """
+    PinheadModel Int -> Int
+    Reserves count consecutive individual ids and returns the first one
+    **tested**
+    """
+    def reserve_indiv_ids(self, count=1):
+        first_id = self.curr_indiv_id
+        self.curr_indiv_id += count
+        return first_id
+
+    """
+    PinheadModel Int -> Int
+    Reserves count consecutive group ids and returns the first one
+    **tested**
+    """
+    def reserve_group_ids(self, count=1):
+        first_id = self.curr_group_id
+        self.curr_group_id += count
+        return first_id
+
     """
     EvoModel -> None
     Takes a step
@@ -175,11 +237,158 @@ class PinheadModel(Model):
 
             if self.can_terminate:
                 break
+            if self.checkpoint_every and self.schedule.year % self.checkpoint_every == 0 and self.schedule.year < self.years:
+                self.checkpoint(self.checkpoint_path)
+
+    """
+    PinheadModel String ->
+    writes the whole state of the model to path, compressed: the groups and agents, the id
+    counters, the scheduler, the logger and the states of self.random and np.random. The file
+    is written beside path and then moved over it, so a crash while writing leaves the last
+    checkpoint as it was
+    **tested**
+    """
+    def checkpoint(self, path):
+        if self.log_basic:
+            self.logger.flush()
 
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            pickle.dump((self, np.random.get_state()), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    """
+    String -> PinheadModel
+    loads a model from a checkpoint and puts np.random back in the state it was in, so
+    calling main carries on exactly as the run would have from there. The stats file is cut
+    back to where it was at the checkpoint and the columns file is mapped again. Loading the
+    checkpoint with pickle alone leaves the files as they are
+    **tested**
+    """
+    @classmethod
+    def resume(cls, path):
+        with gzip.open(path, "rb") as f:
+            model, np_state = pickle.load(f)
+
+        if model.log_basic:
+            model.logger.reopen()
+        np.random.set_state(np_state)
+        return model
     
     def loop(self):
         self.schedule.step()
-        self.refresh_agent_total_counts()
+
+    """
+    PinheadModel -> None
+    runs the detectors on the strategy counts and this year's cooperation, and makes the
+    model ready to terminate if one of them fires
+    **tested**
+    """
+    def check_detectors(self):
+        counts = self.agent_counts
+        coop = sum(group.num_cooperated for group in self.group_table) / max(sum(counts.values()), 1)
+
+        fired = run_detectors(self.detectors, self, counts, coop)
+        if fired is not None:
+            self.stopped_by = fired
+            self.can_terminate = True
+
+        if self.debug_counts:
+            self.check_agent_counts()
+
+    """
+    PinheadModel -> None
+    Every group loses the agents that don't survive, then the survivors of all groups
+    reproduce at once: parents are picked from one cumulative fitness array, and the
+    mutations and pi of every offspring are drawn in bulk
+    **tested**
+    """
+    def reproduce(self):
+        groups = list(self.group_table.keys())
+        n_deaths = self.death(groups)
+        self.birth(groups, n_deaths)
+
+    """
+    PinheadModel [List-of PinheadGroup] -> [List-of Int]
+    In every group, floor(n * p_survive) agents survive with probability proportional to
+    their fitness and the rest die off. All groups are sampled in one pass with Gumbel top-k
+    keys. Returns the number of deaths in each group
+    **tested**
+    """
+    def death(self, groups):
+        indivs = [indiv for group in groups for indiv in self.group_table[group]]
+        group_index = np.repeat(np.arange(len(groups)), [len(self.group_table[group]) for group in groups])
+        fitness = np.array([indiv.fitness for indiv in indivs])
+
+        survives, s_probs = select_survivors(fitness, group_index, len(groups), self.p_survive, np.random)
+
+        new_agents = [[] for group in groups]
+        for indiv, group, survived, s_prob in zip(indivs, group_index.tolist(), survives.tolist(), s_probs.tolist()):
+            indiv.s_prob = s_prob
+            if survived:
+                new_agents[group].append(indiv)
+            else:
+                indiv.kill_indiv(remove_from_group=False)
+
+        n_deaths = []
+        for group, agents in zip(groups, new_agents):
+            n_deaths.append(len(self.group_table[group]) - len(agents))
+            self.group_table[group] = agents
+            group.initialize_strategy_counts()
+
+        return n_deaths
+
+    """
+    PinheadModel [List-of PinheadGroup] [List-of Int] -> None
+    Fills n_deaths[k] empty places in groups[k] with the offspring of its survivors, chosen
+    with probability proportional to fitness
+    **tested**
+    """
+    def birth(self, groups, n_deaths):
+        parents = [indiv for group in groups for indiv in self.group_table[group]]
+        group_index = np.repeat(np.arange(len(groups)), [len(self.group_table[group]) for group in groups])
+        fitness = np.array([indiv.fitness for indiv in parents])
+
+        totals = np.bincount(group_index, weights=fitness, minlength=len(groups))[group_index]
+        r_probs = np.zeros(len(parents))
+        np.divide(fitness, totals, out=r_probs, where=totals > 0)
+        for indiv, r_prob in zip(parents, r_probs.tolist()):
+            indiv.r_prob = r_prob
+
+        child_groups = np.repeat(np.arange(len(groups)), n_deaths)
+        n_children = len(child_groups)
+        reproducers = select_parents(fitness, group_index, np.ones(len(parents), dtype=bool), child_groups, len(groups), np.random)
+
+        strategies = [parents[ind].strategy for ind in reproducers.tolist()]
+        if self.mut_cum_weights is not None:
+            mutants = np.flatnonzero(np.random.random(n_children) < self.p_mutation)
+            picks = np.searchsorted(self.mut_cum_weights, np.random.random(len(mutants)), side="right")
+            all_strategies = list(Strategy)
+            for ind, pick in zip(mutants.tolist(), np.minimum(picks, len(all_strategies) - 1).tolist()):
+                strategies[ind] = all_strategies[pick]
+
+        new_pis = np.random.normal(loc=np.array([parents[ind].pi for ind in reproducers.tolist()]), scale=0.05)
+
+        self.add_indivs([groups[group] for group in child_groups.tolist()], strategies, [parents[ind].fitness for ind in reproducers.tolist()], new_pis.tolist())
+
+    """
+    PinheadModel [List-of PinheadGroup] [List-of Strategy] [List-of Float] [List-of Float] -> [List-of PinheadAgent]
+    Makes one new agent for each entry of the lists and adds it to its group. The ids are
+    reserved as one block, and the tables and strategy counts are updated in one pass
+    **tested**
+    """
+    def add_indivs(self, groups, strategies, fitnesses, pis):
+        first_id = self.reserve_indiv_ids(len(groups))
+        new_indivs = [PinheadAgent(first_id + i, self, strategy, None, fitness, pi=pi) for i, (strategy, fitness, pi) in enumerate(zip(strategies, fitnesses, pis))]
+
+        for indiv, group in zip(new_indivs, groups):
+            self.indiv_table[indiv] = group
+            self.group_table[group].append(indiv)
+
+        for (group, strategy), count in Counter(zip(groups, strategies)).items():
+            group.inc_strategy_count(strategy, count)
+
+        return new_indivs
 
     """
     EvoModel -> None
@@ -188,30 +397,36 @@ class PinheadModel(Model):
     **tested**
     """
     def fight_groups(self, rand=True):
-        for group in self.group_table:
+        groups = list(self.group_table.keys())
+        for group in groups:
             group.fought = False
             group.enemy = None
 
-        # pair up groups 
-        groups1, groups2 = self.shuffle_and_pair(list(self.group_table.keys()), rand)
+        # pair up groups, then decide every conflict and its outcome at once
+        groups1, groups2 = shuffle_and_pair(len(groups), np.random, rand)
+        fight = np.random.random(len(groups1)) < self.p_con if rand else np.ones(len(groups1), dtype=bool)
+        groups1 = groups1[fight]
+        groups2 = groups2[fight]
 
-        for g1, g2 in zip(groups1, groups2):
-            # save enemy for datacollector
-            fight = self.random.choices([True, False], weights=[self.p_con, 1 - self.p_con])[0]
+        average_fitness = np.array([group.average_fitness for group in groups], dtype=float)
+        w = conflict_outcomes(average_fitness[groups1], average_fitness[groups2], np.random if rand else None)
+
+        for i1, i2, won in zip(groups1.tolist(), groups2.tolist(), w.tolist()):
+            g1 = groups[i1]
+            g2 = groups[i2]
 
-            if fight or (not rand):
-                g1.enemy = g2
-                g2.enemy = g1
+            # save enemy for datacollector
+            g1.enemy = g2
+            g2.enemy = g1
 
-                # store whether groups fought for datacollector
-                g1.fought = True
-                g2.fought = True
+            # store whether groups fought for datacollector
+            g1.fought = True
+            g2.fought = True
 
-                w = self.fight(g1, g2, rand)
-                if w:
-                    self.replace_group(g1, g2)
-                else:
-                    self.replace_group(g2, g1)
+            if won:
+                self.replace_group(g1, g2)
+            else:
+                self.replace_group(g2, g1)
 
     """
     EvoModel -> Boolean
@@ -242,12 +457,12 @@ class PinheadModel(Model):
     """
     def replace_group(self, winner, loser):
         loser.kill_group()
-        new_group = PinheadGroup("g" + str(self.curr_group_id), self)
+        new_group = PinheadGroup(self.reserve_group_ids(), self)
         new_group.num_cooperated = winner.num_cooperated
         new_group.average_benefit = winner.average_benefit
 
-        for indiv in self.group_table[winner]:
-            new_indiv = PinheadAgent("i" + str(self.curr_indiv_id), self, indiv.strategy, new_group, indiv.fitness)
+        members = self.group_table[winner]
+        self.add_indivs([new_group] * len(members), [indiv.strategy for indiv in members], [indiv.fitness for indiv in members], [0] * len(members))
 
         return new_group
 
@@ -274,28 +489,56 @@ class PinheadModel(Model):
     """
     EvoModel -> None
     Pairs individuals randomly, and then with probability p, switches their group
-    membership
+    membership. The pairs and the swaps are drawn for the whole population at once over an
+    array of group indices, and the group lists are rebuilt in one pass afterwards
     **tested**
     """
     def recombine_groups(self, rand=True):
-        indivs1, indivs2 = self.shuffle_and_pair(list(self.indiv_table.keys()), rand)
+        indivs = list(self.indiv_table.keys())
+        groups = list(self.group_table.keys())
+        slots = {group: k for k, group in enumerate(groups)}
+        group_index = np.array([slots[group] for group in self.indiv_table.values()], dtype=np.int64)
 
-        for i1, i2 in zip(indivs1, indivs2):
-            i1.migration_partner = i2
-            i2.migration_partner = i1
+        indivs1, indivs2 = shuffle_and_pair(len(indivs), np.random, rand)
 
-            # if they're already in the same group, they don't move by swapping
-            if self.indiv_table[i1] == self.indiv_table[i2]:
-                continue
+        for i1, i2 in zip(indivs1.tolist(), indivs2.tolist()):
+            indivs[i1].migration_partner = indivs[i2]
+            indivs[i2].migration_partner = indivs[i1]
 
-            move = self.random.choices([True, False], weights=[self.p_mig, 1 - self.p_mig])[0]
+        # if they're already in the same group, they don't move by swapping
+        move = group_index[indivs1] != group_index[indivs2]
+        if rand:
+            move &= np.random.random(len(indivs1)) < self.p_mig
+        movers1 = indivs1[move]
+        movers2 = indivs2[move]
+
+        group_index[movers1], group_index[movers2] = group_index[movers2], group_index[movers1]
+
+        movers = np.concatenate((movers1, movers2))
+        for ind, group in zip(movers.tolist(), group_index[movers].tolist()):
+            indiv = indivs[ind]
+            indiv.is_new_agent = True
+            indiv.migrated = True
+            self.indiv_table[indiv] = groups[group]
 
-            if move or (not rand):
-                i1.is_new_agent = True
-                i1.migrated = True
-                i2.is_new_agent = True
-                i2.migrated = True
-                self.swap_agents(i1, i2)
+        self.regroup(groups, indivs, group_index)
+
+    """
+    PinheadModel [List-of PinheadGroup] [List-of PinheadAgent] NdArray -> None
+    Rebuilds the member list and strategy counts of every group from the group index of
+    each agent, where indivs[i] belongs to groups[group_index[i]]
+    **tested**
+    """
+    def regroup(self, groups, indivs, group_index):
+        order = np.argsort(group_index, kind="stable").tolist()
+        offsets = segment_offsets(group_index, len(groups)).tolist()
+        strategies = np.array([indiv.strategy.value for indiv in indivs], dtype=np.int64)
+        counts = segment_counts(group_index, strategies, len(groups), len(Strategy) + 1).tolist()
+
+        for k, group in enumerate(groups):
+            self.group_table[group] = [indivs[i] for i in order[offsets[k]:offsets[k + 1]]]
+            # agents only change groups here, so the model-wide counts stay the same
+            group.agent_counts = {strat: counts[k][strat.value] for strat in Strategy}
 
     """
     EvoModel -> IndivAgent IndivAgent
@@ -309,22 +552,128 @@ class PinheadModel(Model):
         self.indiv_table[indiv1] = group2
         self.indiv_table[indiv2] = group1
 
-        self.group_table[group1].remove(indiv1)
-        self.group_table[group1].append(indiv2)
-        self.group_table[group2].remove(indiv2)
-        self.group_table[group2].append(indiv1)
+        # each agent takes the other's place, so neither list has to shift
+        members1 = self.group_table[group1]
+        members2 = self.group_table[group2]
+        members1[members1.index(indiv1)] = indiv2
+        members2[members2.index(indiv2)] = indiv1
 
         group1.dec_strategy_count(indiv1.strategy)
         group1.inc_strategy_count(indiv2.strategy)
         group2.dec_strategy_count(indiv2.strategy)
         group2.inc_strategy_count(indiv1.strategy)
 
+    """
+    PinheadModel -> None
+    Every agent decides whether to cooperate and whether it gets caught. Learners learn
+    first, then the cooperation probabilities of all agents come from one pass over their
+    strategies, and the cooperation and observation outcomes are drawn in bulk
+    **tested**
+    """
+    def make_choices(self, rand=True):
+        indivs = list(self.indiv_table.keys())
+        groups = list(self.indiv_table.values())
+        strategy = np.array([indiv.strategy.value for indiv in indivs])
+        p_obs = np.random.random(len(indivs))
+
+        self.learn(indivs, groups, strategy, rand)
+
+        pi = np.array([indiv.pi for indiv in indivs])
+        average_benefit = np.array([group.average_benefit for group in groups])
+        prop_cooperators = np.array([group.num_cooperated for group in groups]) / self.n
+
+        p_coop = choice_probabilities(strategy, p_obs, pi, average_benefit, prop_cooperators, self.fitness, self.cost, self.threshold, self.epsilon)
+        default_choice = p_coop > 0.5
+        cooperates = np.random.random(len(indivs)) < p_coop if rand else default_choice
+        observed = np.random.random(len(indivs)) < p_obs
+
+        for indiv, p, p_c, default, coop, obs in zip(indivs, p_obs.tolist(), p_coop.tolist(), default_choice.tolist(), cooperates.tolist(), observed.tolist()):
+            indiv.p_obs = p
+            indiv.p_coop = p_c
+            indiv.default_choice = default
+            indiv.cooperates = coop
+            indiv.observed = obs
+
+            # need the fitness from the last round to be preserved for the learning step
+            indiv.fitness = indiv.base_fitness
+
+    """
+    PinheadModel [List-of PinheadAgent] [List-of PinheadGroup] NdArray Boolean -> None
+    Updates the pi of every civic and selfish learner at once, where groups[i] is the group
+    of indivs[i] and strategy[i] its strategy value. Selfish learners share one noise draw
+    **tested**
+    """
+    def learn(self, indivs, groups, strategy, rand=True):
+        civic = np.flatnonzero(strategy == Strategy.CIVIC.value).tolist()
+        if len(civic) > 0:
+            learners = [indivs[i] for i in civic]
+            prop_cooperators = np.array([groups[i].num_cooperated for i in civic]) / self.n
+            pi, avg_pi = civic_update(np.array([indiv.pi for indiv in learners]), np.array([indiv.avg_pi for indiv in learners]), 
+                                        prop_cooperators, self.threshold, self.learning_rate, self.present_weight)
+            for indiv, new_pi, new_avg_pi in zip(learners, pi.tolist(), avg_pi.tolist()):
+                indiv.pi = new_pi
+                indiv.avg_pi = new_avg_pi
+
+        selfish = np.flatnonzero(strategy == Strategy.SELFISH.value).tolist()
+        if len(selfish) > 0:
+            learners = [indivs[i] for i in selfish]
+            noise = np.random.standard_normal(len(learners)) if rand else None
+            pi, avg_pi = selfish_update(np.array([indiv.pi for indiv in learners]), np.array([indiv.avg_pi for indiv in learners]),
+                                        np.array([indiv.fitness for indiv in learners]), np.array([indiv.avg_fitness for indiv in learners]), 
+                                        self.present_weight, noise)
+            for indiv, new_pi, new_avg_pi in zip(learners, pi.tolist(), avg_pi.tolist()):
+                indiv.pi = new_pi
+                indiv.avg_pi = new_avg_pi
+
+    """
+    PinheadModel -> None
+    Shares the benefits of cooperation in every group at once. Agents who cooperated or were
+    not caught defecting split their group's benefit; the group totals are segmented sums over
+    the group index of each individual, and the fitness changes are applied in a single pass
+    **tested**
+    """
+    def distribute_payoffs(self):
+        groups = list(self.group_table.keys())
+        indivs = [indiv for group in groups for indiv in self.group_table[group]]
+        group_index = np.repeat(np.arange(len(groups)), [len(self.group_table[group]) for group in groups])
+        cooperates = np.frombuffer(bytes([indiv.cooperates for indiv in indivs]), dtype=bool)
+        observed = np.frombuffer(bytes([indiv.observed for indiv in indivs]), dtype=bool)
+
+        num_cooperated, _, average_benefit, fitness_delta = group_payoffs(group_index, cooperates, observed, len(groups), self.benefit, self.cost)
+        average_fitness = self.fitness + num_cooperated*(self.benefit - self.cost)/self.n
+
+        for indiv, delta in zip(indivs, fitness_delta.tolist()):
+            indiv.fitness += delta
+            indiv.avg_fitness = (0.8 * indiv.avg_fitness) + 0.2 * indiv.fitness
+
+        for group, num, benefit, fitness in zip(groups, num_cooperated.tolist(), average_benefit.tolist(), average_fitness.tolist()):
+            group.num_cooperated = num
+            group.average_benefit = benefit
+            group.average_fitness = fitness
+
     def refresh_agent_total_counts(self):
         self.agent_counts = {strat: 0 for strat in Strategy}
         for group in self.group_table:
             for strat in Strategy:
                 self.agent_counts[strat] += group.agent_counts[strat]
 
+    """
+    PinheadModel -> None
+    Recounts the strategies of every agent, and raises an exception if the counts of a group
+    or the model-wide counts have drifted from the recount
+    **tested**
+    """
+    def check_agent_counts(self):
+        totals = Counter()
+        for group, indivs in self.group_table.items():
+            counts = Counter(indiv.strategy for indiv in indivs)
+            totals.update(counts)
+            if any(group.agent_counts[strat] != counts[strat] for strat in Strategy):
+                raise Exception(f"strategy counts of {group.unique_id} are {group.agent_counts}, recount gives {dict(counts)}")
+
+        if any(self.agent_counts[strat] != totals[strat] for strat in Strategy):
+            raise Exception(f"model strategy counts are {self.agent_counts}, recount gives {dict(totals)}")
+
     """
     EvoModel -> None
     Prints out a representation of the groups
@@ -1,13 +1,12 @@
-from mesa.time import RandomActivation
-from mesa.datacollection import DataCollector
 from collections import defaultdict
 
-class RandomActivationByLevel(RandomActivation):
+class RandomActivationByLevel:
 
     def __init__(self, model):
-        super().__init__(model)
+        self.model = model
         self.agents_by_level = defaultdict(list)
         self.year = 0
+        self.epoch = 0 # agents' per-year flags only hold if they were set in this epoch
 
     """
     Self -> None
@@ -16,32 +15,45 @@ class RandomActivationByLevel(RandomActivation):
     def step(self):
         if self.year != 0:
             # reset agent variables
-            for indiv in self.model.indiv_table:
-                indiv.is_new_agent = False 
-                indiv.migrated = False
-                indiv.migration_partner = None
+            self.epoch += 1
             
-            all_groups = list(self.model.group_table.keys())
-            for group in all_groups:
-                group.step_reproduce()
+            self.model.reproduce()
 
             self.model.fight_groups()
             self.model.recombine_groups()
 
-        all_indivs = list(self.model.indiv_table.keys())
-        self.model.random.shuffle(all_indivs)
+        self.model.make_choices()
+        self.model.distribute_payoffs()
 
-        cooperator_count = 0 
-        for indiv in all_indivs:
-            indiv.step()
-            cooperator_count += indiv.cooperates
+        self.model.check_detectors()
+        if self.model.log_basic:
+            self.model.logger.log_stats()
+
+        self.year += 1
+
+class ArrayActivationByLevel:
+
+    def __init__(self, model):
+        self.model = model
+        self.year = 0
+
+    """
+    Self -> None
+    Executes the same steps as RandomActivationByLevel, but each level acts on the whole
+    population arrays of a PinheadArrayModel at once
+    """
+    def step(self):
+        if self.year != 0:
+            self.model.reset_agent_flags()
+            self.model.reproduce()
+            self.model.fight_groups()
+            self.model.recombine_groups()
 
-        all_groups = list(self.model.group_table.keys())
-        self.model.random.shuffle(all_groups)
-        for group in all_groups:
-            group.step_distrib()
+        self.model.make_choices()
+        self.model.distribute()
 
+        self.model.check_detectors()
         if self.model.log_basic:
-            self.model.logger.log_stats()
+            self.model.log_stats()
 
-        self.year += 1
\ No newline at end of file
+        self.year += 1
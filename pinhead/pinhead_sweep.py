@@ -0,0 +1,115 @@
+from pinhead_ensemble import PinheadEnsemble
+from pinhead_logging import RunRegistry
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import hashlib
+import math
+import json
+import os
+
+"""
+Dictionary Dictionary -> [List-of Dictionary]
+expands a parameter grid into its cells, each one the center params with one value of
+every axis. An axis is a param name and its values, or a tuple of names and tuples of
+values for params that change together, like distrib and mut_distrib
+**tested**
+"""
+def expand_grid(center, axes):
+    cells = []
+    for values in product(*axes.values()):
+        cell = dict(center)
+        for names, value in zip(axes.keys(), values):
+            if isinstance(names, tuple):
+                cell.update(zip(names, value))
+            else:
+                cell[names] = value
+        cells.append(cell)
+    return cells
+
+"""
+Dictionary Int Int -> [List-of Int]
+the seed of one replicate of a cell. It's built from the params of the cell rather than
+its place in the grid, so a task keeps its seed when the grid grows. The model's generator
+hashes the whole list through a SeedSequence, so every task gets an unrelated stream
+**tested**
+"""
+def task_seed(cell, replicate, seed=0):
+    key = hashlib.sha256(json.dumps(cell, sort_keys=True).encode()).hexdigest()
+    return [seed, int(key[:16], 16), replicate]
+
+"""
+RunRegistry Dictionary Dictionary Boolean -> Dictionary
+the entry in the manifest of a run, read back from its record in the registry
+"""
+def manifest_entry(registry, run, cell, skipped):
+    return {"params": cell, "seed": run["seed"], "stats": registry.stats_path(run), "years": run["years"],
+            "stopped_by": run["stopped_by"], "skipped": skipped}
+
+"""
+Dictionary [List-of [List-of Int]] -> [List-of Dictionary]
+runs a batch of replicates of a cell to the end in a worker process, side by side in one
+PinheadEnsemble, each from its own seed. Returns their entries in the manifest
+"""
+def run_task(cell, seeds):
+    ensemble = PinheadEnsemble(replicates=len(seeds), replicate_seeds=seeds, **cell, log_basic=True)
+    loggers = list(ensemble.loggers) # the ensemble drops the loggers of replicates that finish early
+    ensemble.main()
+
+    registry = loggers[0].registry
+    runs = {(run["prefix"], run["trial"]): run for run in registry.runs(loggers[0].directory)}
+    return [manifest_entry(registry, runs[(logger.prefix, logger.trial)], cell, False) for logger in loggers]
+
+"""
+[List-of Dictionary] Int Int String [Maybe Int] [Maybe Int] -> [List-of Dictionary]
+Runs replicates runs of every cell on a process pool, one worker per core by default, and
+appends their entries to the manifest at manifest_path as each batch finishes. A run the
+registry already has down as done with the same seed is skipped, and its earlier outcome
+goes in the manifest instead, so a sweep that was cut off can just be run again.
+
+The replicates of a cell that are left to run go through PinheadEnsembles of at most batch
+replicates each. By default batch is as large as it can be while still giving every worker
+a task. A batch that raises goes in the manifest with its error and the rest carry on.
+Returns the entries of the manifest
+**tested**
+"""
+def run_sweep(cells, replicates=1, seed=0, manifest_path="data/manifest.jsonl", workers=None, batch=None):
+    registry = RunRegistry()
+    done = {json.dumps(run["seed"]): run for run in registry.runs(status="done")}
+    workers = workers or os.cpu_count()
+
+    entries = []
+    pending = []
+    for cell in cells:
+        seeds = []
+        for replicate in range(replicates):
+            run_seed = task_seed(cell, replicate, seed)
+            run = done.get(json.dumps(run_seed))
+            if run is None:
+                seeds.append(run_seed)
+            else:
+                entries.append(manifest_entry(registry, run, cell, True))
+        if seeds:
+            pending.append((cell, seeds))
+
+    batch = batch or max(1, math.ceil(sum(len(seeds) for cell, seeds in pending) / workers))
+    tasks = [(cell, seeds[i:i + batch]) for cell, seeds in pending for i in range(0, len(seeds), batch)]
+
+    with open(manifest_path, "a") as manifest:
+        for entry in entries:
+            manifest.write(json.dumps(entry) + "\n")
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_task, cell, seeds): (cell, seeds) for cell, seeds in tasks}
+            for future in as_completed(futures):
+                try:
+                    batch_entries = future.result()
+                except Exception as error:
+                    cell, seeds = futures[future]
+                    batch_entries = [{"params": cell, "seed": run_seed, "error": repr(error), "skipped": False} for run_seed in seeds]
+                for entry in batch_entries:
+                    manifest.write(json.dumps(entry) + "\n")
+                manifest.flush()
+                entries.extend(batch_entries)
+
+    return entries
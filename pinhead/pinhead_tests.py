@@ -1,10 +1,22 @@
 import unittest
 import numpy as np
 import math
+import os
+import json
+import tempfile
+import gzip
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 from pinhead_model import PinheadModel
 from pinhead_agent import PinheadAgent
 from pinhead_agent import Strategy
+from pinhead_array_model import PinheadArrayModel
+from pinhead_ensemble import PinheadEnsemble
+from pinhead_logging import RunRegistry, read_stats, load_columns, COLUMN_STRATEGIES, COLUMN_METRICS
+from pinhead_detectors import CoopYears, Fixation, Extinction, Stationary
+from pinhead_sweep import expand_grid, task_seed, run_sweep
+from pinhead_kernels import choice_probabilities, civic_update, selfish_update, conflict_outcomes, group_payoffs, select_survivors, select_parents, shuffle_and_pair, segment_offsets, segment_counts
 
 class PinheadTests(unittest.TestCase):
     
@@ -825,6 +837,228 @@ class PinheadTests(unittest.TestCase):
                 corresp_group = i + 2 if i < 2 else i - 2
                 self.assertEqual(pm.indiv_table[agent], groups[corresp_group]) # agents are reflected
 
+    def testAddIndivs(self):
+        pm = PinheadModel(n=10, g=3)
+        groups = list(pm.group_table.keys())
+        old_counts = {group: group.agent_counts.copy() for group in groups}
+        old_total = pm.agent_counts[Strategy.SAINT]
+        first_id = pm.curr_indiv_id
+
+        new_indivs = pm.add_indivs([groups[0], groups[2], groups[0]], [Strategy.SAINT, Strategy.SAINT, Strategy.CIVIC], [1.5, 2, 3], [0.1, 0.2, 0.3])
+
+        self.assertEqual([indiv.id for indiv in new_indivs], [first_id, first_id + 1, first_id + 2])
+        self.assertEqual(pm.curr_indiv_id, first_id + 3)
+        self.assertEqual(len(pm.group_table[groups[0]]), 12)
+        self.assertEqual(len(pm.group_table[groups[1]]), 10)
+        self.assertEqual(len(pm.group_table[groups[2]]), 11)
+        self.assertEqual(pm.indiv_table[new_indivs[1]], groups[2])
+        self.assertEqual(groups[0].agent_counts[Strategy.SAINT], old_counts[groups[0]][Strategy.SAINT] + 1)
+        self.assertEqual(groups[0].agent_counts[Strategy.CIVIC], old_counts[groups[0]][Strategy.CIVIC] + 1)
+        self.assertEqual(groups[2].agent_counts[Strategy.SAINT], old_counts[groups[2]][Strategy.SAINT] + 1)
+        self.assertEqual(pm.agent_counts[Strategy.SAINT], old_total + 2)
+
+        self.assertEqual(new_indivs[2].fitness, 3)
+        self.assertEqual(new_indivs[2].avg_fitness, 3)
+        self.assertEqual(new_indivs[2].pi, 0.3)
+        self.assertEqual(new_indivs[2].avg_pi, 0.3)
+        self.assertTrue(new_indivs[2].is_new_agent)
+
+    def testAgentFlagEpochs(self):
+        pm = PinheadModel(n=10, g=3)
+        indivs = list(pm.indiv_table.keys())
+        self.assertTrue(all(indiv.is_new_agent for indiv in indivs))
+
+        indivs[0].migrated = True
+        indivs[0].migration_partner = indivs[1]
+        indivs[2].is_new_agent = False
+        self.assertTrue(indivs[0].migrated)
+        self.assertEqual(indivs[0].migration_partner, indivs[1])
+        self.assertFalse(indivs[2].is_new_agent)
+
+        # a new epoch clears every flag without touching the agents
+        pm.schedule.epoch += 1
+        self.assertFalse(any(indiv.is_new_agent or indiv.migrated for indiv in indivs))
+        self.assertIsNone(indivs[0].migration_partner)
+
+        indivs[3].is_new_agent = True
+        self.assertTrue(indivs[3].is_new_agent)
+        self.assertFalse(indivs[4].is_new_agent)
+
+    def testCheckAgentCounts(self):
+        pm = PinheadModel(n=20, g=10, p_con=0.5, p_mig=0.3, p_mutation=0.2, debug_counts=True)
+        for i in range(20):
+            pm.loop()
+
+        # the counts kept along the way match a recount
+        pm.check_agent_counts()
+        old_counts = pm.agent_counts.copy()
+        pm.refresh_agent_total_counts()
+        self.assertEqual(old_counts, pm.agent_counts)
+        self.assertEqual(sum(pm.agent_counts.values()), 200)
+
+        group = list(pm.group_table.keys())[0]
+        group.agent_counts[Strategy.SAINT] += 1
+        self.assertRaises(Exception, pm.check_agent_counts)
+        group.agent_counts[Strategy.SAINT] -= 1
+        pm.agent_counts[Strategy.SAINT] += 1
+        self.assertRaises(Exception, pm.check_agent_counts)
+
+    def testReserveIds(self):
+        pm = PinheadModel(n=10, g=6, p_con=0.5, p_survive=0.6)
+        self.assertEqual(pm.curr_indiv_id, 60)
+        self.assertEqual(pm.curr_group_id, 6)
+
+        first_id = pm.reserve_indiv_ids(5)
+        self.assertEqual(first_id, 60)
+        self.assertEqual(pm.reserve_indiv_ids(), 65)
+        self.assertEqual(pm.reserve_group_ids(3), 6)
+        self.assertEqual(pm.curr_group_id, 9)
+
+        for i in range(5):
+            pm.loop()
+
+        # ids stay unique integers, and labels are built from them
+        ids = [indiv.id for indiv in pm.indiv_table]
+        self.assertEqual(len(set(ids)), 60)
+        self.assertTrue(all(isinstance(i, int) and i < pm.curr_indiv_id for i in ids))
+        for group in pm.group_table:
+            self.assertEqual(group.unique_id, "g" + str(group.id))
+            self.assertLess(group.id, pm.curr_group_id)
+            for indiv in pm.group_table[group]:
+                self.assertEqual(indiv.unique_id, "i" + str(indiv.id))
+
+        # agents built from a label still advance the counter
+        group = list(pm.group_table.keys())[0]
+        new_agent = PinheadAgent("i" + str(pm.curr_indiv_id + 10), pm, Strategy.SAINT, group)
+        self.assertEqual(new_agent.id, pm.curr_indiv_id - 1)
+        self.assertEqual(pm.reserve_indiv_ids(), new_agent.id + 1)
+
+    def testRegroup(self):
+        pm = PinheadModel(n=30, g=8, distrib={"miscreant": 0.2, "deceiver": 0.2, "citizen": 0.2, "saint": 0.2, "civic": 0.1, "selfish": 0.1, "static": 0})
+        for i in range(3):
+            for agent in pm.indiv_table:
+                agent.migrated = False
+            pm.recombine_groups()
+
+            groups = list(pm.group_table.keys())
+            for group, agents in pm.group_table.items():
+                self.assertEqual(len(agents), 30)
+
+                counts = {strat: 0 for strat in Strategy}
+                for agent in agents:
+                    self.assertEqual(pm.indiv_table[agent], group)
+                    counts[agent.strategy] += 1
+                self.assertEqual(counts, group.agent_counts)
+
+            # partners are mutual, and migrants only ever swap with each other
+            for agent in pm.indiv_table:
+                partner = agent.migration_partner
+                if partner is not None:
+                    self.assertEqual(partner.migration_partner, agent)
+                    self.assertEqual(agent.migrated, partner.migrated)
+
+        # regroup puts agents wherever the index says
+        indivs = list(pm.indiv_table.keys())
+        group_index = np.arange(len(indivs)) % 8
+        for indiv, k in zip(indivs, group_index):
+            pm.indiv_table[indiv] = groups[k]
+        pm.regroup(groups, indivs, group_index)
+
+        for k, group in enumerate(groups):
+            self.assertEqual(pm.group_table[group], indivs[k::8])
+            self.assertEqual(sum(group.agent_counts.values()), 30)
+
+    def testMakeChoices(self):
+        pm = PinheadModel(n=50, g=20, distrib={"miscreant": 0.2, "deceiver": 0.2, "citizen": 0.2, "saint": 0.2, "civic": 0, "selfish": 0, "static": 0.2}, epsilon=0.1)
+        for i in range(3):
+            pm.loop()
+
+        # without randomness every agent takes its default choice, which matches its own make_choice
+        pm.make_choices(rand=False)
+        for agent in pm.indiv_table:
+            self.assertEqual(agent.fitness, pm.fitness)
+            self.assertEqual(agent.cooperates, agent.default_choice)
+            p_coop = agent.p_coop
+            self.assertEqual(agent.make_choice(rand=False), agent.cooperates)
+            self.assertAlmostEqual(agent.p_coop, p_coop)
+
+        # with randomness, agents cooperate with probability p_coop and are caught with probability p_obs
+        coop_count = 0
+        obs_count = 0
+        expected_coop = 0
+        expected_obs = 0
+        for k in range(10):
+            pm.make_choices()
+            for agent in pm.indiv_table:
+                coop_count += agent.cooperates
+                obs_count += agent.observed
+                expected_coop += agent.p_coop
+                expected_obs += agent.p_obs
+        
+        self.assertLess(abs(coop_count - expected_coop), 300) # PROB
+        self.assertLess(abs(obs_count - expected_obs), 300) # PROB
+
+    def testModelLearn(self):
+        pm = PinheadModel(n=40, g=10, distrib={"miscreant": 0, "deceiver": 0, "citizen": 0, "saint": 0.2, "civic": 0.3, "selfish": 0.3, "static": 0.2})
+        for i in range(3):
+            pm.loop()
+
+        indivs = list(pm.indiv_table.keys())
+        groups = list(pm.indiv_table.values())
+        before = {indiv: (indiv.pi, indiv.avg_pi) for indiv in indivs}
+        pm.learn(indivs, groups, np.array([indiv.strategy.value for indiv in indivs]), rand=False)
+        after = {indiv: (indiv.pi, indiv.avg_pi) for indiv in indivs}
+
+        # compare with each agent learning on its own
+        for indiv in indivs:
+            indiv.pi, indiv.avg_pi = before[indiv]
+            if indiv.strategy == Strategy.CIVIC:
+                indiv.civic_learn()
+            elif indiv.strategy == Strategy.SELFISH:
+                indiv.selfish_learn(rand=False)
+
+            self.assertAlmostEqual(indiv.pi, after[indiv][0])
+            self.assertAlmostEqual(indiv.avg_pi, after[indiv][1])
+
+    def testDistributePayoffs(self):
+        pm = PinheadModel(n=24, g=30, benefit=4.25, cost=1.4, fitness=2)
+
+        for k in range(3):
+            for group, agents in pm.group_table.items():
+                for agent in agents:
+                    agent.cooperates = np.random.uniform(0, 1) < 0.5
+                    agent.observed = np.random.uniform(0, 1) < 0.5
+                    agent.fitness = 2
+                    agent.avg_fitness = 3
+
+            # one agent per group of a third of the groups is caught defecting, the rest defect unobserved
+            for j, agents in enumerate(pm.group_table.values()):
+                if j % 3 == 0:
+                    for i, agent in enumerate(agents):
+                        agent.cooperates = False
+                        agent.observed = (i == 0)
+
+            pm.distribute_payoffs()
+            batched = {group: (group.num_cooperated, group.average_benefit, group.average_fitness) for group in pm.group_table}
+            batched_fitness = {agent: (agent.fitness, agent.avg_fitness) for agent in pm.indiv_table}
+
+            # compare with distributing group by group
+            for agent in pm.indiv_table:
+                agent.fitness = 2
+                agent.avg_fitness = 3
+            for group in pm.group_table:
+                group.step_distrib()
+                self.assertEqual(group.num_cooperated, batched[group][0])
+                self.assertAlmostEqual(group.average_benefit, batched[group][1])
+                self.assertAlmostEqual(group.average_fitness, batched[group][2])
+            
+            for agent in pm.indiv_table:
+                self.assertAlmostEqual(agent.fitness, batched_fitness[agent][0])
+                self.assertAlmostEqual(agent.avg_fitness, batched_fitness[agent][1])
+
+            for t in range(k * 3):
+                pm.loop()
+
     # PinheadAgent tests --------------------------------------------------
     def testAddToGroup(self):
         pm = PinheadModel(n=20, g=10)
@@ -1518,10 +1752,943 @@ class PinheadTests(unittest.TestCase):
         self.assertGreater(counts[Strategy.CITIZEN], 3000 - 200)
         self.assertLess(counts[Strategy.CITIZEN], 3000 + 200)
 
+    def testModelDeath(self):
+        pm = PinheadModel(n=10, g=5, p_survive=0.8)
 
+        indiv_fitnesses = [4,12,6,4,5,16,19,3,0,1,3,5,11,2,18,16,6,8,9,20,2,6,6,8,10,4,10,3,7,2,0,2,3,1,4,0,1,1,1,1,0,0,0,0,0,0,0,0,0,0]
+        expected_probs = [0.057142857,0.171428571,0.085714286,0.057142857,0.071428571,0.228571429,0.271428571,0.042857143,0,0.014285714,0.030612245,0.051020408,0.112244898,0.020408163,0.183673469,0.163265306,0.06122449,0.081632653,0.091836735,0.204081633,0.034482759,0.103448276,0.103448276,0.137931034,0.172413793,0.068965517,0.172413793,0.051724138,0.120689655,0.034482759,0,0.142857143,0.214285714,0.071428571,0.285714286,0,0.071428571,0.071428571,0.071428571,0.071428571,0.1,0.1,0.1,0.1,0.1,0.1,0.1,0.1,0.1,0.1]
 
+        groups = list(pm.group_table.keys())
+        old_agent_lists = []
+        for i, group in enumerate(groups):
+            for j, agent in enumerate(pm.group_table[group]):
+                agent.fitness = indiv_fitnesses[i*10 + j]
+            old_agent_lists.append(pm.group_table[group].copy())
+
+        n_deaths = pm.death(groups)
+        self.assertEqual(n_deaths, [2] * 5)
+        self.assertEqual(len(pm.indiv_table), 40)
+
+        for i, group in enumerate(groups):
+            self.assertEqual(len(pm.group_table[group]), 8)
+            self.assertEqual(sum(group.agent_counts.values()), 8)
+            for j, agent in enumerate(old_agent_lists[i]):
+                self.assertAlmostEqual(agent.s_prob, expected_probs[i*10 + j])
+                self.assertEqual(agent in pm.indiv_table, agent in pm.group_table[group])
+
+        # the prevalence of each fitness level among the survivors follows the survival weights
+        pm = PinheadModel(n=20000, g=4, p_survive=0.05)
+        subgroup_fitnesses = [[2, 1, 0.6, 0.4], [8, 4, 2, 1], [4, 3, 2, 1], [5, 4, 1, 0]]
+        approximate_percentages = [[0.5, 0.25, 0.125, 0.125], [8/15, 4/15, 2/15, 1/15], [4/10, 3/10, 2/10, 1/10], [0.5, 0.4, 0.1, 0]]
+
+        groups = list(pm.group_table.keys())
+        for i, group in enumerate(groups):
+            for j, agent in enumerate(pm.group_table[group]):
+                agent.fitness = subgroup_fitnesses[i][math.floor(j / 5000)]
+
+        self.assertEqual(pm.death(groups), [19000] * 4)
 
+        for i, group in enumerate(groups):
+            counts = {fitness: 0 for fitness in subgroup_fitnesses[i]}
+            for agent in pm.group_table[group]:
+                counts[agent.fitness] += 1
+
+            for fitness, percentage in zip(subgroup_fitnesses[i], approximate_percentages[i]):
+                self.assertGreater(counts[fitness], 1000*percentage - 70) # PROB
+                self.assertLess(counts[fitness], 1000*percentage + 70) # PROB
+
+    def testModelBirth(self):
+        # check that agents reproduce in proportion to their fitnesses, in all groups at once
+        pm = PinheadModel(n=12000, g=3, p_mutation=0)
+        splits = [[3000, 6000, 9000, 12000], [9000, 12000], [4000, 8000, 12000]]
+        fitnesses = [[4, 3, 2, 1], [3, 9], [5, 4, 1]]
+        groups = list(pm.group_table.keys())
+
+        for i, group in enumerate(groups):
+            curr_index = 0
+            for j, agent in enumerate(pm.group_table[group]):
+                if j >= splits[i][curr_index]:
+                    curr_index += 1
+
+                agent.fitness = fitnesses[i][curr_index]
+
+        pm.birth(groups, [5000, 2000, 0])
+
+        for i, (group, births) in enumerate(zip(groups, [5000, 2000, 0])):
+            self.assertEqual(len(pm.group_table[group]), 12000 + births)
+
+            fitness_counts = {fitness: 0 for fitness in fitnesses[i]}
+            for agent in pm.group_table[group]:
+                fitness_counts[agent.fitness] += 1
+
+            total_fitness = 0
+            for bucket, fitness in enumerate(fitnesses[i]):
+                initial_pop = splits[i][bucket] if bucket == 0 else splits[i][bucket] - splits[i][bucket - 1]
+                total_fitness += initial_pop * fitness
+
+            for bucket, fitness in enumerate(fitnesses[i]):
+                initial_pop = splits[i][bucket] if bucket == 0 else splits[i][bucket] - splits[i][bucket - 1]
+                expectation = initial_pop + births*initial_pop*fitness / total_fitness
+                self.assertGreater(fitness_counts[fitness], expectation - 150) # PROB
+                self.assertLess(fitness_counts[fitness], expectation + 150) # PROB
+
+                # r_prob is the share of the group's fitness
+                agent = pm.group_table[group][splits[i][bucket] - 1]
+                self.assertAlmostEqual(agent.r_prob, fitness / total_fitness)
+
+        # check that around the correct numbers of agents mutate, and that pi is inherited
+        pm = PinheadModel(n=1000, g=10, distrib={"miscreant": 0, "deceiver": 0, "citizen": 1, "saint": 0},
+                            mut_distrib={"miscreant": 0.25, "deceiver": 0.25, "citizen": 0.25, "saint": 0.25},
+                            p_mutation=0.6)
+
+        for agent in pm.indiv_table:
+            agent.pi = 0.5
+        pm.birth(list(pm.group_table.keys()), [1000] * 10)
 
+        counts = {strat: 0 for strat in Strategy}
+        for agent in pm.indiv_table:
+            counts[agent.strategy] += 1
+
+        self.assertEqual(sum(counts.values()), 20000)
+        self.assertGreater(counts[Strategy.CITIZEN], 10000 + 4000 + 1500 - 150)
+        self.assertLess(counts[Strategy.CITIZEN], 10000 + 4000 + 1500 + 150)
+        for strat in [Strategy.SAINT, Strategy.MISCREANT, Strategy.DECEIVER]:
+            self.assertGreater(counts[strat], 1500 - 150)
+            self.assertLess(counts[strat], 1500 + 150)
+
+        new_pis = np.array([agent.pi for agent in pm.indiv_table if agent.is_new_agent and agent.pi != 0.5])
+        self.assertEqual(len(new_pis), 10000)
+        self.assertAlmostEqual(new_pis.mean(), 0.5, places=2)
+        self.assertAlmostEqual(new_pis.std(), 0.05, places=2)
+
+        for group in pm.group_table:
+            self.assertEqual(sum(group.agent_counts.values()), 2000)
+
+    def testReproduce(self):
+        pm = PinheadModel(n=40, g=25, p_survive=0.7, p_mutation=0.05)
+        for i in range(3):
+            pm.loop()
+
+        old_indivs = set(pm.indiv_table)
+        pm.reproduce()
+
+        self.assertEqual(len(pm.indiv_table), 1000)
+        self.assertEqual(len(old_indivs & set(pm.indiv_table)), 25 * 28)
+        for group, agents in pm.group_table.items():
+            self.assertEqual(len(agents), 40)
+            self.assertEqual(sum(group.agent_counts.values()), 40)
+            for agent in agents:
+                self.assertEqual(pm.indiv_table[agent], group)
+
+
+
+
+    # PinheadArrayModel tests ----------------------------------------------------------
+    def testArrayInvariants(self):
+        pm = PinheadArrayModel(n=100, g=100, p_survive=0.6, p_con=0, p_mig=0.25, benefit=4, cost=1.5, fitness=2, epsilon=0.15, threshold=0.3)
+        steps = 20
+        for i in range(steps):
+            pm.loop()
+
+            # every group holds n agents, and the counts agree with the arrays
+            self.assertEqual(len(pm.group), 10000)
+            self.assertTrue((np.bincount(pm.group, minlength=100) == 100).all())
+            counts = pm.group_strategy_counts()
+            for strat in Strategy:
+                self.assertEqual(counts[:, strat.value].sum(), pm.agent_counts[strat])
+                self.assertEqual((pm.strategy == strat.value).sum(), pm.agent_counts[strat])
+
+            # cooperation
+            if i != 0:
+                benefit = old_average_benefit[pm.group]
+                prop_cooperators = old_num_cooperated[pm.group] / 100
+                deceiver_coop = pm.p_obs * benefit >= 1.5
+                expectations = {
+                    Strategy.MISCREANT: np.zeros(10000, dtype=bool),
+                    Strategy.DECEIVER: deceiver_coop,
+                    Strategy.CITIZEN: (prop_cooperators >= 0.3) | deceiver_coop,
+                    Strategy.SAINT: np.ones(10000, dtype=bool)
+                }
+                for strat, expectation in expectations.items():
+                    mask = pm.strategy == strat.value
+                    as_expected = (pm.cooperates[mask] == expectation[mask]).sum()
+                    self.assertGreater(as_expected, 0.85 * mask.sum() - 250) # PROB
+                    self.assertLess(as_expected, 0.85 * mask.sum() + 250) # PROB
+
+            # distrib
+            for k in range(100):
+                members = pm.group == k
+                cooperates = pm.cooperates[members]
+                caught = pm.observed[members] & ~cooperates
+                fitness = pm.fitness[members]
+
+                self.assertAlmostEqual(pm.average_fitness[k], fitness.sum()/100)
+                self.assertEqual(pm.num_cooperated[k], cooperates.sum())
+                self.assertAlmostEqual(pm.average_benefit[k], (cooperates.sum()*4)/(100 - caught.sum()))
+
+                self.assertTrue((fitness[caught] == 2).all())
+                self.assertTrue(np.allclose(fitness[~caught & ~cooperates], 2 + pm.average_benefit[k]))
+                self.assertTrue(np.allclose(fitness[cooperates], 0.5 + pm.average_benefit[k]))
+
+            # death and migration
+            if i != 0:
+                survived = np.isin(pm.indiv_id, old_indiv_id)
+                old_positions = {indiv_id: j for j, indiv_id in enumerate(old_indiv_id.tolist())}
+
+                same_group_counter = 0
+                for j in np.flatnonzero(survived):
+                    if pm.group[j] == old_group[old_positions[pm.indiv_id[j]]]:
+                        same_group_counter += 1
+                        self.assertFalse(pm.is_new_agent[j])
+                        self.assertFalse(pm.migrated[j])
+                    else:
+                        self.assertTrue(pm.migrated[j])
+                        self.assertTrue(pm.is_new_agent[j])
+                self.assertTrue(pm.is_new_agent[~survived].all())
+
+                # check that the average fitness of dead is lower than the survived
+                killed = ~np.isin(old_indiv_id, pm.indiv_id)
+                survived_fitness = old_fitness[[old_positions[indiv_id] for indiv_id in pm.indiv_id[survived].tolist()]]
+                self.assertGreater(survived_fitness.mean(), old_fitness[killed].mean())
+
+                # 60% should have survived
+                self.assertEqual(survived.sum(), 6000)
+
+                # the newly born agents (4000) and the old agents that migrated (~1500) are new agents
+                self.assertGreater(pm.is_new_agent.sum(), 5500 - 250) # PROB
+                self.assertLess(pm.is_new_agent.sum(), 5500 + 250) # PROB
+
+                # 75% (4500) of the remaining agents should be in the same groups
+                self.assertGreater(same_group_counter, 4500 - 250) # PROB
+                self.assertLess(same_group_counter, 4500 + 250) # PROB
+
+                # 25% of the agents should have just migrated
+                self.assertGreater(pm.migrated.sum(), 2500 - 250) # PROB
+                self.assertLess(pm.migrated.sum(), 2500 + 250) # PROB
+
+            # store some old values
+            old_indiv_id = pm.indiv_id.copy()
+            old_group = pm.group.copy()
+            old_fitness = pm.fitness.copy()
+            old_average_benefit = pm.average_benefit.copy()
+            old_num_cooperated = pm.num_cooperated.copy()
+
+    def testArrayCheckAgentCounts(self):
+        pm = PinheadArrayModel(n=20, g=10, p_con=0.5, p_mig=0.3, p_mutation=0.2, debug_counts=True)
+        for i in range(20):
+            pm.loop()
+
+        pm.check_agent_counts()
+        self.assertEqual(list(pm.strategy_totals), list(np.bincount(pm.strategy, minlength=8)))
+        self.assertEqual(sum(pm.agent_counts.values()), 200)
+
+        pm.strategy[0] = Strategy.SAINT.value if pm.strategy[0] != Strategy.SAINT.value else Strategy.CIVIC.value
+        self.assertRaises(Exception, pm.check_agent_counts)
+
+    def testArrayChoiceProbabilities(self):
+        pm = PinheadArrayModel(n=4, g=4, cost=1, fitness=2, epsilon=0.1, threshold=0.5, learning_rate=0.2, present_weight=0.2)
+
+        strategies = [Strategy.MISCREANT, Strategy.SAINT, Strategy.DECEIVER, Strategy.DECEIVER,
+                        Strategy.CITIZEN, Strategy.CITIZEN, Strategy.CITIZEN, Strategy.CITIZEN,
+                        Strategy.STATIC, Strategy.STATIC, Strategy.CIVIC, Strategy.CIVIC,
+                        Strategy.SELFISH, Strategy.SELFISH, Strategy.SELFISH, Strategy.SELFISH]
+        p_obses = [0.9, 0.1, 0.2, 0.8, 0.2, 0.8, 0.2, 0.8, 0.6, 0.6, 0.2, 0.2, 0.2, 0.6, 0.2, 0.6]
+        pis = [0, 0, 0, 0, 0, 0, 0, 0, 0.3, 0.6, 0.3, 0.6, 0.3, 0.6, 0.3, 0.6]
+        cooperates = [False, True, False, True, False, True, False, True, True, True, False, True, False, True, False, True]
+
+        pm.strategy[:] = [strat.value for strat in strategies]
+        pm.group[:] = np.repeat(np.arange(4), 4)
+        pm.average_benefit[:] = [2, 2, 2, 1.25]
+        pm.num_cooperated[:] = [4, 0, 3, 1]
+        pm.p_obs[:] = p_obses
+        pm.pi[:] = pis
+        pm.avg_pi[:] = 0.5
+        pm.avg_fitness[:] = 2
+
+        p_coop = pm.choice_probabilities()
+        for i in range(16):
+            self.assertAlmostEqual(p_coop[i], 0.9 if cooperates[i] else 0.1)
+
+        # static learners don't learn, civic learners learn from their group, selfish learners from their fitness
+        self.assertEqual(list(pm.pi[8:10]), [0.3, 0.6])
+        self.assertAlmostEqual(pm.pi[10], 0.8*0.3 + 0.2)
+        self.assertAlmostEqual(pm.pi[11], 0.8*0.6 + 0.2)
+        self.assertAlmostEqual(pm.avg_pi[10], 0.8*0.5 + 0.2*(0.8*0.3 + 0.2))
+        self.assertEqual(list(pm.pi[12:]), [0.3, 0.6, 0.3, 0.6])
+
+    def testArraySelfishLearn(self):
+        pm = PinheadArrayModel(n=16, g=1, present_weight=0.2)
+        fitnesses = [7,7,7,7,7,7,7,7,4,4,4,4,4,4,4,4]
+        pis = [0.6,0.6,0.6,0.6,0.2,0.2,0.2,0.2,0.6,0.6,0.6,0.6,0.2,0.2,0.2,0.2]
+        expected_pis = [0.628571429,0.628571429,0.628571429,0.628571429,0.114285714,0.114285714,0.114285714,0.114285714,0.575,0.575,0.575,0.575,0.275,0.275,0.275,0.275]
+
+        pm.fitness[:] = fitnesses
+        pm.pi[:] = pis
+        pm.avg_pi[:] = 0.5
+        pm.avg_fitness[:] = 5
+
+        pm.selfish_learn(np.ones(16, dtype=bool), rand=False)
+        for i in range(16):
+            self.assertAlmostEqual(pm.pi[i], expected_pis[i])
+            self.assertAlmostEqual(pm.avg_pi[i], 0.8*0.5 + 0.2*expected_pis[i])
+
+    def testArrayReproduce(self):
+        pm = PinheadArrayModel(n=1000, g=10, p_survive=0.6, p_mutation=0.6,
+                                distrib={"miscreant": 0, "deceiver": 0, "citizen": 1, "saint": 0},
+                                mut_distrib={"miscreant": 0.25, "deceiver": 0.25, "citizen": 0.25, "saint": 0.25})
+        pm.fitness[:] = np.tile(np.repeat([3.0, 1.0], 500), 10)
+        pm.pi[:] = 0.5
+        pm.is_new_agent[:] = False
+        old_ids = pm.indiv_id.copy()
+
+        pm.reproduce()
+
+        # group sizes are unchanged, the dead were replaced by newborns with fresh ids
+        self.assertTrue((np.bincount(pm.group) == 1000).all())
+        newborn = ~np.isin(pm.indiv_id, old_ids)
+        self.assertEqual(newborn.sum(), 4000)
+        self.assertEqual(len(np.unique(pm.indiv_id)), 10000)
+        self.assertTrue((pm.is_new_agent == newborn).all())
+
+        # fitter agents survive and reproduce more
+        fit_survivors = (pm.fitness[~newborn] == 3).sum()
+        self.assertGreater(fit_survivors, 3000) # PROB
+        expected_fit_newborns = 4000 * 3*fit_survivors / (3*fit_survivors + (6000 - fit_survivors))
+        self.assertGreater((pm.fitness[newborn] == 3).sum(), expected_fit_newborns - 150) # PROB
+        self.assertLess((pm.fitness[newborn] == 3).sum(), expected_fit_newborns + 150) # PROB
+        self.assertTrue((pm.avg_fitness[newborn] == pm.fitness[newborn]).all())
+
+        # 40% of newborns stay citizens, the other 60% are spread over the four strategies
+        self.assertGreater((pm.strategy[newborn] == Strategy.CITIZEN.value).sum(), 1600 + 600 - 150) # PROB
+        self.assertLess((pm.strategy[newborn] == Strategy.CITIZEN.value).sum(), 1600 + 600 + 150) # PROB
+        self.assertGreater((pm.strategy[newborn] == Strategy.SAINT.value).sum(), 600 - 100) # PROB
+        self.assertLess((pm.strategy[newborn] == Strategy.SAINT.value).sum(), 600 + 100) # PROB
+
+        # pi is inherited with a little noise
+        self.assertAlmostEqual(pm.pi[newborn].mean(), 0.5, places=2) # PROB
+        self.assertAlmostEqual(pm.pi[newborn].std(), 0.05, places=2) # PROB
+        self.assertTrue((pm.avg_pi[newborn] == pm.pi[newborn]).all())
+
+    def testArrayFightGroups(self):
+        # check that a fight occurs about p_con fraction of the time
+        pm = PinheadArrayModel(n=5, g=10000, p_con=0.3)
+        pm.fight_groups()
+
+        self.assertTrue(pm.fought.sum() > 1500 - 150 and pm.fought.sum() < 1500 + 150) # PROB
+        self.assertTrue(((pm.enemy >= 0) == pm.fought).all())
+        self.assertEqual(pm.curr_group_id, 10000 + pm.fought.sum())
+        self.assertEqual(len(np.unique(pm.group_id)), 10000)
+
+        # check that expected groups end up replacing and being replaced
+        pm = PinheadArrayModel(n=5, g=103)
+        pm.average_fitness[:] = np.where(np.arange(103) % 2 == 0, 20, 13)
+        old_strategy = pm.strategy.copy()
+        old_fitness = pm.fitness.copy()
+        old_group_id = pm.group_id.copy()
+        pm.fitness[:] = np.arange(515)
+
+        pm.fight_groups(rand=False)
+
+        for i in range(103):
+            if i < 51:
+                winner = i if i % 2 == 0 else i + 51
+            elif i < 102:
+                winner = i if i % 2 == 0 else i - 51
+            else:
+                winner = i
+
+            if winner == i:
+                self.assertEqual(pm.group_id[i], old_group_id[i])
+                self.assertEqual(pm.fought[i], i != 102)
+            else:
+                # the loser's slot holds a new group, made of copies of the winner's agents
+                self.assertGreaterEqual(pm.group_id[i], 103)
+                self.assertEqual(pm.enemy[winner], old_group_id[i])
+                self.assertFalse(pm.fought[i])
+                self.assertEqual(list(pm.strategy[5*i:5*i + 5]), list(old_strategy[5*winner:5*winner + 5]))
+                self.assertEqual(list(pm.fitness[5*i:5*i + 5]), list(np.arange(5*winner, 5*winner + 5)))
+                self.assertTrue(pm.is_new_agent[5*i:5*i + 5].all())
+                self.assertTrue((pm.pi[5*i:5*i + 5] == 0).all())
+
+    def testArrayRecombineGroups(self):
+        # probabilistic test to check that about p_mig fractions of agents migrate
+        pm = PinheadArrayModel(n=100, g=100, p_mig=0.15)
+        pm.is_new_agent[:] = False
+        old_group = pm.group.copy()
+
+        pm.recombine_groups()
+
+        moved = pm.group != old_group
+        self.assertTrue((moved == pm.migrated).all())
+        self.assertTrue((moved == pm.is_new_agent).all())
+        self.assertTrue(moved.sum() > 1250 and moved.sum() < 1750) # PROB
+        self.assertTrue((np.bincount(pm.group) == 100).all())
+        self.assertTrue((pm.migration_partner >= 0).all())
+
+        # non-probabilistic test to make sure everyone ended up in the correct group
+        pm = PinheadArrayModel(n=6, g=4)
+        pm.recombine_groups(rand=False)
+        self.assertEqual(list(pm.group), [2]*6 + [3]*6 + [0]*6 + [1]*6)
+        self.assertTrue(pm.migrated.all())
+
+    def testArraySaintlyGroup(self):
+        pm = PinheadArrayModel(n=100, g=51, distrib={"miscreant": 0.1, "deceiver": 0.2, "citizen": 0.3, "saint": 0.4}, saintly_group=True)
+
+        self.assertEqual(pm.num_groups, 50)
+        counts = pm.group_strategy_counts()
+        self.assertEqual(counts[0, Strategy.CITIZEN.value], 50)
+        self.assertEqual(counts[0, Strategy.SAINT.value], 50)
+        self.assertTrue(pm.agent_counts[Strategy.MISCREANT] > 400 and pm.agent_counts[Strategy.MISCREANT] < 600) # PROB
+        self.assertTrue(pm.agent_counts[Strategy.SAINT] > 1850 and pm.agent_counts[Strategy.SAINT] < 2150) # PROB
+
+    # pinhead_kernels tests ----------------------------------------------------------
+    def testSegmentOffsets(self):
+        offsets = segment_offsets(np.array([2, 0, 2, 3, 0, 2]), 5)
+        self.assertEqual(list(offsets), [0, 2, 2, 5, 6, 6])
+
+    def testSegmentCounts(self):
+        counts = segment_counts(np.array([2, 0, 2, 1, 0, 2]), np.array([1, 1, 3, 0, 1, 3]), 3, 4)
+        self.assertEqual(counts.tolist(), [[0, 2, 0, 0], [1, 0, 0, 0], [0, 1, 0, 2]])
+
+    def testChoiceProbabilities(self):
+        strategy = np.array([strat.value for strat in [Strategy.MISCREANT, Strategy.SAINT, Strategy.DECEIVER, Strategy.DECEIVER,
+                        Strategy.CITIZEN, Strategy.CITIZEN, Strategy.CITIZEN, Strategy.STATIC, Strategy.CIVIC, Strategy.SELFISH]])
+        p_obs = np.array([0.9, 0.1, 0.2, 0.8, 0.2, 0.2, 0.8, 0.6, 0.2, 0.6])
+        pi = np.array([0, 0, 0, 0, 0, 0, 0, 0.3, 0.3, 0.6])
+        average_benefit = np.array([2, 2, 2, 2, 2, 1.25, 1.25, 2, 2, 1.25])
+        prop_cooperators = np.array([1, 1, 1, 1, 0.25, 0.25, 0.25, 0.5, 0.5, 0.25])
+
+        p_coop = choice_probabilities(strategy, p_obs, pi, average_benefit, prop_cooperators, 2, 1, 0.5, 0.1)
+        cooperates = [False, True, False, True, False, False, True, True, False, True]
+        self.assertTrue(np.allclose(p_coop, np.where(cooperates, 0.9, 0.1)))
+
+    def testLearnerUpdates(self):
+        pi, avg_pi = civic_update(np.array([0.3, 0.6, 0.2]), np.array([0.5, 0.5, 0.1]), np.array([0.5, 0.25, 0.75]), 0.5, 0.2, 0.2)
+        self.assertTrue(np.allclose(pi, [0.8*0.3 + 0.2, 0.8*0.6, 0.8*0.2 + 0.2]))
+        self.assertTrue(np.allclose(avg_pi, [0.8*0.5 + 0.2*pi[0], 0.8*0.5 + 0.2*pi[1], 0.8*0.1 + 0.2*pi[2]]))
+
+        pi, avg_pi = selfish_update(np.array([0.3, 0.6, 0.5]), np.array([0.5, 0.5, 0.1]), np.array([2.0, 4.0, 0.0]), np.array([3.0, 2.0, 1.0]), 0.2)
+        self.assertTrue(np.allclose(pi, [0.3 + (-0.2)*(-1)/2, 0.6 + 0.1*2/4, 0.5])) # zero fitness doesn't move
+        self.assertTrue(np.allclose(avg_pi, 0.8*np.array([0.5, 0.5, 0.1]) + 0.2*pi))
+
+        # noise scales with the size of the step
+        pi, _ = selfish_update(np.array([0.3, 0.6]), np.array([0.5, 0.5]), np.array([2.0, 4.0]), np.array([3.0, 2.0]), 0.2, noise=np.array([1.0, -2.0]))
+        self.assertTrue(np.allclose(pi, [0.3 + 0.1 + 0.05, 0.6 + 0.05 - 0.05]))
+
+    def testGroupPayoffs(self):
+        group = np.array([0, 0, 0, 0, 1, 1, 1, 2, 2])
+        cooperates = np.array([True, True, False, False, True, False, False, False, False])
+        observed = np.array([True, False, True, False, False, True, True, True, True])
+
+        num_cooperated, num_rewarded, average_benefit, fitness_delta = group_payoffs(group, cooperates, observed, 3, 4.25, 1.4)
+
+        self.assertEqual(list(num_cooperated), [2, 1, 0])
+        self.assertEqual(list(num_rewarded), [3, 1, 0])
+        self.assertTrue(np.allclose(average_benefit, [2*4.25/3, 4.25, 0]))
+        self.assertTrue(np.allclose(fitness_delta, [2*4.25/3 - 1.4, 2*4.25/3 - 1.4, 0, 2*4.25/3, 4.25 - 1.4, 0, 0, 0, 0]))
+
+    def testSelectSurvivors(self):
+        rng = np.random.default_rng()
+        group = np.repeat(np.arange(5), 10)
+        fitness = np.array([4,12,6,4,5,16,19,3,0,1,3,5,11,2,18,16,6,8,9,20,2,6,6,8,10,4,10,3,7,2,0,2,3,1,4,0,1,1,1,1,0,0,0,0,0,0,0,0,0,0], dtype=float)
+        expected_probs = [0.057142857,0.171428571,0.085714286,0.057142857,0.071428571,0.228571429,0.271428571,0.042857143,0,0.014285714,0.030612245,0.051020408,0.112244898,0.020408163,0.183673469,0.163265306,0.06122449,0.081632653,0.091836735,0.204081633,0.034482759,0.103448276,0.103448276,0.137931034,0.172413793,0.068965517,0.172413793,0.051724138,0.120689655,0.034482759,0,0.142857143,0.214285714,0.071428571,0.285714286,0,0.071428571,0.071428571,0.071428571,0.071428571,0.1,0.1,0.1,0.1,0.1,0.1,0.1,0.1,0.1,0.1]
+
+        survives, s_prob = select_survivors(fitness, group, 5, 0.8, rng)
+        self.assertTrue(np.allclose(s_prob, expected_probs))
+        self.assertTrue((np.bincount(group[survives]) == 8).all())
+
+        # survivors are drawn in proportion to fitness, without replacement
+        subgroup_fitnesses = [[2, 1, 0.6, 0.4], [8, 4, 2, 1], [4, 3, 2, 1], [3, 2.9, 2.1, 2], [5, 4, 1, 0]]
+        approximate_percentages = [[0.5, 0.25, 0.125, 0.125], [8/15, 4/15, 2/15, 1/15], [4/10, 3/10, 2/10, 1/10], [0.3, 0.3, 0.2, 0.2], [0.5, 0.4, 0.1, 0]]
+        group = np.repeat(np.arange(5), 100000)
+        fitness = np.concatenate([np.repeat(fitnesses, 25000) for fitnesses in subgroup_fitnesses])
+
+        survives, _ = select_survivors(fitness, group, 5, 0.05, rng)
+        self.assertTrue((np.bincount(group[survives]) == 5000).all())
+        for i in range(5):
+            for j in range(4):
+                count = (survives & (group == i) & (fitness == subgroup_fitnesses[i][j])).sum()
+                self.assertGreater(count, 5000*approximate_percentages[i][j] - 250) # PROB
+                self.assertLess(count, 5000*approximate_percentages[i][j] + 250) # PROB
+
+    def testSelectParents(self):
+        rng = np.random.default_rng()
+        group = np.repeat(np.arange(3), 4)
+        fitness = np.array([1, 3, 0, 0, 0, 0, 0, 0, 2, 2, 4, 9], dtype=float)
+        survives = np.array([True, True, True, False, True, True, False, False, True, True, True, False])
+        child_groups = np.repeat(np.arange(3), 20000)
+
+        parents = select_parents(fitness, group, survives, child_groups, 3, rng)
+        self.assertTrue((group[parents] == child_groups).all())
+        self.assertTrue(survives[parents].all())
+
+        counts = np.bincount(parents, minlength=12)
+        expected = [5000, 15000, 0, 0, 10000, 10000, 0, 0, 5000, 5000, 10000, 0]
+        for i in range(12):
+            self.assertGreater(counts[i], expected[i] - 400) # PROB
+            self.assertLessEqual(counts[i], expected[i] + 400) # PROB
+
+    def testArrayShuffleAndPair(self):
+        rng = np.random.default_rng()
+        first, second = shuffle_and_pair(6, rng)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 3)
+        self.assertEqual(len(set(first) | set(second)), 6)
+
+        first, second = shuffle_and_pair(9, rng)
+        self.assertEqual(len(first), 4)
+        self.assertEqual(len(second), 4)
+        self.assertEqual(len(set(first) | set(second)), 8)
+
+        first, second = shuffle_and_pair(7, rng, rand=False)
+        self.assertEqual(list(first), [0, 1, 2])
+        self.assertEqual(list(second), [3, 4, 5])
+
+    def testConflictOutcomes(self):
+        fitness1 = np.array([6.0, 27.0, 17.0, 0.0])
+        fitness2 = np.array([14.0, 3.0, 17.0, 0.0])
+        self.assertEqual(list(conflict_outcomes(fitness1, fitness2)), [False, True, True, True])
+
+        rng = np.random.default_rng()
+        wins = np.zeros(4)
+        for i in range(10000):
+            wins += conflict_outcomes(fitness1, fitness2, rng)
+        
+        self.assertTrue(wins[0] > 2500 and wins[0] < 3500) # PROB
+        self.assertTrue(wins[1] > 8500 and wins[1] < 9500) # PROB
+        self.assertTrue(wins[2] > 4500 and wins[2] < 5500) # PROB
+        self.assertTrue(wins[3] > 4500 and wins[3] < 5500) # PROB
+
+
+    # Logger tests --------------------------------------------------
+    def testStreamingLogger(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                pm = PinheadModel(n=10, g=4, years=10, log_basic=True, log_groups=True)
+                pm.logger.chunk_years = 3
+                path = pm.logger.stats_json
+                self.assertTrue(path.endswith("deet_stats_1.jsonl"))
+
+                for i in range(7):
+                    pm.loop()
+
+                    # the years are only held in memory until a chunk is written
+                    self.assertEqual(len(pm.logger.datadict), (i + 1) % 3)
+
+                with open(path) as f:
+                    self.assertEqual(len(f.readlines()), 3)
+                pm.main()
+
+                stats = read_stats(path)
+                self.assertEqual(stats["params"]["n"], 10)
+                self.assertEqual(list(stats.keys()), ["params"] + [str(year) for year in range(10)])
+                self.assertEqual(len(stats["9"]["groups"]), 4)
+                self.assertEqual(sum(stats["9"][strat]["pop"] for strat in ["mis", "dec", "cit", "sai", "civ", "sel", "sta"]), 40)
+
+                # a chunk cut off halfway through is dropped
+                with open(path, "a") as f:
+                    f.write(json.dumps({10: stats["9"]})[:50])
+                self.assertEqual(len(read_stats(path)), 11)
+
+                # the next logger for the same config takes the next trial
+                pm = PinheadModel(n=10, g=4, years=10, log_basic=True, log_groups=True)
+                self.assertTrue(pm.logger.stats_json.endswith("deet_stats_2.jsonl"))
+            finally:
+                os.chdir(cwd)
+
+    def testColumnarLogger(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                for pm in [PinheadModel(n=10, g=4, years=30, log_basic=True, log_columns=True),
+                           PinheadArrayModel(n=10, g=4, years=30, log_basic=True, log_columns=True)]:
+                    for i in range(12):
+                        pm.loop()
+                    pm.logger.flush()
+
+                    path = pm.logger.stats_json[:-len(".jsonl")] + ".npy"
+                    columns = load_columns(path)
+                    self.assertIsInstance(columns, np.memmap)
+                    self.assertEqual(columns.shape, (12, len(COLUMN_STRATEGIES), len(COLUMN_METRICS)))
+
+                    pm.main()
+                    columns = load_columns(path)
+                    stats = read_stats(pm.logger.stats_json)
+                    self.assertEqual(columns.shape[0], 30)
+                    for year in range(30):
+                        self.assertEqual(columns[year, :, 0].sum(), 40)
+                        for s, strat in enumerate(COLUMN_STRATEGIES):
+                            self.assertEqual(columns[year, s, 0], stats[str(year)][strat]["pop"])
+                            if stats[str(year)][strat]["pop"] > 0:
+                                self.assertAlmostEqual(columns[year, s, 2], stats[str(year)][strat]["coop"], delta=0.001)
+                            else:
+                                self.assertTrue(np.isnan(columns[year, s, 1]))
+            finally:
+                os.chdir(cwd)
+
+    def testRunRegistry(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                os.mkdir(os.path.join("data", "config"))
+                open(os.path.join("data", "config", "aggr_stats_1.json"), "w").close()
+
+                # runs started at the same time all get their own trial, skipping the old file
+                registry = RunRegistry()
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    trials = list(pool.map(lambda i: RunRegistry().start("config", "aggr_stats", {"i": i}, seed=i), range(16)))
+                self.assertEqual(sorted(trials), list(range(2, 18)))
+                self.assertEqual(registry.start("config", "deet_stats", {}), 1)
+
+                registry.finish("config", "aggr_stats", 2, status="failed")
+                runs = registry.runs("config")
+                self.assertEqual(len(runs), 17)
+                self.assertEqual([run["trial"] for run in registry.runs(status="failed")], [2])
+                self.assertEqual(runs[0]["seed"], runs[0]["params"]["i"])
+                self.assertIsNone(runs[1]["ended"])
+
+                # loggers mark their run as done once the last year is written
+                pe = PinheadEnsemble(replicates=2, seed=3, n=10, g=4, years=5, log_basic=True)
+                self.assertEqual([logger.trial for logger in pe.loggers], [1, 2])
+                self.assertEqual([run["status"] for run in registry.runs(pe.loggers[0].directory)], ["running", "running"])
+                pe.main()
+                runs = registry.runs(pe.loggers[0].directory)
+                self.assertEqual([run["status"] for run in runs], ["done", "done"])
+                self.assertEqual([run["seed"] for run in runs], [[3, 0], [3, 1]])
+                self.assertEqual(runs[0]["params"]["n"], 10)
+
+                # the object model records its seed too
+                pm = PinheadModel(n=10, g=4, years=2, seed=7, log_basic=True)
+                self.assertEqual(registry.runs(pm.logger.directory)[0]["seed"], 7)
+
+                # old stats files are looked for under the registry's own root
+                os.makedirs(os.path.join("other", "config"))
+                open(os.path.join("other", "config", "aggr_stats_1.jsonl"), "w").close()
+                self.assertEqual(RunRegistry(root="other").start("config", "aggr_stats", {}), 2)
+            finally:
+                os.chdir(cwd)
+
+    def testLogAgentCounts(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                # the logged populations are the model's running counts, not a recount
+                for pm in [PinheadModel(n=10, g=4, years=5, log_basic=True), PinheadArrayModel(n=10, g=4, years=5, log_basic=True)]:
+                    pm.loop()
+                    self.assertEqual({strat: pm.logger.datadict[0][strat.name.lower()[:3]]["pop"] for strat in Strategy}, pm.agent_counts)
+
+                pm = PinheadModel(n=10, g=4, years=5, log_basic=True)
+                pm.agent_counts[Strategy.SAINT] += 5
+                pm.loop()
+                self.assertEqual(pm.logger.datadict[0]["sai"]["pop"], pm.agent_counts[Strategy.SAINT])
+                self.assertRaises(Exception, pm.check_agent_counts)
+            finally:
+                os.chdir(cwd)
+
+    def testGroupSchedule(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                for pm in [PinheadModel(n=10, g=4, years=20, log_basic=True, log_groups=True, log_group_every=5),
+                           PinheadArrayModel(n=10, g=4, years=20, log_basic=True, log_groups=True, log_group_every=5)]:
+                    pm.main()
+                    stats = read_stats(pm.logger.stats_json)
+                    self.assertEqual([year for year in range(20) if stats[str(year)]["groups"]], [0, 5, 10, 15])
+                    self.assertEqual(len(stats["5"]["groups"]), 4)
+                    self.assertEqual(sum(stats["7"][strat]["pop"] for strat in ["mis", "dec", "cit", "sai", "civ", "sel", "sta"]), 40)
+            finally:
+                os.chdir(cwd)
+
+    def testRingBuffer(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                distrib = {"miscreant": 1, "deceiver": 0, "citizen": 0, "saint": 0, "civic": 0, "selfish": 0, "static": 0}
+                pm = PinheadModel(n=10, g=4, years=30, distrib=distrib, p_mutation=0, log_basic=True, log_groups=True,
+                                  log_group_every=5, log_ring_years=3)
+                pm.logger.chunk_years = 4
+
+                # cooperation starts out low, so the groups are kept for the first years
+                for i in range(20):
+                    pm.loop()
+                self.assertEqual(pm.logger.groups_until, 3)
+
+                # pretend cooperation was in between the thresholds, so year 20 crosses one again.
+                # The ring holds years 18 to 20, and years 18 and 19 were already written
+                pm.logger.was_low = False
+                pm.main()
+                self.assertEqual(pm.logger.groups_until, 23)
+
+                stats = read_stats(pm.logger.stats_json)
+                self.assertEqual([year for year in range(30) if stats[str(year)]["groups"]], [0, 1, 2, 3, 5, 10, 15, 18, 19, 20, 21, 22, 23, 25])
+                self.assertEqual(stats["18"]["mis"]["pop"], 40)
+                self.assertEqual(sum(group["mis"]["pop"] for group in stats["18"]["groups"].values()), 40)
+            finally:
+                os.chdir(cwd)
+
+    # Detector tests ---------------------------------------------------------
+    def testDetectors(self):
+        miscreants = {"miscreant": 1, "deceiver": 0, "citizen": 0, "saint": 0, "civic": 0, "selfish": 0, "static": 0}
+
+        # a single strategy with no mutation is fixed from the start
+        for model in [PinheadModel, PinheadArrayModel]:
+            pm = model(n=10, g=4, years=50, distrib=dict(miscreants), p_mutation=0, detectors=[Extinction(), Fixation()])
+            pm.main()
+            self.assertEqual(pm.schedule.year, 1)
+            self.assertIsInstance(pm.stopped_by, Fixation)
+
+        # miscreants hardly cooperate, so every year counts towards the low detector
+        pm = PinheadModel(n=10, g=4, years=50, distrib=dict(miscreants), detectors=[CoopYears(below=0.25, years=3), CoopYears(above=0.9, years=3)])
+        pm.main()
+        self.assertEqual(pm.schedule.year, 4)
+        self.assertEqual(pm.stopped_by.below, 0.25)
+        self.assertEqual(pm.detectors[1].counter, 0)
+
+        pm = PinheadArrayModel(n=10, g=4, years=50, detectors=[Stationary(window=5, tolerance=1)])
+        pm.main()
+        self.assertEqual(pm.schedule.year, 5)
+
+        # any function of the model, the counts and cooperation works as a detector
+        seen = []
+        def detector(model, counts, coop):
+            seen.append((sum(counts.values()), coop))
+            return model.schedule.year == 6
+
+        pm = PinheadModel(n=10, g=4, years=50, detectors=[detector])
+        pm.main()
+        self.assertEqual(pm.schedule.year, 7)
+        self.assertIs(pm.stopped_by, detector)
+        self.assertTrue(all(n == 40 and 0 <= coop <= 1 for n, coop in seen))
+
+        # until_high and until_low pick the default detectors
+        self.assertEqual([detector.above for detector in PinheadModel(n=10, g=4).detectors], [0.9])
+        self.assertEqual([detector.below for detector in PinheadArrayModel(n=10, g=4, until_high=False, until_low=True).detectors], [0.25])
+        self.assertEqual(PinheadModel(n=10, g=4, until_high=False).detectors, [])
+
+    def testEnsembleDetectors(self):
+        pe = PinheadEnsemble(replicates=3, seed=4, n=10, g=4, years=20, detectors=[Stationary(window=3, tolerance=1)])
+        target = pe.views[1]
+        pe.replicate_detectors[1].append(lambda model, counts, coop: model is target and model.schedule.year == 1)
+
+        # each replicate keeps its own detector state, and only the one that fired is dropped
+        pe.loop()
+        pe.loop()
+        self.assertTrue(target.can_terminate)
+        pe.drop_replicates(np.array([not view.can_terminate for view in pe.views]))
+        self.assertEqual(pe.replicates, 2)
+        self.assertEqual([len(detectors[0].history) for detectors in pe.replicate_detectors], [2, 2])
+
+        pe.main()
+        self.assertEqual(pe.replicates, 0)
+        self.assertEqual(pe.schedule.year, 3)
+
+    # Checkpoint tests -------------------------------------------------------
+    def testCheckpointResume(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                np.random.seed(2)
+                pm = PinheadModel(n=10, g=6, years=20, p_con=0.5, p_mig=0.3, log_basic=True, log_groups=True, log_columns=True,
+                                  checkpoint_every=5)
+                pm.logger.chunk_years = 3
+                pm.main()
+
+                # checkpoints stay out of the directory of stats files
+                self.assertTrue(os.path.exists(pm.checkpoint_path))
+                self.assertEqual(sorted(os.listdir(os.path.dirname(pm.logger.stats_json))),
+                                 sorted(os.path.basename(pm.logger.stats_json[:-len(".jsonl")]) + ext for ext in [".jsonl", ".npy"]))
+
+                def state(model):
+                    return [(group.id, agent.id, agent.strategy, agent.fitness, agent.pi, agent.cooperates)
+                            for group, members in model.group_table.items() for agent in members]
+
+                stats = read_stats(pm.logger.stats_json)
+                columns = np.array(load_columns(pm.logger.stats_json[:-len(".jsonl")] + ".npy"))
+
+                # just loading the checkpoint leaves the finished run's files alone
+                with gzip.open(pm.checkpoint_path, "rb") as f:
+                    pickle.load(f)
+                self.assertEqual(read_stats(pm.logger.stats_json), stats)
+
+                # the last checkpoint was at year 15, and the resumed model runs the last five years the same way
+                resumed = PinheadModel.resume(pm.checkpoint_path)
+                self.assertEqual(resumed.schedule.year, 15)
+                self.assertEqual(sum(resumed.agent_counts.values()), 60)
+                resumed.main()
+
+                self.assertEqual(state(resumed), state(pm))
+                self.assertEqual((resumed.curr_group_id, resumed.curr_indiv_id), (pm.curr_group_id, pm.curr_indiv_id))
+                self.assertEqual(read_stats(resumed.logger.stats_json), stats)
+                np.testing.assert_array_equal(load_columns(resumed.logger.stats_json[:-len(".jsonl")] + ".npy"), columns)
+
+                # a checkpoint also works without a logger
+                path = os.path.join(tmp, "model.ckpt")
+                pm = PinheadModel(n=10, g=4, years=10, checkpoint_every=4, checkpoint_path=path)
+                pm.main()
+                resumed = PinheadModel.resume(path)
+                self.assertEqual(resumed.schedule.year, 8)
+                resumed.main()
+                self.assertEqual(state(resumed), state(pm))
+                self.assertRaises(Exception, PinheadModel, n=10, g=4, checkpoint_every=4)
+                self.assertRaises(Exception, PinheadModel, n=10, g=4, checkpoint_every=4, checkpoint_path=path,
+                                  detectors=[lambda model, counts, coop: False])
+            finally:
+                os.chdir(cwd)
+
+    # Sweep tests ------------------------------------------------------------
+    def testExpandGrid(self):
+        center = {"n": 10, "g": 4, "benefit": 3, "p_mig": 0.1}
+        cells = expand_grid(center, {"benefit": [3, 4], ("p_mig", "p_con"): [(0.1, 0), (0.5, 0.2)]})
+        self.assertEqual(cells, [{"n": 10, "g": 4, "benefit": 3, "p_mig": 0.1, "p_con": 0},
+                                 {"n": 10, "g": 4, "benefit": 3, "p_mig": 0.5, "p_con": 0.2},
+                                 {"n": 10, "g": 4, "benefit": 4, "p_mig": 0.1, "p_con": 0},
+                                 {"n": 10, "g": 4, "benefit": 4, "p_mig": 0.5, "p_con": 0.2}])
+        self.assertEqual(center["benefit"], 3)
+
+        # seeds depend on the cell and replicate, not on where the cell is in the grid
+        self.assertEqual(task_seed(dict(cells[1]), 1), task_seed(cells[1], 1))
+        self.assertEqual(len({tuple(task_seed(cell, r)) for cell in cells for r in range(3)}), 12)
+        self.assertNotEqual(task_seed(cells[0], 0, seed=1), task_seed(cells[0], 0))
+
+    def testRunSweep(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                cells = expand_grid({"n": 10, "g": 4, "years": 5}, {"benefit": [3, 4]})
+                entries = run_sweep(cells, replicates=2, workers=2)
+                self.assertEqual(len(entries), 4)
+                self.assertFalse(any(entry["skipped"] for entry in entries))
+                self.assertEqual(len({entry["stats"] for entry in entries}), 4)
+                for entry in entries:
+                    self.assertEqual(entry["years"], 5)
+                    self.assertEqual(read_stats(entry["stats"])["params"]["benefit"], entry["params"]["benefit"])
+
+                # the same seed gives the same run, whichever batch it was run in
+                model = PinheadEnsemble(replicates=1, replicate_seeds=[entries[0]["seed"]], **entries[0]["params"])
+                model.main()
+                self.assertEqual(read_stats(entries[0]["stats"])["4"]["mis"]["pop"], model.agent_counts[Strategy.MISCREANT])
+
+                # running the sweep again skips what's done, with the outcome it had, and only runs the new cell
+                first = {json.dumps(entry["seed"]): entry for entry in entries}
+                cells.append(dict(cells[0], benefit=5))
+                entries = run_sweep(cells, replicates=2, workers=2, batch=2)
+                self.assertEqual(sorted(entry["skipped"] for entry in entries), [False, False, True, True, True, True])
+                for entry in entries:
+                    self.assertEqual(entry["years"], 5)
+                    if entry["skipped"]:
+                        self.assertEqual(entry, dict(first[json.dumps(entry["seed"])], skipped=True))
+                self.assertEqual(len(RunRegistry().runs(status="done")), 6)
+                with open(os.path.join("data", "manifest.jsonl")) as f:
+                    self.assertEqual(len(f.readlines()), 10)
+
+                # a replicate that stops early records when and why
+                cell = {"n": 10, "g": 4, "years": 1100, "distrib": {"miscreant": 1, "civic": 0, "saint": 0}, "until_high": False, "until_low": True}
+                entries = run_sweep([cell], replicates=1, workers=1)
+                self.assertEqual(entries[0]["years"], 1001)
+                self.assertEqual(entries[0]["stopped_by"], "CoopYears")
+            finally:
+                os.chdir(cwd)
+
+    # PinheadEnsemble tests --------------------------------------------------
+    def testEnsembleInvariants(self):
+        pe = PinheadEnsemble(replicates=3, seed=1, n=10, g=8, p_con=0.5, p_mig=0.3, years=30)
+        for i in range(30):
+            pe.loop()
+
+            # every replicate keeps its own rows in its own group slots, n agents to a slot
+            replicate = np.arange(pe.num_indivs) // pe.indivs_per_replicate
+            self.assertTrue((pe.group // pe.groups_per_replicate == replicate).all())
+            self.assertTrue((np.bincount(pe.group, minlength=pe.num_groups) == 10).all())
+            self.assertEqual(len(pe.group_id), 24)
+
+            # group ids are unique within each replicate and below that replicate's counter
+            group_id = pe.group_id.reshape(3, -1)
+            for r in range(3):
+                self.assertEqual(len(set(group_id[r])), 8)
+                self.assertTrue((group_id[r] < pe.curr_group_id[r]).all())
+
+        counts = pe.replicate_strategy_counts()
+        self.assertTrue((counts.sum(axis=1) == 80).all())
+        self.assertEqual(list(counts.sum(axis=0)), list(np.bincount(pe.strategy, minlength=8)))
+
+    def testEnsembleSeed(self):
+        pe1 = PinheadEnsemble(replicates=2, seed=7, n=10, g=6, p_con=0.5, years=20)
+        pe2 = PinheadEnsemble(replicates=2, seed=7, n=10, g=6, p_con=0.5, years=20)
+        pe1.main()
+        pe2.main()
+        self.assertTrue((pe1.strategy == pe2.strategy).all())
+        self.assertTrue((pe1.group == pe2.group).all())
+        self.assertTrue((pe1.pi == pe2.pi).all())
+
+        # replicates draw from different streams
+        strategy = pe1.strategy.reshape(2, -1)
+        self.assertFalse((strategy[0] == strategy[1]).all())
+
+    def testEnsembleSaintlyGroup(self):
+        pe = PinheadEnsemble(replicates=3, n=10, g=5, saintly_group=True)
+        self.assertEqual(pe.num_groups, 12)
+        self.assertEqual(list(pe.group_id), [0, 1, 2, 3] * 3)
+        strategy = pe.strategy.reshape(3, -1)
+        for r in range(3):
+            self.assertEqual(list(strategy[r, :10]), [Strategy.CITIZEN.value, Strategy.SAINT.value] * 5)
+
+    def testEnsembleNewGroupIds(self):
+        pe = PinheadEnsemble(replicates=3, n=4, g=4)
+        ids = pe.new_group_ids(np.array([1, 2, 9, 10, 11]))
+        self.assertEqual(list(ids), [4, 5, 4, 5, 6])
+        self.assertEqual(list(pe.curr_group_id), [6, 4, 7])
+
+        pe.replace_groups(np.array([0, 8]), np.array([3, 11]))
+        self.assertEqual(list(pe.group_id), [0, 1, 2, 6, 0, 1, 2, 3, 0, 1, 2, 7])
+        self.assertEqual(list(pe.strategy[pe.group == 11]), list(pe.strategy[pe.group == 8]))
+
+    def testEnsembleDropReplicates(self):
+        pe = PinheadEnsemble(replicates=3, n=4, g=5, p_con=0, p_mutation=0, years=5)
+        pe.strategy[:] = np.repeat([1, 2, 3], 20)
+        pe.group_id += np.repeat([0, 10, 20], 5)
+        pe.main()
+        strategy = pe.strategy.reshape(3, -1).copy()
+
+        pe.drop_replicates(np.array([True, False, True]))
+        self.assertEqual(pe.replicates, 2)
+        self.assertEqual(pe.num_groups, 10)
+        self.assertEqual(pe.num_indivs, 40)
+        self.assertEqual(list(pe.strategy), list(strategy[[0, 2]].ravel()))
+        self.assertEqual(pe.group.max(), 9)
+        self.assertTrue((pe.group[20:] >= 5).all())
+        self.assertTrue((pe.group_id[5:] >= 20).all())
+        self.assertEqual(pe.agent_counts[Strategy.DECEIVER], 0)
+
+        pe.years = 10
+        pe.main()
+        self.assertTrue((np.bincount(pe.group, minlength=10) == 4).all())
+
+    def testEnsembleStreams(self):
+        pe = PinheadEnsemble(replicates=3, n=2, g=2)
+        self.assertEqual(pe.streams().counts, [4, 4, 4])
+        self.assertEqual(pe.streams(indivs=np.array([0, 5, 6, 11])).counts, [1, 2, 1])
+        self.assertEqual(pe.streams(indivs=np.arange(12) % 3 == 0).counts, [2, 1, 1])
+        self.assertEqual(pe.streams(groups=np.array([1, 4, 5])).counts, [1, 0, 2])
+        self.assertEqual(len(pe.streams().normal(loc=np.zeros(12), scale=0.05)), 12)
+
+        first, second = pe.pair_indivs()
+        self.assertTrue((first // 4 == second // 4).all())
+        self.assertEqual(list(first // 4), [0, 0, 1, 1, 2, 2])
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
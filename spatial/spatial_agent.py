@@ -4,6 +4,13 @@ import numpy as np
 class SpatialAgent: 
     next_id = 0
 
+    # fixed attribute layout, so agents carry no __dict__
+    __slots__ = (
+        "id", "model", "birth_group", "group", "pi", "avg_pi", "learning", "lifespan", "birth_epoch", "first_round_epoch",
+        "avg_fitness_diff", "fitness_diff", "fitness", "square", "foraging_direction", "just_migrated",
+        "cooperate", "public_benefit", "private_benefit", "p_obs", "caught", "coop_strategy"
+    )
+
     def __init__(self, model, group, mean_lifespan=50, pi=None, learning=None, rand=True):
         # assign identifying id, and superstructures
         self.id = SpatialAgent.next_id
@@ -55,43 +62,25 @@ class SpatialAgent:
         self.private_benefit = None
 
     
-    # SpatialAgent List Int -> Tuple 
-    # assigns a foraging square to an agent
-    # returns where agent forages
-    # **tested**
-    def choose_square(self, probs=None):
-        # choose direction to forage in, get which square that corresponds to
-        # 0 - stay, 1 - up, 2 - down, 3 - left, 4 - right
-        self.foraging_direction = random.choices(range(5), probs)[0] 
-        self.square = self.model.forager_grid.direction_to_coord(self.group.location[0], self.group.location[1], self.foraging_direction) # 
-        potential_new_group_index = self.model.grid_group_indices[self.square]
-        
-        # if the agent moved, and the agent decides to migrate
-        if self.foraging_direction != 0 and self.migration_choice(potential_new_group_index):
-            self.just_migrated = True
-            self.model.forager_grid_next.add_agent(self.square) # add agent to forager_grid_next as a home agent
-            self.switch_group(potential_new_group_index) # put agent into the new group
-        else:
-            self.just_migrated = False
-            self.model.forager_grid_next.add_agent(self.square, self.foraging_direction) # add agent to forager_grid as a visiting agent
-        
-        return self.square
-    
-    # if there is a group on the agent's square, and that group fulfills the similarity criterion, then the agent
-    # may migrate with probability p_swap
-    def migration_choice(self, potential_group_index):
-        # there is no group on the square the agent is on
-        if potential_group_index == -1:
-            return False 
-
-        potential_group = self.model.groups[potential_group_index]
-
-        # if the difference in group cooperation levels is allowable
-        if abs(potential_group.avg_pct_cooperators - self.group.avg_pct_cooperators) <= self.model.similarity_threshold:
-            return random.choices([True, False], weights = [self.model.p_swap, 1-self.model.p_swap])[0]
-        else:
-            return False
-        
+    # SpatialAgent -> Number
+    # age and first_round are kept as the model epoch they count from, so the model ages
+    # every agent by starting a new epoch instead of visiting each one
+    @property
+    def age(self):
+        return self.model.epoch - self.birth_epoch
+
+    @age.setter
+    def age(self, age):
+        self.birth_epoch = self.model.epoch - age
+
+    @property
+    def first_round(self):
+        return self.first_round_epoch == self.model.epoch
+
+    @first_round.setter
+    def first_round(self, first_round):
+        self.first_round_epoch = self.model.epoch if first_round else -1
+
     # SpatialAgent, Float List -> Boolean 
     # agent decides whether to cooperate
     # returns whether agent cooperates
@@ -187,17 +176,6 @@ class SpatialAgent:
         else:
             return None
 
-    # SpatialAgent ->
-    # Puts agent in the group with index new_group_num; removes them from the current group
-    # **tested**
-    def switch_group(self, new_group_num):
-        old_group = self.group
-        new_group = self.model.groups[new_group_num]
-
-        old_group.remove_agent(self)
-        new_group.add_agent(self)
-
-
     # SpatialAgent -> void
     # the agent's pi value is updated based on its learning style and the
     # outcome of the previous round.
@@ -0,0 +1,30 @@
+# A detector is called once a year, after the agents have learned and before the year is
+# logged, as detector(model, counts, coop): counts maps each learning style to its number of
+# agents and coop is the fraction of all agents that cooperated. It returns True once the
+# run can stop. Any function with that signature can be used as a detector
+
+# stops the run once a single learning style is left and nothing can mutate into another one
+class Fixation:
+    def __call__(self, model, counts, coop):
+        return model.p_mutation == 0 and sum(count > 0 for count in counts.values()) == 1
+
+# stops the run once there are no agents left
+class Extinction:
+    def __call__(self, model, counts, coop):
+        return sum(counts.values()) == 0
+
+# [List-of Detector] SpatialModel Dictionary Float -> Maybe Detector
+# calls every detector, so the ones that keep count see every year, and returns the first
+# one that fired
+def run_detectors(detectors, model, counts, coop):
+    fired = None
+    for detector in detectors:
+        if detector(model, counts, coop) and fired is None:
+            fired = detector
+    return fired
+
+# -> [List-of Detector]
+# the detectors a model gets when it isn't given any: one learning style left without
+# mutation, which is when the logger used to stop the run, or no agents left at all
+def default_detectors():
+    return [Fixation(), Extinction()]
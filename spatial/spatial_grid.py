@@ -1,10 +1,20 @@
 import numpy as np
 
+# channel of the grid an agent is counted in on arrival, for each direction it traveled.
+# Up/down and left/right are reversed, since the channel gives where the agent came from
+ARRIVAL_CHANNEL = np.array([0, 2, 1, 4, 3])
+
 class SpatialGrid:
     def __init__(self, size, model):
         self.grid = np.zeros((size, size, 5))
         self.size = size
         self.model = model
+
+        # neighbor_rows[row, col, d], neighbor_cols[row, col, d] is the square reached by going in
+        # direction d from (row, col), as in direction_to_coord
+        rows, cols = np.indices((size, size))
+        self.neighbor_rows = np.stack([rows, (rows - 1) % size, (rows + 1) % size, rows, rows], axis=2)
+        self.neighbor_cols = np.stack([cols, cols, cols, (cols - 1) % size, (cols + 1) % size], axis=2)
     
     # SpatialGrid ->
     # Adds a forager at the given location. If direction is None, this is the
@@ -26,7 +36,7 @@ class SpatialGrid:
             # etc. Need to reverse up/down and left/right because of direction gives the 
             # direction the agent traveled, which is the opposite of the direction
             # the agent came from
-            self.grid[location[0], location[1], [0, 2, 1, 4, 3][direction]] += 1 
+            self.grid[location[0], location[1], ARRIVAL_CHANNEL[direction]] += 1 
     
     # SpatialGrid ->
     # remove agent from this square, similar to add_agent
@@ -34,7 +44,20 @@ class SpatialGrid:
         if direction is None:
             self.grid[location[0], location[1], 0] -= 1
         else:
-            self.grid[location[0], location[1], [0, 2, 1, 4, 3][direction]] -= 1
+            self.grid[location[0], location[1], ARRIVAL_CHANNEL[direction]] -= 1
+
+    # SpatialGrid NdArray NdArray NdArray ->
+    # Adds many foragers at once, forager i at (rows[i], cols[i]) in channel channels[i],
+    # with a single bincount over the flattened grid
+    # **tested**
+    def add_agents(self, rows, cols, channels):
+        cells = (rows * self.size + cols) * 5 + channels
+        self.grid += np.bincount(cells, minlength=self.grid.size).reshape(self.grid.shape)
+
+    # SpatialGrid ->
+    # empties the grid in place, so it can be filled again without a new allocation
+    def clear(self):
+        self.grid.fill(0)
         
     # SpatialGrid ->
     # Adds a group of agents to location as their home square.
@@ -71,6 +94,16 @@ class SpatialGrid:
 
         return n_outside
     
+    # SpatialGrid -> NdArray NdArray
+    # the number of foragers on every square (num_foragers) and the average number on its
+    # four neighbours (calculate_n_outside), as two size by size arrays. The neighbours are
+    # summed by rolling the plane of totals one square each way around the torus
+    # **tested**
+    def calculate_n_fields(self):
+        n_here = self.grid.sum(axis=2)
+        n_outside = (np.roll(n_here, 1, axis=0) + np.roll(n_here, -1, axis=0) + np.roll(n_here, 1, axis=1) + np.roll(n_here, -1, axis=1)) / 4
+        return n_here, n_outside
+
     # Decides whether a new group should form on this square. (Must have at 
     # least n agents from some group foraging on this square.) If so, returns
     # the coordinates of the original group that these foragers are splitting 
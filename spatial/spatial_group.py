@@ -3,6 +3,13 @@ import random
 class SpatialGroup:
     next_id = 0
 
+    # fixed attribute layout, so groups carry no __dict__
+    __slots__ = (
+        "location", "id", "model", "pct_cooperators", "avg_pct_cooperators", "pct_cooperators_memory",
+        "avg_benefit", "all_civic", "mostly_civic", "majority_civic", "previously_all_civic", "n_agents",
+        "first_round", "n_rounds", "is_bud", "just_budded", "budded_to", "agents"
+    )
+
     def __init__(self, model, location, agents, avg_benefit=None, is_bud=False):
 
         self.location = location
@@ -140,32 +147,6 @@ class SpatialGroup:
         else:
             self.recount_agents()
 
-    # SpatialGroup -> 
-    # Adds an agent to the group, and updates fields accordingly
-    # **tested**
-    def add_agent(self, agent):
-        self.n_agents[agent.learning] += 1
-        self.agents.append(agent)
-        agent.group = self
-
-        self.majority_civic = self.n_agents["civic"] > (0.5 * len(self.agents))
-        self.mostly_civic = self.n_agents["civic"] > (0.9 * len(self.agents))
-        self.all_civic = self.n_agents["civic"] == len(self.agents)
-   
-    # SpatialGroup ->
-    # Removes an agent from the group, and updates fields accordingly
-    # **tested**
-    def remove_agent(self, agent):
-        self.n_agents[agent.learning] -= 1
-        self.agents.remove(agent)
-
-        if len(self.agents) == 0:
-            self.die()
-        else:     
-            self.majority_civic = self.n_agents["civic"] > (0.5 * len(self.agents))
-            self.mostly_civic = self.n_agents["civic"] > (0.9 * len(self.agents))
-            self.all_civic = self.n_agents["civic"] == len(self.agents)
-
     # SpatialGroup ->
     # kills off a group, removing it from the dictionary of groups and the grid of group indices
     # these are the only ways we keep track of which groups are where
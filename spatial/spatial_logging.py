@@ -1,103 +1,230 @@
 import json
+import sqlite3
 import csv
 import os
+from collections import deque
 from datetime import datetime
+import numpy as np
+
+# layout of the columnar stats files: entry [year, s, m] is metric COLUMN_METRICS[m] of the
+# agents with strategy COLUMN_STRATEGIES[s], NaN for fit, coop and pi when there are none of them
+COLUMN_STRATEGIES = ["civic", "selfish", "static", "coop"]
+COLUMN_METRICS = ["pop", "new", "fit", "coop", "pi"]
+
+# index of each learning style in the stats arrays, and its key in the stats
+STRATEGY_INDEX = {strat: s for s, strat in enumerate(COLUMN_STRATEGIES)}
+STRATEGY_KEYS = [strat[:3] for strat in COLUMN_STRATEGIES]
+
+# String -> NdArray
+# memory-maps a columnar stats file, cut down to the years that were written, with axes
+# (year, strategy, metric) as given by COLUMN_STRATEGIES and COLUMN_METRICS
+def load_columns(path):
+    columns = np.load(path, mmap_mode="r")
+    written = np.isnan(columns[:, 0, 0])
+    return columns[:written.argmax()] if written.any() else columns
+
+# hands out the trial numbers of the runs under a data directory and keeps a record of
+# each run in <root>/runs.sqlite: its config directory, stats file prefix, trial, params,
+# seed, start and end time, and status ("running", "done", or whatever finish is given).
+# A trial is taken inside a write transaction, so runs started at the same time from
+# different processes never get the same number. root is made if it isn't there yet
+class RunRegistry:
+    def __init__(self, root="data"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "runs.sqlite")
+        conn = self.connect()
+        try:
+            conn.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                directory TEXT, prefix TEXT, trial INTEGER, params TEXT, seed TEXT,
+                                started TEXT, ended TEXT, status TEXT, PRIMARY KEY (directory, prefix, trial))""")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    # String String Dictionary Any -> Integer
+    # registers a new run in directory and returns its trial number, one past the highest so
+    # far. Stats files written before the registry existed are skipped over
+    def start(self, directory, prefix, params, seed=None):
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            last, = conn.execute("SELECT MAX(trial) FROM runs WHERE directory = ? AND prefix = ?", (directory, prefix)).fetchone()
+            trial = (last or 0) + 1
+            while os.path.exists(os.path.join(self.root, directory, f'{prefix}_{trial}.json')):
+                trial += 1
+
+            conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, NULL, 'running')",
+                         (directory, prefix, trial, json.dumps(params), json.dumps(seed), datetime.now().isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+        return trial
+
+    # String String Integer String ->
+    # records that the run has ended, with the given status
+    def finish(self, directory, prefix, trial, status="done"):
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE runs SET ended = ?, status = ? WHERE directory = ? AND prefix = ? AND trial = ?",
+                         (datetime.now().isoformat(), status, directory, prefix, trial))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # [Maybe String] [Maybe String] -> [List-of Dictionary]
+    # returns the records of the runs, optionally only those in directory or with status
+    def runs(self, directory=None, status=None):
+        query, args = "SELECT * FROM runs WHERE 1", []
+        if directory is not None:
+            query, args = query + " AND directory = ?", args + [directory]
+        if status is not None:
+            query, args = query + " AND status = ?", args + [status]
+
+        conn = self.connect()
+        try:
+            cursor = conn.execute(query + " ORDER BY directory, prefix, trial", args)
+            names = [column[0] for column in cursor.description]
+            records = [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+        for record in records:
+            record["params"], record["seed"] = json.loads(record["params"]), json.loads(record["seed"])
+        return records
 
 class Logger:
-    def __init__(self, model, directory, param_dict):  
+    # if columns is true, the population-wide stats also go into a .npy file with one row per
+    # year, see load_columns
+    # with log_groups, the group stats are only kept every group_every years. The last
+    # ring_years years of group stats are held in a ring buffer, which is written out when
+    # total cooperation rises above 0.9 or falls below 0.25, and the groups are then kept
+    # for the next ring_years years as well
+    # the trial number of the run comes from the RunRegistry of data/, which also records
+    # when the run started and ended along with its params and seed
+    def __init__(self, model, directory, param_dict, seed=None, columns=False, group_every=1, ring_years=0):  
         self.model = model
+        self.group_every = group_every
+        self.ring_years = ring_years
+        self.ring = deque(maxlen=ring_years) if ring_years > 0 else None
+        self.groups_until = -1 # last year of the window after a trigger
+        self.was_high = False
+        self.was_low = False
 
-        new_directory = os.path.join("data", directory)
-        if not os.path.exists(new_directory):
-            os.mkdir(new_directory)
-        trial = 1
+        os.makedirs(os.path.join("data", directory), exist_ok=True)
 
-        if self.model.log_groups:
-            while os.path.exists(os.path.join(new_directory, f'deet_stats_{trial}.json')):
-                trial += 1
-            self.stats_json = f'data/{directory}/deet_stats_{trial}.json'
-        else:
-            while os.path.exists(os.path.join(new_directory, f'aggr_stats_{trial}.json')):
-                trial += 1
-            self.stats_json = f'data/{directory}/aggr_stats_{trial}.json'
+        self.registry = RunRegistry()
+        self.directory = directory
+        self.prefix = "deet_stats" if self.model.log_groups else "aggr_stats"
+        self.trial = self.registry.start(directory, self.prefix, param_dict, seed)
+        self.stats_json = f'data/{directory}/{self.prefix}_{self.trial}.json'
 
         self.datadict = {}
         self.datadict["demographics"] = {"total": 0, "age": 0, "migrated": 0}
         self.datadict["params"] = param_dict
+
+        self.columns = None
+        if columns:
+            self.columns = np.lib.format.open_memmap(self.stats_json[:-len(".json")] + ".npy", mode="w+", dtype=np.float64,
+                                                     shape=(self.model.years, len(COLUMN_STRATEGIES), len(COLUMN_METRICS)))
+            self.columns[:] = np.nan
     
-    # Logs stats for each group
+    # whether the group stats of year go into the stats file
+    def keeps_groups(self, year):
+        return year % self.group_every == 0 or year <= self.groups_until
+
+    # puts the group stats held in the ring buffer back into their years, and keeps the
+    # group stats of the next ring_years years
+    def dump_ring(self, year):
+        for ring_year, groups in self.ring:
+            self.datadict[ring_year]["groups"] = groups
+        self.groups_until = year + self.ring_years
+
+    # Logs stats for each group. The agents' values are gathered into arrays, and each stat
+    # is summed by (group, strategy) with one bincount
     def log_stats(self):
-        strategies = ["civic", "selfish", "static", "coop"]
         year = self.model.year
+        groups = list(self.model.groups.items())
+        agents = [agent for id, group in groups for agent in group.agents]
+        n_groups = len(groups)
+        n_strats = len(COLUMN_STRATEGIES)
 
-        total_pop_by_strat = {strat: 0 for strat in strategies}
-        total_fitness_by_strat = {strat: 0 for strat in strategies}
-        total_coop_by_strat = {strat: 0 for strat in strategies}
-        total_pi_by_strat = {strat: 0 for strat in strategies}
-        total_new_agents_by_strat = {strat: 0 for strat in strategies}
+        group_index = np.repeat(np.arange(n_groups), [len(group.agents) for id, group in groups])
+        strategy = np.array([STRATEGY_INDEX[agent.learning] for agent in agents], dtype=np.int64)
+        fitness = np.array([agent.fitness for agent in agents], dtype=float)
+        new = np.array([agent.first_round for agent in agents], dtype=bool)
+        cooperate = np.array([agent.cooperate for agent in agents], dtype=bool)
+        pi = np.array([agent.pi for agent in agents], dtype=float)
 
         self.datadict[year] = {}
-        self.datadict[year]["g"] = len(self.model.groups)
+        self.datadict[year]["g"] = n_groups
 
         self.datadict[year]["groups"] = {}
-        for id, group in self.model.groups.items():
-            # Initialize stats for this group
-            fitness_by_strat = {strat: 0 for strat in strategies}
-            new_agents_by_strat = {strat: 0 for strat in strategies}
-            coop_by_strat = {strat: 0 for strat in strategies}
-            pi_by_strat = {strat: 0 for strat in strategies}
-            obs_by_strat = {strat: 0 for strat in strategies}
-            error_by_strat = {strat: 0 for strat in strategies}
-            
-            # Aggregate stats
-            for indiv in group.agents:
-                fitness_by_strat[indiv.learning] += indiv.fitness
-                new_agents_by_strat[indiv.learning] += indiv.first_round
-                coop_by_strat[indiv.learning] += indiv.cooperate
-                pi_by_strat[indiv.learning] += indiv.pi
-                obs_by_strat[indiv.learning] += indiv.p_obs
-                error_by_strat[indiv.learning] += (indiv.cooperate == indiv.coop_strategy)
-            
-            # Calculate values
-            group_stats = {}
-            for strat in strategies:
-                group_stats[strat[:3]] = {'pop': group.n_agents[strat]}
-                if group.n_agents[strat] > 0:
-                    group_stats[strat[:3]]['new'] = new_agents_by_strat[strat]
-                    group_stats[strat[:3]]['fit'] = round(fitness_by_strat[strat] / group.n_agents[strat], 2)
-                    group_stats[strat[:3]]['coop'] = round(coop_by_strat[strat] / group.n_agents[strat], 3)
-                    group_stats[strat[:3]]['pi'] = round(pi_by_strat[strat] / group.n_agents[strat], 2)
-                    group_stats[strat[:3]]['obs'] = round(obs_by_strat[strat] / group.n_agents[strat], 3)
-                    group_stats[strat[:3]]['err'] = round(error_by_strat[strat] / group.n_agents[strat], 3)
-    
-                total_pop_by_strat[strat] += group.n_agents[strat]
-                total_new_agents_by_strat[strat] += new_agents_by_strat[strat]
-                total_fitness_by_strat[strat] += fitness_by_strat[strat]
-                total_coop_by_strat[strat] += coop_by_strat[strat]
-                total_pi_by_strat[strat] += pi_by_strat[strat]
+        if self.model.log_groups and (self.ring is not None or self.keeps_groups(year)):
+            p_obs = np.array([agent.p_obs for agent in agents], dtype=float)
+            error = np.array([agent.cooperate == agent.coop_strategy for agent in agents], dtype=bool)
+
+            n_cells = n_groups * n_strats
+            cell = group_index * n_strats + strategy
+            sums = [np.bincount(cell, weights=values, minlength=n_cells).reshape(n_groups, n_strats).tolist()
+                    for values in (None, new, fitness, cooperate, pi, p_obs, error)]
+
+            groups_dict = {}
+            for (id, group), pops, news, fits, coops, pis, obses, errs in zip(groups, *sums):
+                group_stats = {}
+                for s, key in enumerate(STRATEGY_KEYS):
+                    n = int(pops[s])
+                    group_stats[key] = {'pop': n} if n == 0 else \
+                        {'pop': n, 'new': int(news[s]), 'fit': round(fits[s] / n, 2), 'coop': round(coops[s] / n, 3),
+                         'pi': round(pis[s] / n, 2), 'obs': round(obses[s] / n, 3), 'err': round(errs[s] / n, 3)}
 
-            if self.model.log_groups:
                 group_stats["exp"] = None if not group.just_budded else group.budded_to
                 group_stats["bud"] = None if not group.just_budded else self.model.grid_group_indices[group.budded_to]
-                self.datadict[year]["groups"][id] = group_stats
+                groups_dict[id] = group_stats
+
+            if self.keeps_groups(year):
+                self.datadict[year]["groups"] = groups_dict
+            if self.ring is not None:
+                self.ring.append((year, groups_dict))
+
+        total_pop, total_new, total_fitness, total_coop, total_pi = [np.bincount(strategy, weights=values, minlength=n_strats).tolist()
+                                                                      for values in (None, new, fitness, cooperate, pi)]
         
-        zero_counter = 3
-        for strat in strategies:
-            self.datadict[year][strat[:3]] = {}
-            self.datadict[year][strat[:3]]["pop"] = total_pop_by_strat[strat]
-            self.datadict[year][strat[:3]]["new"] = total_new_agents_by_strat[strat]
+        for s, (strat, key) in enumerate(zip(COLUMN_STRATEGIES, STRATEGY_KEYS)):
+            pop = int(total_pop[s])
+            self.datadict[year][key] = {}
+            self.datadict[year][key]["pop"] = pop
+            self.datadict[year][key]["new"] = int(total_new[s])
             
-            if total_pop_by_strat[strat] > 0:
-                zero_counter -= 1
-                self.datadict[year][strat[:3]]["fit"] = round(total_fitness_by_strat[strat] / total_pop_by_strat[strat], 2)
-                self.datadict[year][strat[:3]]["coop"] = round(total_coop_by_strat[strat] / total_pop_by_strat[strat], 3)
-                self.datadict[year][strat[:3]]["pi"] = round(total_pi_by_strat[strat] / total_pop_by_strat[strat], 3)
-                print(strat, self.datadict[year][strat[:3]]["pop"], self.datadict[year][strat[:3]]["coop"])
-
-        # if only one agent type remains, then we can terminate the model
-        if zero_counter == 2 and self.model.p_mutation == 0:
-            self.model.can_terminate = True
-        
+            if pop > 0:
+                self.datadict[year][key]["fit"] = round(total_fitness[s] / pop, 2)
+                self.datadict[year][key]["coop"] = round(total_coop[s] / pop, 3)
+                self.datadict[year][key]["pi"] = round(total_pi[s] / pop, 3)
+                print(strat, self.datadict[year][key]["pop"], self.datadict[year][key]["coop"])
+
+        if self.columns is not None:
+            pop = np.array(total_pop)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.columns[year, :, 0] = pop
+                self.columns[year, :, 1] = total_new
+                self.columns[year, :, 2] = np.array(total_fitness) / pop
+                self.columns[year, :, 3] = np.array(total_coop) / pop
+                self.columns[year, :, 4] = np.array(total_pi) / pop
+
+        # crossing either threshold triggers a dump of the ring buffer
+        total_coop_pct = sum(total_coop) / max(sum(total_pop), 1)
+        is_high, is_low = total_coop_pct > 0.9, total_coop_pct < 0.25
+        if self.ring is not None and ((is_high and not self.was_high) or (is_low and not self.was_low)):
+            self.dump_ring(year)
+        self.was_high, self.was_low = is_high, is_low
+
+
         if year == self.model.years - 1 or self.model.can_terminate:
             with open(self.stats_json, 'w') as f:
-                json.dump(self.datadict, f)
\ No newline at end of file
+                json.dump(self.datadict, f)
+            if self.columns is not None:
+                self.columns.flush()
+            self.registry.finish(self.directory, self.prefix, self.trial)
\ No newline at end of file
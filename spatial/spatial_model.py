@@ -1,12 +1,12 @@
 import random 
 import numpy as np
 import csv
-from collections import defaultdict
 
 from spatial_agent import SpatialAgent
 from spatial_group import SpatialGroup
-from spatial_grid import SpatialGrid
+from spatial_grid import SpatialGrid, ARRIVAL_CHANNEL
 from spatial_logging import Logger
+from spatial_detectors import default_detectors, run_detectors
 
 class SpatialModel:
     def __init__(
@@ -34,8 +34,12 @@ class SpatialModel:
         write_log=True, # turns on and off logging
         p_obs=None, # can set p_obs to a constant value
         log_groups=False, # logs detailed info about groups
+        log_columns=False, # also writes the population-wide stats as a .npy file
+        log_group_every=1, # keeps the group stats every this many years
+        log_ring_years=0, # years of group stats to write out when cooperation crosses a threshold
         mean_lifespan=50,
-        similarity_threshold=1
+        similarity_threshold=1,
+        detectors=None # when to stop early, see spatial_detectors. fixation and extinction by default
         ): 
 
         param_dict = {
@@ -102,8 +106,8 @@ class SpatialModel:
         # Third index: 0 - from this square, 1 - from above, 2 - from below, 3 - from left, 4 - from right 
         self.forager_grid = SpatialGrid(self.size, model=self)
         
-        # forager_grid_next: count of foragers from all adjacent square on this round, is updated as agents make choices
-        # necessary so that all agents decide based on last round's numbers
+        # forager_grid_next: count of foragers from all adjacent square on this round, is filled in once every agent has chosen
+        # necessary so that all agents decide based on last round's numbers. The two grids swap every round and are reused
         self.forager_grid_next = SpatialGrid(self.size, self) 
 
         # grid_group_indices: size by size grid. grid_group_indices[i, j] is the index of the group
@@ -122,6 +126,7 @@ class SpatialModel:
         SpatialGroup.next_id = 0
         SpatialAgent.next_id = 0
 
+        self.epoch = 0 # counts calls to increment_entities, agents' ages are measured in epochs
         self.initialize_groups()
         self.year = 0
         self.years = years
@@ -132,9 +137,11 @@ class SpatialModel:
         if self.write_log:
             config = f'y{years}_n{n}_g{g}_c{cost_coop}_b{benefit}_r{resources}_t{threshold}_pm{p_mutation}_ps{p_swap}_distrib{round(self.distrib[2], 2)}_cd{cost_distant}' 
             self.log_groups = log_groups
-            self.logger = Logger(self, config, param_dict)
+            self.logger = Logger(self, config, param_dict, columns=log_columns, group_every=log_group_every, ring_years=log_ring_years)
         
         self.can_terminate = False
+        self.detectors = default_detectors() if detectors is None else list(detectors)
+        self.stopped_by = None # the detector that made the model ready to terminate
 
     # SpatialModel -> None
     # initializes groups by finding a location for each group, and setting the count of foragers 
@@ -189,13 +196,11 @@ class SpatialModel:
     def increment_entities(self):
         self.death_age["sum"] = 0
         self.death_age["count"] = 0
+        self.epoch += 1 # ages every agent and clears their first_round
         for group in self.groups.values():
             group.n_rounds += 1
             group.first_round = False
             group.just_budded = False
-            for agent in group.agents:
-                agent.first_round = False
-                agent.age += 1
 
     def main(self):
         for i in range(self.years):
@@ -237,6 +242,8 @@ class SpatialModel:
             for agent in group.agents:
                 agent.learn()
 
+        self.check_detectors()
+
         # before agents die off, write stats
         # keep stats on number of agents and number of cooperators for each learning style:
         if self.write_log:
@@ -246,6 +253,24 @@ class SpatialModel:
 
         # return n_agents
     
+    # SpatialModel -> 
+    # runs the detectors on the groups' counts of each learning style and this year's
+    # cooperation, and makes the model ready to terminate if one of them fires
+    # **tested**
+    def check_detectors(self):
+        counts = {"static": 0, "selfish": 0, "civic": 0, "coop": 0}
+        cooperators = 0
+        for group in self.groups.values():
+            for learning, count in group.n_agents.items():
+                counts[learning] += count
+            cooperators += group.pct_cooperators * len(group.agents)
+        coop = cooperators / max(sum(counts.values()), 1)
+
+        fired = run_detectors(self.detectors, self, counts, coop)
+        if fired is not None:
+            self.stopped_by = fired
+            self.can_terminate = True
+
     # SpatialModel -> 
     # calls reproduction on all groups
     # **tested**
@@ -265,35 +290,89 @@ class SpatialModel:
     # **tested**
     def square_decisions(self, default_probs=None):
 
-        # make a list of all the agents, since they move around groups
-        all_agents = []
-        for group in self.groups.values():
-            all_agents += group.agents
-        
-        self.calculations = 0 # testing purposes, checks how many times foraging probs was calculated
-        
-        foraging_probs_dict = defaultdict(list) # memoize the foraging probs for each group
-        
-        # for each agent choose a square
-        for agent in all_agents: 
-            # CHANGED we were using the same probabilities for each group!
-            if default_probs is None:
-                # when probs have been memoized for this group, used them
-                if foraging_probs_dict[agent.group]:
-                    probs = foraging_probs_dict[agent.group]
-                # when they've not been calculated, calculate them
-                else:
-                    self.calculations += 1
-                    probs = self.calc_foraging_probs(agent.group.location[0], agent.group.location[1])
-                    foraging_probs_dict[agent.group] = probs
-                agent.choose_square(probs)
-            else:
-                agent.choose_square(default_probs)
+        # make a list of all the agents, since they move around groups, and the square of each one's group
+        groups = list(self.groups.values())
+        all_agents = [agent for group in groups for agent in group.agents]
+        sizes = [len(group.agents) for group in groups]
+        home_rows = np.repeat(np.array([group.location[0] for group in groups], dtype=np.int64), sizes)
+        home_cols = np.repeat(np.array([group.location[1] for group in groups], dtype=np.int64), sizes)
+
+        # cumulative foraging probs of every agent, looked up from the probs of every square at once
+        if default_probs is None:
+            self.calculations = len(groups) # testing purposes, checks how many groups foraging probs were looked up for
+            cum_probs = np.cumsum(self.calc_foraging_prob_field(), axis=2)[home_rows, home_cols]
+        else:
+            self.calculations = 0
+            cum_probs = np.broadcast_to(np.cumsum(default_probs), (len(all_agents), 5))
+
+        # choose every agent's direction at once by inverse CDF, like random.choices: the direction is the number of
+        # cumulative probs at or below the draw. 0 - stay, 1 - up, 2 - down, 3 - left, 4 - right
+        draws = np.random.random(len(all_agents)) * cum_probs[:, -1]
+        directions = (cum_probs[:, :-1] <= draws[:, None]).sum(axis=1)
+        rows = self.forager_grid.neighbor_rows[home_rows, home_cols, directions]
+        cols = self.forager_grid.neighbor_cols[home_rows, home_cols, directions]
+        channels = ARRIVAL_CHANNEL[directions]
+
+        for agent, direction, row, col in zip(all_agents, directions.tolist(), rows.tolist(), cols.tolist()):
+            agent.foraging_direction = direction
+            agent.square = (row, col)
+            agent.just_migrated = False
+
+        # an agent that moved onto the square of a group whose cooperation level is within similarity_threshold
+        # of its own group's migrates to it with probability p_swap, decided for all of them in one draw
+        avg_pct_cooperators = np.zeros((self.size, self.size))
+        for group in groups:
+            avg_pct_cooperators[group.location] = group.avg_pct_cooperators
+        targets = self.grid_group_indices[rows, cols]
+        similar = np.abs(avg_pct_cooperators[rows, cols] - avg_pct_cooperators[home_rows, home_cols]) <= self.similarity_threshold
+        candidates = np.flatnonzero((directions != 0) & (targets != -1) & similar)
+        willing = candidates[np.random.random(len(candidates)) < self.p_swap].tolist()
+
+        # agents still migrate one after another: a group whose last agent leaves before anyone joins it dies
+        # right away, so agents after that can't migrate into it and forage on its square as visitors
+        remaining = dict(zip(groups, sizes))
+        dying = set()
+        migrants = []
+        for i in willing:
+            agent = all_agents[i]
+            new_group = self.groups[targets[i]]
+            if new_group in dying:
+                continue
+            migrants.append(i)
+            remaining[new_group] += 1
+            remaining[agent.group] -= 1
+            if remaining[agent.group] == 0:
+                dying.add(agent.group)
+
+        # migrants are home agents on their new square, and join the end of their new group. Every group that
+        # lost or gained agents gets its new list of members at once, and dies if it has none left
+        channels[migrants] = 0
+        members = {group: [] for group in groups}
+        stays = np.ones(len(all_agents), dtype=bool)
+        stays[migrants] = False
+        for agent, stay in zip(all_agents, stays.tolist()):
+            if stay:
+                members[agent.group].append(agent)
+
+        changed = set()
+        for i in migrants:
+            agent = all_agents[i]
+            new_group = self.groups[targets[i]]
+            agent.just_migrated = True
+            members[new_group].append(agent)
+            changed.update((agent.group, new_group))
+
+        for group in groups:
+            if group in changed:
+                group.set_agents(members[group])
+
+        # count every agent into forager_grid_next at once
+        self.forager_grid_next.add_agents(rows, cols, channels)
                 
-        # we've been updating forager_grid_next so as not to interfere with agent decision-making
-        # so replace forager_grid with forager_grid_next
-        self.forager_grid = self.forager_grid_next
-        self.forager_grid_next = SpatialGrid(self.size, self)
+        # forager_grid_next was kept apart so as not to interfere with agent decision-making,
+        # so it becomes forager_grid, and the old forager_grid is emptied to be filled next round
+        self.forager_grid, self.forager_grid_next = self.forager_grid_next, self.forager_grid
+        self.forager_grid_next.clear()
 
     # SpatialModel -> 
     # calls every agent to decide whether to cooperate
@@ -351,6 +430,28 @@ class SpatialModel:
         payoff_outside = (self.resources - self.cost_distant) / (n_outside + 1)
         return payoff_here, payoff_outside
     
+    # SpatialModel -> NdArray
+    # calc_foraging_probs for every square at once, as a size by size by 5 array, so groups
+    # can look up the probabilities of their own square
+    # **tested**
+    def calc_foraging_prob_field(self):
+        payoff_here, payoff_outside = self.calc_expected_payoff_field()
+
+        probs = np.empty((self.size, self.size, 5))
+        probs[:, :, 0] = payoff_here / (payoff_here + payoff_outside)
+        probs[:, :, 1:] = ((payoff_outside / (payoff_here + payoff_outside)) / 4)[:, :, None]
+        return probs
+
+    # SpatialModel -> NdArray NdArray
+    # calc_expected_payoffs for every square at once
+    # **tested**
+    def calc_expected_payoff_field(self):
+        n_here, n_outside = self.forager_grid.calculate_n_fields()
+
+        payoff_here = self.resources / (n_here + 1)
+        payoff_outside = (self.resources - self.cost_distant) / (n_outside + 1)
+        return payoff_here, payoff_outside
+
     # FUNCTIONS FOR SPLITTING GROUPS
 
     # SpatialModel -> 
@@ -2,12 +2,16 @@ import unittest
 import numpy as np
 import random
 import math
+import os
+import tempfile
 from collections import defaultdict
 
 from spatial_model import SpatialModel
 from spatial_group import SpatialGroup
-from spatial_grid import SpatialGrid
+from spatial_grid import SpatialGrid, ARRIVAL_CHANNEL
 from spatial_agent import SpatialAgent
+from spatial_logging import RunRegistry, load_columns
+from spatial_detectors import Fixation, Extinction
 
 # probabilistic tests are marked with PROB, they may fail
 class TestSpatialModelNew(unittest.TestCase):
@@ -243,12 +247,14 @@ class TestSpatialModelNew(unittest.TestCase):
     def testLoop(self):
         # one where everyone should die
         sm = SpatialModel(n=20, g=20, resources=1, benefit=1, cost_coop=1, cost_stayin_alive=20, cost_distant=1, present_weight=0.3, write_log=False)
+        initial_pis = {} # pi of each agent at the start of the round, by id
+        old_avg_benefits = {} # avg_benefit of each group in the last round, by id
 
         # Round 0
         for group in sm.groups.values():
             for agent in group.agents:
                 agent.lifespan = 100
-                agent.initial_pi = agent.pi
+                initial_pis[agent.id] = agent.pi
 
         sm.loop()
 
@@ -270,7 +276,7 @@ class TestSpatialModelNew(unittest.TestCase):
                 total_group_benefit += agent.public_benefit 
                 self.assertTrue(agent.fitness >= agent.private_benefit) # agent gets at least its private benefit -- distribution happened
                 caught_count += agent.caught
-                all_pis_equal = all_pis_equal and (agent.pi == agent.initial_pi) # check that pis change (learning happened)
+                all_pis_equal = all_pis_equal and (agent.pi == initial_pis[agent.id]) # check that pis change (learning happened)
 
             self.assertFalse(all_pis_equal) # learning happened
             if total_group_benefit != 0:
@@ -278,7 +284,7 @@ class TestSpatialModelNew(unittest.TestCase):
             else:
                 self.assertEqual(0, group.avg_benefit)
             
-            group.old_avg_benefit = group.avg_benefit # save this so we can compare next round
+            old_avg_benefits[group.id] = group.avg_benefit # save this so we can compare next round
 
         self.assertEqual(population, 400) # no one should have died
         self.assertEqual(len(sm.groups), 20) # no groups should have died
@@ -288,7 +294,7 @@ class TestSpatialModelNew(unittest.TestCase):
         for group in sm.groups.values():
             for agent in group.agents:
                 agent.lifespan = 100
-                agent.initial_pi = agent.pi
+                initial_pis[agent.id] = agent.pi
 
         sm.loop()
 
@@ -310,15 +316,15 @@ class TestSpatialModelNew(unittest.TestCase):
                 total_group_benefit += agent.public_benefit 
                 self.assertTrue(agent.fitness >= agent.private_benefit) # group_distribution
                 caught_count += agent.caught
-                all_pis_equal = all_pis_equal and (agent.pi == agent.initial_pi) # learn
+                all_pis_equal = all_pis_equal and (agent.pi == initial_pis[agent.id]) # learn
 
             self.assertFalse(all_pis_equal)
             if total_group_benefit != 0:
-                self.assertEqual(total_group_benefit/(20 - caught_count)*0.3 + 0.7*group.old_avg_benefit, group.avg_benefit) # correct avg_benefit update
+                self.assertEqual(total_group_benefit/(20 - caught_count)*0.3 + 0.7*old_avg_benefits[group.id], group.avg_benefit) # correct avg_benefit update
             else:
-                self.assertEqual(0.7*group.old_avg_benefit, group.avg_benefit)
+                self.assertEqual(0.7*old_avg_benefits[group.id], group.avg_benefit)
             
-            group.old_avg_benefit = group.avg_benefit
+            old_avg_benefits[group.id] = group.avg_benefit
 
         self.assertEqual(population, 400) # no one should have died
         self.assertEqual(len(sm.groups), 20) # no one should have died
@@ -326,7 +332,7 @@ class TestSpatialModelNew(unittest.TestCase):
         # Round 2
         for group in sm.groups.values():
             for agent in group.agents:
-                agent.initial_pi = agent.pi
+                initial_pis[agent.id] = agent.pi
 
         sm.loop()
 
@@ -341,12 +347,14 @@ class TestSpatialModelNew(unittest.TestCase):
 
         # one where no one should die and everyone should reproduce
         sm = SpatialModel(n=20, g=20, resources=25, benefit=60, cost_coop=20, cost_stayin_alive=0, cost_repro=0, cost_distant=5, write_log=False)
+        initial_pis = {}
+        old_avg_benefits = {}
 
         # Round 0
         for group in sm.groups.values():
             for agent in group.agents:
                 agent.lifespan = 100 # increase lifespan so it isn't the bottleneck
-                agent.initial_pi = agent.pi
+                initial_pis[agent.id] = agent.pi
 
         sm.loop()
 
@@ -368,7 +376,7 @@ class TestSpatialModelNew(unittest.TestCase):
                 total_group_benefit += agent.public_benefit
                 self.assertTrue(agent.fitness >= agent.private_benefit)
                 caught_count += agent.caught
-                all_pis_equal = all_pis_equal and (agent.pi == agent.initial_pi)
+                all_pis_equal = all_pis_equal and (agent.pi == initial_pis[agent.id])
 
             self.assertFalse(all_pis_equal)
             if total_group_benefit != 0:
@@ -376,7 +384,7 @@ class TestSpatialModelNew(unittest.TestCase):
             else:
                 self.assertEqual(0, group.avg_benefit)
             
-            group.old_avg_benefit = group.avg_benefit
+            old_avg_benefits[group.id] = group.avg_benefit
 
         self.assertEqual(population, 400) # no one should have died
         self.assertEqual(len(sm.groups), 20)
@@ -384,7 +392,7 @@ class TestSpatialModelNew(unittest.TestCase):
         # Round 1
         for group in sm.groups.values():
             for agent in group.agents:
-                agent.initial_pi = agent.pi
+                initial_pis[agent.id] = agent.pi
                 agent.lifespan = 100
 
         sm.loop()
@@ -407,16 +415,16 @@ class TestSpatialModelNew(unittest.TestCase):
                 total_group_benefit += agent.public_benefit
                 self.assertTrue(agent.fitness >= agent.private_benefit)
                 caught_count += agent.caught
-                if hasattr(agent, "initial_pi"):
-                    all_pis_equal = all_pis_equal and (agent.pi == agent.initial_pi)
+                if agent.id in initial_pis:
+                    all_pis_equal = all_pis_equal and (agent.pi == initial_pis[agent.id])
 
             self.assertFalse(all_pis_equal)
             if total_group_benefit != 0:
-                self.assertEqual(total_group_benefit/(40 - caught_count)*0.3 + 0.7*group.old_avg_benefit, group.avg_benefit)
+                self.assertEqual(total_group_benefit/(40 - caught_count)*0.3 + 0.7*old_avg_benefits[group.id], group.avg_benefit)
             else:
-                self.assertEqual(0.7*group.old_avg_benefit, group.avg_benefit)
+                self.assertEqual(0.7*old_avg_benefits[group.id], group.avg_benefit)
             
-            group.old_avg_benefit = group.avg_benefit
+            old_avg_benefits[group.id] = group.avg_benefit
 
         self.assertEqual(population, 800) # no one should have died, everyone reproduced
         self.assertEqual(len(sm.groups), 20) # no group sent more than n agents to a different square
@@ -426,10 +434,10 @@ class TestSpatialModelNew(unittest.TestCase):
         for i in range(3):
             for group in sm.groups.values():
                 for agent in group.agents:
-                    agent.initial_pi = agent.pi
+                    initial_pis[agent.id] = agent.pi
                     agent.lifespan = 100
 
-                group.old_avg_benefit = group.avg_benefit
+                old_avg_benefits[group.id] = group.avg_benefit
             sm.loop()
         
         population = 0
@@ -451,8 +459,8 @@ class TestSpatialModelNew(unittest.TestCase):
                 self.assertTrue(agent.fitness >= agent.private_benefit)
                 caught_count += agent.caught
 
-                if hasattr(agent, "initial_pi"):
-                    all_pis_equal = all_pis_equal and (agent.pi == agent.initial_pi)
+                if agent.id in initial_pis:
+                    all_pis_equal = all_pis_equal and (agent.pi == initial_pis[agent.id])
 
             self.assertFalse(all_pis_equal)
 
@@ -545,6 +553,131 @@ class TestSpatialModelNew(unittest.TestCase):
         for group in sm.groups.values():
             self.assertEqual(len(group.agents), 4)
         
+    def testIncrementEntities(self):
+        sm = SpatialModel(n=8, g=4, write_log=False)
+        agents = [agent for group in sm.groups.values() for agent in group.agents]
+        agents[0].age = 5
+        agents[1].first_round = False
+
+        sm.increment_entities()
+        sm.increment_entities()
+
+        self.assertEqual(agents[0].age, 7)
+        for agent in agents[1:]:
+            self.assertEqual(agent.age, 2)
+            self.assertFalse(agent.first_round)
+        for group in sm.groups.values():
+            self.assertFalse(group.first_round)
+
+        # agents born after the increments start at age 0 in their first round
+        child = SpatialAgent(sm, agents[0].group)
+        self.assertEqual(child.age, 0)
+        self.assertTrue(child.first_round)
+        sm.increment_entities()
+        self.assertEqual(child.age, 1)
+        self.assertFalse(child.first_round)
+        
+    def testColumnarLogger(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                sm = SpatialModel(n=8, g=4, years=5, log_columns=True)
+                for i in range(5):
+                    sm.loop()
+
+                columns = load_columns(sm.logger.stats_json[:-len(".json")] + ".npy")
+                self.assertEqual(columns.shape, (5, 4, 5))
+                for year in range(5):
+                    for s, strat in enumerate(["civ", "sel", "sta", "coo"]):
+                        self.assertEqual(columns[year, s, 0], sm.logger.datadict[year][strat]["pop"])
+                        self.assertEqual(columns[year, s, 1], sm.logger.datadict[year][strat]["new"])
+                        if sm.logger.datadict[year][strat]["pop"] > 0:
+                            self.assertAlmostEqual(columns[year, s, 3], sm.logger.datadict[year][strat]["coop"], delta=0.001)
+            finally:
+                os.chdir(cwd)
+
+    def testDetectors(self):
+        # a single learning style with no mutation is fixed from the start, with or without logging
+        for write_log in [False, True]:
+            cwd = os.getcwd()
+            with tempfile.TemporaryDirectory() as tmp:
+                os.chdir(tmp)
+                try:
+                    os.mkdir("data")
+                    sm = SpatialModel(n=8, g=4, years=20, distrib=[1, 0, 0, 0], p_mutation=0, write_log=write_log)
+                    sm.main()
+                    self.assertEqual(sm.year, 1)
+                    self.assertIsInstance(sm.stopped_by, Fixation)
+                finally:
+                    os.chdir(cwd)
+
+        seen = []
+        def detector(model, counts, coop):
+            seen.append((counts, coop))
+            return model.year == 4
+
+        sm = SpatialModel(n=8, g=4, years=20, p_mutation=0.1, write_log=False, detectors=[Extinction(), detector])
+        sm.main()
+        self.assertEqual(sm.year, 5)
+        self.assertIs(sm.stopped_by, detector)
+        self.assertEqual(sum(seen[0][0].values()), 32)
+        self.assertTrue(all(0 <= coop <= 1 for counts, coop in seen))
+
+        # every detector sees every year, even after one before it has fired
+        years = []
+        sm = SpatialModel(n=8, g=4, years=20, write_log=False, detectors=[lambda model, counts, coop: True,
+                                                                          lambda model, counts, coop: years.append(model.year)])
+        sm.main()
+        self.assertEqual(sm.year, 1)
+        self.assertEqual(years, [0])
+
+    def testRunRegistry(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                models = [SpatialModel(n=8, g=4, years=3) for i in range(2)]
+                self.assertEqual([sm.logger.trial for sm in models], [1, 2])
+                self.assertTrue(models[1].logger.stats_json.endswith("aggr_stats_2.json"))
+
+                for i in range(3):
+                    models[0].loop()
+                runs = RunRegistry().runs(models[0].logger.directory)
+                self.assertEqual([run["status"] for run in runs], ["done", "running"])
+                self.assertEqual(runs[0]["params"]["n"], 8)
+                self.assertIsNotNone(runs[0]["ended"])
+            finally:
+                os.chdir(cwd)
+
+    def testGroupSchedule(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.mkdir("data")
+                sm = SpatialModel(n=8, g=4, years=12, log_groups=True, log_group_every=5, log_ring_years=2)
+                for i in range(8):
+                    sm.loop()
+                kept = [year for year in range(8) if sm.logger.datadict[year]["groups"]]
+
+                # the logger keeps every fifth year, plus the ring and the years after a trigger
+                self.assertTrue({0, 5}.issubset(kept))
+                for year in kept:
+                    self.assertTrue(year % 5 == 0 or year <= sm.logger.groups_until)
+
+                # dumping the ring puts the groups back into the last two years, and keeps the next two
+                sm.logger.dump_ring(7)
+                self.assertEqual(sm.logger.groups_until, 9)
+                sm.loop()
+                sm.loop()
+                for year in [6, 7, 8, 9]:
+                    self.assertEqual(len(sm.logger.datadict[year]["groups"]), sm.logger.datadict[year]["g"])
+            finally:
+                os.chdir(cwd)
+
     # test SpatialModel.calc_expected_payoff
     def testCalcExpectedPayoffs(self):
         forager_grid = np.array(
@@ -661,6 +794,60 @@ class TestSpatialModelNew(unittest.TestCase):
         self.assertAlmostEqual(probs[4], 0.125748503)
         
 
+    # the directions drawn in bulk by square_decisions follow the foraging probs
+    def testSquareDecisionDraws(self):
+        sm = SpatialModel(n=5000, g=1, size=5, p_swap=0, write_log=False)
+        probs = [0.1, 0.2, 0.3, 0.15, 0.25]
+        sm.square_decisions(default_probs=probs)
+
+        agents = sm.groups[0].agents
+        directions = np.bincount([agent.foraging_direction for agent in agents], minlength=5) / len(agents)
+        for direction in range(5):
+            self.assertAlmostEqual(directions[direction], probs[direction], delta=0.03) # PROB may fail sometimes
+
+        home = sm.groups[0].location
+        for agent in agents[:50]:
+            self.assertEqual(agent.square, sm.forager_grid.direction_to_coord(home[0], home[1], agent.foraging_direction))
+
+        # a direction with no probability is never drawn
+        sm.square_decisions(default_probs=[0.5, 0, 0.5, 0, 0])
+        self.assertEqual({agent.foraging_direction for agent in agents}, {0, 2})
+
+    # migration in square_decisions is drawn with p_swap, only between similar groups
+    def testMigrationDraws(self):
+        for p_swap, avg_pct_cooperators, migrants in [(0.3, 0.6, 0.3), (0.3, 0.9, 0), (0, 0.6, 0)]:
+            sm = SpatialModel(n=2000, g=2, size=3, p_swap=p_swap, similarity_threshold=0.2, write_log=False)
+            sm.grid_group_indices[:] = -1
+            for group in sm.groups.values():
+                group.location = (0, group.id)
+                sm.grid_group_indices[0, group.id] = group.id
+            sm.groups[0].avg_pct_cooperators = 0.5
+            sm.groups[1].avg_pct_cooperators = avg_pct_cooperators
+
+            # group 0 forages on group 1's square, group 1 on an empty square
+            sm.square_decisions(default_probs=[0, 0, 0, 0, 1])
+            self.assertAlmostEqual(len(sm.groups[1].agents) / 2000 - 1, migrants, delta=0.03) # PROB may fail sometimes
+            self.assertEqual(len(sm.groups[0].agents) + len(sm.groups[1].agents), 4000)
+            self.assertEqual(sm.forager_grid.grid[0, 1, 0], len(sm.groups[1].agents) - 2000)
+            self.assertEqual(sm.groups[0].n_agents["static"] + sm.groups[1].n_agents["static"],
+                             sum(agent.learning == "static" for group in sm.groups.values() for agent in group.agents))
+
+    # SpatialModel.calc_foraging_prob_field, against the probs of each square on its own
+    def testCalcForagingProbField(self):
+        sm = SpatialModel(g=10, size=6, resources=20, cost_distant=5, write_log=False)
+        sm.forager_grid.grid = np.random.randint(0, 20, size=(6, 6, 5)).astype(float)
+
+        n_here, n_outside = sm.forager_grid.calculate_n_fields()
+        payoff_here, payoff_outside = sm.calc_expected_payoff_field()
+        probs = sm.calc_foraging_prob_field()
+        self.assertEqual(probs.shape, (6, 6, 5))
+        for row in range(6):
+            for col in range(6):
+                self.assertEqual(n_here[row, col], sm.forager_grid.num_foragers((row, col)))
+                self.assertEqual(n_outside[row, col], sm.forager_grid.calculate_n_outside(row, col))
+                self.assertEqual((payoff_here[row, col], payoff_outside[row, col]), sm.calc_expected_payoffs(row, col))
+                self.assertEqual(probs[row, col].tolist(), sm.calc_foraging_probs(row, col))
+
     def testSquareDecisions(self):
         sm = SpatialModel(n=10, g=10, size=4, p_swap=0, cost_distant=0, write_log=False)
 
@@ -841,8 +1028,7 @@ class TestSpatialModelNew(unittest.TestCase):
         
         for i, group in enumerate(sm.groups.values()):
             
-            while len(group.agents) < group_populations[i]:
-                group.add_agent(SpatialAgent(sm, group))
+            group.set_agents(group.agents + [SpatialAgent(sm, group) for _ in range(group_populations[i] - len(group.agents))])
 
 
             square = group.location
@@ -1387,8 +1573,7 @@ class TestSpatialModelNew(unittest.TestCase):
 
         for i, group in enumerate(sm.groups.values()):
             
-            while len(group.agents) < group_populations[i]:
-                group.add_agent(SpatialAgent(sm, group))
+            group.set_agents(group.agents + [SpatialAgent(sm, group) for _ in range(group_populations[i] - len(group.agents))])
             
             group.first_round = group_first_rounds[i]
             group.avg_benefit = group_prev_avg_benefits[i]
@@ -1440,268 +1625,6 @@ class TestSpatialModelNew(unittest.TestCase):
         
         self.assertTrue(not sm.groups)
     
-    # test SpatialGroup.add_agent
-    def testAddAgent(self):
-        sm = SpatialModel(n=10, g=10, size=10, write_log=False)
-
-        group = sm.groups[4]
-        agent = SpatialAgent(sm, group)
-        old_n_agents = group.n_agents.copy()
-        old_agents = group.agents.copy()
-
-        group.add_agent(agent)
-
-        self.assertEqual(len(group.agents), 11)
-        self.assertTrue(agent in group.agents)
-        self.assertEqual(old_n_agents[agent.learning] + 1, group.n_agents[agent.learning])
-        self.assertEqual(old_agents + [agent], group.agents)
-        self.assertEqual(agent.group, group)
-
-        group = sm.groups[9]
-        agent_list_copy = group.agents.copy()
-        for i in range(5):
-            agent = group.agents[0]
-            n_agents_old = group.n_agents.copy()
-            group.remove_agent(agent)
-
-            self.assertEqual(len(group.agents), 9 - i)
-            self.assertTrue(agent not in group.agents)
-            self.assertEqual(n_agents_old[agent.learning] - 1, group.n_agents[agent.learning])
-            self.assertEqual(agent_list_copy[i + 1:], group.agents)
-
-        for i, agent in enumerate(group.agents):
-            if i % 2 == 0:
-                agent.learning = "static"
-            else: 
-                agent.learning = "selfish"
-
-        group.recount_agents()
-
-        for i in range(50):
-            agent = SpatialAgent(sm, None, learning="civic")
-            old_n_agents = group.n_agents.copy()
-            old_agents = group.agents.copy()
-            group.add_agent(agent)
-
-            self.assertEqual(len(group.agents), 6 + i)
-            self.assertTrue(agent in group.agents)
-            self.assertEqual(old_n_agents[agent.learning] + 1, group.n_agents[agent.learning])
-            self.assertEqual(old_agents + [agent], group.agents)
-            self.assertEqual(agent.group, group)
-
-            if i < 5:
-                self.assertTrue(not group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 3)
-                self.assertEqual(group.n_agents["selfish"], 2)
-                self.assertEqual(group.n_agents["civic"], i + 1)
-            elif i >= 5 and i < 45:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 3)
-                self.assertEqual(group.n_agents["selfish"], 2)
-                self.assertEqual(group.n_agents["civic"], i + 1) 
-            elif i >= 45:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 3)
-                self.assertEqual(group.n_agents["selfish"], 2)
-                self.assertEqual(group.n_agents["civic"], i + 1)
-        
-        group = sm.groups[8]
-        agent_list_copy = group.agents.copy()
-
-        for agent in group.agents:
-            agent.learning = "civic"
-        
-        group.recount_agents()
-
-        for i in range(9):
-            agent = SpatialAgent(sm, None, learning="civic")
-            old_n_agents = group.n_agents.copy()
-            old_agents = group.agents.copy()
-            group.add_agent(agent)
-
-            self.assertEqual(len(group.agents), 11 + i)
-            self.assertTrue(agent in group.agents)
-            self.assertEqual(old_n_agents[agent.learning] + 1, group.n_agents[agent.learning])
-            self.assertEqual(old_agents + [agent], group.agents)
-            self.assertEqual(agent.group, group)
-
-            self.assertTrue(group.majority_civic)
-            self.assertTrue(group.mostly_civic)
-            self.assertTrue(group.all_civic)
-            self.assertEqual(group.n_agents["static"], 0)
-            self.assertEqual(group.n_agents["selfish"], 0)
-            self.assertEqual(group.n_agents["civic"], 11 + i)
-        
-        for i in range(21):
-            agent = SpatialAgent(sm, None, learning=random.choice(["selfish", "static"]))
-            old_n_agents = group.n_agents.copy()
-            old_agents = group.agents.copy()
-            group.add_agent(agent)
-
-            self.assertEqual(len(group.agents), 20 + i)
-            self.assertTrue(agent in group.agents)
-            self.assertEqual(old_n_agents[agent.learning] + 1, group.n_agents[agent.learning])
-            self.assertEqual(old_agents + [agent], group.agents)
-            self.assertEqual(agent.group, group)
-
-            if i < 2:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"] + group.n_agents["selfish"], i + 1)
-                self.assertEqual(group.n_agents["civic"], 19)
-            elif i >=2 and i < 18:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"] + group.n_agents["selfish"], i + 1)
-                self.assertEqual(group.n_agents["civic"], 19)
-            elif i > 18:
-                self.assertTrue(not group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"] + group.n_agents["selfish"], i + 1)
-                self.assertEqual(group.n_agents["civic"], 19)
-    
-    # test SpatialGroup.add_agent
-    def testRemoveAgent(self):
-        sm = SpatialModel(size=8, g=21, n=25, write_log=False)
-        
-        group = sm.groups[5]
-        agent = group.agents[4]
-        group_agents_old = group.agents.copy()
-        n_agents_old = group.n_agents.copy()
-
-        group.remove_agent(agent)
-    
-        self.assertEqual(len(group.agents), 24)
-        self.assertTrue(agent not in group.agents)
-        self.assertEqual(n_agents_old[agent.learning] - 1, group.n_agents[agent.learning]) 
-        self.assertEqual(group_agents_old[:4] + group_agents_old[5:], group.agents)
-
-        agent_list_copy = group.agents.copy()
-        for i, agent in enumerate(agent_list_copy):
-            n_agents_old = group.n_agents.copy()
-            group.remove_agent(agent)
-
-            self.assertEqual(len(group.agents), 23 - i)
-            self.assertTrue(agent not in group.agents)
-            self.assertEqual(n_agents_old[agent.learning] - 1, group.n_agents[agent.learning])
-            self.assertEqual(agent_list_copy[i + 1:], group.agents)
-        
-        self.assertTrue(5 not in sm.groups)
-        self.assertTrue(group not in sm.groups.values())
-        self.assertTrue(not group.agents)
-        self.assertEqual(sm.grid_group_indices[group.location], -1)
-
-        sm = SpatialModel(size=8, g=5, n=25, write_log=False)
-        group = sm.groups[3]
-
-        for i, agent in enumerate(group.agents):
-            if i < 13:
-                agent.learning = "static"
-            else:
-                agent.learning = "civic"
-            
-        group.recount_agents()
-        
-        agent_list_copy = group.agents.copy()
-        for i, agent in enumerate(agent_list_copy):
-            n_agents_old = group.n_agents.copy()
-            group.remove_agent(agent)
-
-            self.assertEqual(len(group.agents), 24 - i)
-            self.assertTrue(agent not in group.agents)
-            self.assertEqual(n_agents_old[agent.learning] - 1, group.n_agents[agent.learning])
-            self.assertEqual(agent_list_copy[i + 1:], group.agents)
-
-            if i == 0:
-                self.assertTrue(not group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 12)
-                self.assertEqual(group.n_agents["civic"], 12)
-            elif i > 0 and i < 11:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 12 - i)
-                self.assertEqual(group.n_agents["civic"], 12)
-            elif i == 11:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 1)
-                self.assertEqual(group.n_agents["civic"], 12)
-            elif i > 11:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(group.mostly_civic)
-                self.assertTrue(group.all_civic)
-                self.assertEqual(group.n_agents["static"], 0)
-                self.assertEqual(group.n_agents["civic"], 24 - i) # start on index 12 with 12 civic learners
-
-        self.assertTrue(3 not in sm.groups)
-        self.assertTrue(group not in sm.groups.values())
-        self.assertTrue(not group.agents)
-        self.assertEqual(sm.grid_group_indices[group.location], -1)
-
-        sm = SpatialModel(size=8, g=5, n=22, write_log=False)
-        group = sm.groups[0]
-
-        for i, agent in enumerate(group.agents):
-            if i < 20:
-                agent.learning = "civic"
-            else:
-                agent.learning = "static"
-        
-        group.recount_agents()
-
-        agent_list_copy = group.agents.copy()
-        for i, agent in enumerate(agent_list_copy):
-            n_agents_old = group.n_agents.copy()
-            group.remove_agent(agent)
-
-            self.assertEqual(len(group.agents), 21 - i)
-            self.assertTrue(agent not in group.agents)
-            self.assertEqual(n_agents_old[agent.learning] - 1, group.n_agents[agent.learning])
-            self.assertEqual(agent_list_copy[i + 1:], group.agents)
-
-            if i == 0:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 2)
-                self.assertEqual(group.n_agents["civic"], 19) # removed 1
-            elif i > 0 and i < 17:
-                self.assertTrue(group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 2)
-                self.assertEqual(group.n_agents["civic"], 19 - i)
-            elif i > 17 and i < 20:
-                self.assertTrue(not group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 2)
-                self.assertEqual(group.n_agents["civic"], 19 - i)
-            elif i >= 20:
-                self.assertTrue(not group.majority_civic)
-                self.assertTrue(not group.mostly_civic)
-                self.assertTrue(not group.all_civic)
-                self.assertEqual(group.n_agents["static"], 21 - i) # start with 1 and on index 20
-                self.assertEqual(group.n_agents["civic"], 0)
-        
-        self.assertTrue(0 not in sm.groups)
-        self.assertTrue(group not in sm.groups.values())
-        self.assertTrue(not group.agents)
-        self.assertEqual(sm.grid_group_indices[group.location], -1)
-
     # test SpatialGroup.death_and_birth
     def testDeathAndBirth(self):
         print("testing death and birth")
@@ -1716,8 +1639,7 @@ class TestSpatialModelNew(unittest.TestCase):
         sm = SpatialModel(n=12, g=5, cost_stayin_alive=3, cost_repro=1, write_log=False)
 
         for i, group in enumerate(sm.groups.values()): 
-            while len(group.agents) < len(group_fitnesses[i]):
-                group.add_agent(SpatialAgent(sm, group))
+            group.set_agents(group.agents + [SpatialAgent(sm, group) for _ in range(len(group_fitnesses[i]) - len(group.agents))])
             
             agents_to_die = []
             agents_to_repro = []
@@ -1852,431 +1774,6 @@ class TestSpatialModelNew(unittest.TestCase):
     # ------------------------------------------------------------
     # SpatialAgent Tests
 
-    # test SpatialAgent.switch_group
-    def testSwitchGroup(self):
-        sm = SpatialModel(n=21, g=10, size=7, write_log=False)
-        origin_group = sm.groups[3]
-        origin_old_agents = origin_group.agents.copy()
-        origin_old_n_agents = origin_group.n_agents.copy()
-
-        dest_group = sm.groups[5]
-        dest_old_agents = dest_group.agents.copy()
-        dest_old_n_agents = dest_group.n_agents.copy()
-
-        agent_to_switch = origin_group.agents[3]
-        self.assertEqual(agent_to_switch.group, origin_group)
-        agent_to_switch.switch_group(5)
-
-        self.assertNotIn(agent_to_switch, origin_group.agents)
-        self.assertIn(agent_to_switch, dest_group.agents)
-
-        self.assertEqual(len(origin_group.agents), 20)
-        self.assertEqual(len(dest_group.agents), 22)
-
-        self.assertEqual(origin_old_n_agents[agent_to_switch.learning] - 1, origin_group.n_agents[agent_to_switch.learning])
-        self.assertEqual(dest_old_n_agents[agent_to_switch.learning] + 1, dest_group.n_agents[agent_to_switch.learning])
-
-        self.assertEqual(origin_group.agents, origin_old_agents[:3] + origin_old_agents[4:])
-        self.assertEqual(dest_group.agents, dest_old_agents + [agent_to_switch])
-
-        self.assertEqual(agent_to_switch.group, dest_group)
-
-        origin_group = sm.groups[0]
-        dest_group = sm.groups[6]
-
-        for agent in origin_group.agents:
-            agent.learning = random.choice(["selfish", "static"])
-        
-        for agent in dest_group.agents:
-            agent.learning = "civic"
-
-        origin_group.recount_agents()
-        dest_group.recount_agents()
-
-        origin_old_agents = origin_group.agents.copy()
-        dest_old_agents = dest_group.agents.copy()
-
-        self.assertTrue(dest_group.all_civic)
-        self.assertTrue(dest_group.mostly_civic)
-        self.assertTrue(dest_group.majority_civic)
-
-        for i, agent in enumerate(origin_old_agents):
-            self.assertTrue(0 in sm.groups)
-            self.assertTrue(origin_group in sm.groups.values())
-            self.assertTrue(origin_group.agents)
-            self.assertEqual(sm.grid_group_indices[origin_group.location], 0)
-            
-
-            self.assertEqual(agent.group, origin_group)
-            origin_old_n_agents = origin_group.n_agents.copy()
-            dest_old_n_agents = dest_group.n_agents.copy()
-            agent.switch_group(6)
-
-            self.assertNotIn(agent, origin_group.agents)
-            self.assertIn(agent, dest_group.agents)
-
-            self.assertEqual(len(origin_group.agents), 20 - i)
-            self.assertEqual(len(dest_group.agents), 22 + i)
-
-            self.assertEqual(origin_old_n_agents[agent.learning] - 1, origin_group.n_agents[agent.learning])
-            self.assertEqual(dest_old_n_agents[agent.learning] + 1, dest_group.n_agents[agent.learning])
-
-            self.assertEqual(dest_group.n_agents["civic"], 21)
-            self.assertEqual(dest_group.n_agents["selfish"] + dest_group.n_agents["static"], i + 1)
-            self.assertEqual(origin_group.n_agents["selfish"] + origin_group.n_agents["static"], 20 - i)
-
-            self.assertEqual(origin_group.agents, origin_old_agents[i + 1:])
-            self.assertEqual(dest_group.agents, dest_old_agents + origin_old_agents[:i + 1])
-
-            self.assertEqual(agent.group, dest_group)
-
-            self.assertTrue(not origin_group.all_civic)
-            self.assertTrue(not origin_group.mostly_civic)
-            self.assertTrue(not origin_group.majority_civic)
-
-            if i < 2:
-                self.assertTrue(not dest_group.all_civic)
-                self.assertTrue(dest_group.mostly_civic)
-                self.assertTrue(dest_group.majority_civic) 
- 
-            elif i >= 2 and i < 20:
-                self.assertTrue(not dest_group.all_civic)
-                self.assertTrue(not dest_group.mostly_civic)
-                self.assertTrue(dest_group.majority_civic) 
-            elif i == 20:
-                self.assertTrue(not dest_group.all_civic)
-                self.assertTrue(not dest_group.mostly_civic)
-                self.assertTrue(not dest_group.majority_civic) 
-
-        self.assertTrue(0 not in sm.groups)
-        self.assertTrue(origin_group not in sm.groups.values())
-        self.assertTrue(not origin_group.agents)
-        self.assertEqual(sm.grid_group_indices[origin_group.location], -1)
-
-        origin_group = sm.groups[1]
-        dest_group = sm.groups[7]
-
-        for agent in origin_group.agents:
-            agent.learning = "civic"
-        
-        for i in range(115 - 21):
-            origin_group.add_agent(SpatialAgent(sm, None, learning="civic"))
-        
-        for i, agent in enumerate(dest_group.agents):
-            if i % 2 == 0:
-                agent.learning = "selfish"
-            else:
-                agent.learning = "civic"
-
-        origin_group.recount_agents()
-        dest_group.recount_agents()
-
-        origin_old_agents = origin_group.agents.copy()
-        dest_old_agents = dest_group.agents.copy()
-        
-        self.assertTrue(origin_group.all_civic)
-        self.assertEqual(len(origin_group.agents), 115)
-        for i, agent in enumerate(origin_old_agents):
-            self.assertTrue(1 in sm.groups)
-            self.assertTrue(origin_group in sm.groups.values())
-            self.assertTrue(origin_group.agents)
-            self.assertEqual(sm.grid_group_indices[origin_group.location], 1)
-
-            origin_old_n_agents = origin_group.n_agents.copy()
-            dest_old_n_agents = dest_group.n_agents.copy()
-
-            agent.switch_group(7)
-
-            self.assertNotIn(agent, origin_group.agents)
-            self.assertIn(agent, dest_group.agents)
-
-            self.assertEqual(len(origin_group.agents), 114 - i)
-            self.assertEqual(len(dest_group.agents), 22 + i)
-
-            self.assertEqual(origin_old_n_agents[agent.learning] - 1, origin_group.n_agents[agent.learning])
-            self.assertEqual(dest_old_n_agents[agent.learning] + 1, dest_group.n_agents[agent.learning])
-
-            self.assertEqual(dest_group.n_agents["civic"], 11 + i)
-            self.assertEqual(dest_group.n_agents["selfish"] + dest_group.n_agents["static"], 11)
-            self.assertEqual(origin_group.n_agents["civic"], 114 - i)
-
-            self.assertEqual(origin_group.agents, origin_old_agents[i + 1:])
-            self.assertEqual(dest_group.agents, dest_old_agents + origin_old_agents[:i + 1])
-
-            self.assertEqual(agent.group, dest_group)
-
-            self.assertTrue(origin_group.all_civic)
-            self.assertTrue(origin_group.mostly_civic) # should fail when it gets to 0
-            self.assertTrue(origin_group.majority_civic)
-
-            if i < 1:
-                self.assertTrue(not dest_group.all_civic)
-                self.assertTrue(not dest_group.mostly_civic)
-                self.assertTrue(not dest_group.majority_civic)
-            elif i >= 1 and i < 89:
-                self.assertTrue(not dest_group.all_civic)
-                self.assertTrue(not dest_group.mostly_civic)
-                self.assertTrue(dest_group.majority_civic)
-            elif i >= 89:
-                self.assertTrue(not dest_group.all_civic)
-                self.assertTrue(dest_group.mostly_civic)
-                self.assertTrue(dest_group.majority_civic)
-            
-        self.assertTrue(1 not in sm.groups)
-        self.assertTrue(origin_group not in sm.groups.values())
-        self.assertTrue(not origin_group.agents)
-        self.assertEqual(sm.grid_group_indices[origin_group.location], -1)
-
-    # test SpatialAgent.choose_square
-    def testChooseSquare(self):
-        # without migration
-        sm = SpatialModel(n=50, g=8, size=4, p_swap=0, write_log=False)
-        old_forager_grid_next = np.array([[[17, 15, 21,  9,  4],
-        [ 4, 11, 10, 24,  4],
-        [21, 23, 17,  9, 22],
-        [20, 19, 14,  3,  3]],
-
-       [[ 6, 16,  2, 20,  8],
-        [ 7,  3,  3,  3,  7],
-        [16,  0, 17, 10, 16],
-        [12,  8, 18,  8, 11]],
-
-       [[12,  7, 12, 20, 17],
-        [11, 20, 23, 18, 20],
-        [12,  9, 19, 21, 16],
-        [21, 21, 19,  7,  6]],
-
-       [[ 2, 11, 17,  3,  5],
-        [ 8,  0, 10,  6,  8],
-        [ 9,  6, 13,  3, 23],
-        [20, 23,  1, 14, 24]]])
-
-        sm.forager_grid_next.grid = old_forager_grid_next.copy()
-        old_forager_grid = sm.forager_grid.grid.copy()
-
-        group = sm.groups[0]
-        square = group.location
-
-        # find the square underneath the selected group, if it has no group on it, move one there
-        under_square = sm.forager_grid.direction_to_coord(group.location[0], group.location[1], 2)
-        if sm.grid_group_indices[under_square] == -1:
-            group_under = sm.groups[1]
-            sm.grid_group_indices[group_under.location[0], group_under.location[1]] = -1
-            group_under.location = under_square
-            sm.grid_group_indices[group_under.location[0], group_under.location[1]] = 1
-        else:
-            group_under = sm.groups[sm.grid_group_indices[under_square]]
-        
-        old_group_under_agents = group_under.agents.copy()
-        old_group_agents = group.agents.copy()
-        
-        # find the square to the left of the selected group, if it has a group on it, move it away
-        left_square = sm.forager_grid.direction_to_coord(group.location[0], group.location[1], 3)
-        if not sm.grid_group_indices[left_square] == -1:
-            intruding_group = sm.groups[sm.grid_group_indices[left_square]]
-            new_square_raveled = np.argmin(sm.grid_group_indices) # flattened index of the array
-            new_square = np.unravel_index(new_square_raveled, sm.grid_group_indices.shape)
-
-            sm.grid_group_indices[left_square] = -1
-            intruding_group.location = new_square
-            sm.grid_group_indices[new_square] = intruding_group.id
-        
-        agent = group.agents[3]
-        agent.choose_square(probs=[0, 0, 1, 0, 0])
-        self.assertEqual(agent.foraging_direction, 2)
-        square_down = (sm.forager_grid.modular_add(square[0], 1), square[1]) # going downward
-        self.assertEqual(agent.square, square_down)
-
-        old_forager_grid_next[square_down[0], square_down[1], 1] += 1
-        self.assertTrue((old_forager_grid_next == sm.forager_grid_next.grid).all()) # increment forager_grid_next
-        self.assertTrue((old_forager_grid == sm.forager_grid.grid).all()) # the regular forager grid should stay 
-
-        self.assertEqual(agent.group, group)
-        self.assertEqual(group_under.agents, old_group_under_agents)
-        self.assertEqual(group.agents, old_group_agents)
-
-        agent = group.agents[8]
-        agent.choose_square(probs=[0, 0, 0, 1, 0])
-        self.assertEqual(agent.foraging_direction, 3)
-        square_left = (square[0], sm.forager_grid.modular_add(square[1], -1))
-        self.assertEqual(agent.square, square_left)
-
-        old_forager_grid_next[square_left[0], square_left[1], 4] += 1 # agent coming from the right
-        self.assertTrue((old_forager_grid_next == sm.forager_grid_next.grid).all()) # increments forager_grid_next
-        self.assertTrue((old_forager_grid == sm.forager_grid.grid).all()) # unchanged
-        
-        self.assertEqual(agent.group, group)
-        self.assertEqual(group_under.agents, old_group_under_agents)
-        self.assertEqual(group.agents, old_group_agents)
-
-        agent = group.agents[12]
-        agent.choose_square(probs=[1, 0, 0, 0, 0])
-        self.assertEqual(agent.foraging_direction, 0)
-        self.assertEqual(agent.square, square)
-
-        old_forager_grid_next[square[0], square[1], 0] += 1 # agent coming from the right
-        self.assertTrue((old_forager_grid_next == sm.forager_grid_next.grid).all()) # increments forager_grid_next
-        self.assertTrue((old_forager_grid == sm.forager_grid.grid).all()) # unchanged
-        
-        down_counter = 0
-        left_counter = 0
-        stay_counter = 0
-        for agent in group.agents:
-            agent.choose_square(probs=[1/3, 0, 1/3, 1/3, 0])
-            self.assertIn(agent.foraging_direction, [0, 2, 3])
-
-            if agent.foraging_direction == 2:
-                self.assertEqual(agent.square, square_down)
-                down_counter += 1
-            elif agent.foraging_direction == 3:
-                self.assertEqual(agent.square, square_left)
-                left_counter +=1
-            elif agent.foraging_direction == 0:
-                self.assertEqual(agent.square, square)
-                stay_counter += 1
-        
-        self.assertEqual(down_counter + left_counter + stay_counter, 50)
-        old_forager_grid_next[square_down[0], square_down[1], 1] += down_counter
-        old_forager_grid_next[square_left[0], square_left[1], 4] += left_counter
-        old_forager_grid_next[square[0], square[1], 0] += stay_counter
-
-        self.assertTrue((old_forager_grid_next == sm.forager_grid_next.grid).all())
-        self.assertTrue((old_forager_grid == sm.forager_grid.grid).all())
-        
-        self.assertIn(group, sm.groups.values())
-        self.assertEqual(len(group.agents), 50)
-
-        # with migration
-        sm = SpatialModel(n=50, g=15, size=4, p_swap=1, write_log=False)
-        group = sm.groups[3]
-        sm.forager_grid.grid = np.array([[[ 1,  5, 13,  4, 14],
-        [21,  0, 16, 21, 12],
-        [21, 21, 24,  2, 23],
-        [ 5, 14,  6,  3, 10]],
-
-       [[17,  6,  9, 24, 13],
-        [13, 15,  6, 22, 13],
-        [ 4,  3, 19, 11,  6],
-        [16, 16,  8,  2, 19]],
-
-       [[18,  2,  8,  9,  8],
-        [14,  5, 16,  3, 23],
-        [14,  9, 14, 17,  9],
-        [12, 19, 13, 23,  4]],
-
-       [[ 4, 10, 15,  4, 20],
-        [20, 20, 17,  7, 24],
-        [ 9,  2,  3, 20, 11],
-        [ 8, 14,  0, 20,  1]]])
-
-        sm.forager_grid_next.grid = old_forager_grid_next.copy()
-        old_forager_grid = sm.forager_grid.grid.copy()
-
-        group = sm.groups[0]
-        square = group.location
-
-        # find the square underneath the selected group, if it has no group on it, move one there
-        over_square = sm.forager_grid.direction_to_coord(group.location[0], group.location[1], 1)
-        if sm.grid_group_indices[over_square] == -1:
-            group_over = sm.groups[14]
-            sm.grid_group_indices[group_over.location[0], group_over.location[1]] = -1
-            group_over.location = over_square
-            sm.grid_group_indices[over_square] = 14
-        else:
-            group_over = sm.groups[sm.grid_group_indices[over_square]]
-        
-        old_group_over_agents = group_over.agents.copy()
-        old_group_agents = group.agents.copy()
-        
-        # find the square to the left of the selected group, if it has a group on it, move it away
-        right_square = sm.forager_grid.direction_to_coord(group.location[0], group.location[1], 4)
-        if not sm.grid_group_indices[right_square] == -1:
-            intruding_group = sm.groups[sm.grid_group_indices[right_square]]
-            new_square_raveled = np.argmin(sm.grid_group_indices) # flattened index of the array
-            new_square = np.unravel_index(new_square_raveled, sm.grid_group_indices.shape)
-
-            sm.grid_group_indices[right_square] = -1
-            intruding_group.location = new_square
-            sm.grid_group_indices[new_square] = intruding_group.id
-        
-        agent = group.agents[23]
-        agent.choose_square(probs=[0, 1, 0, 0, 0])
-        self.assertEqual(agent.foraging_direction, 1)
-        self.assertTrue(agent.just_migrated)
-        square_up = (sm.forager_grid.modular_add(square[0], -1), square[1]) # going upward
-        self.assertEqual(agent.square, square_up)
-
-        old_forager_grid_next[square_up[0], square_up[1], 0] += 1 # these agents migratec
-        self.assertTrue((old_forager_grid_next == sm.forager_grid_next.grid).all()) # increment forager_grid_next
-        self.assertTrue((old_forager_grid == sm.forager_grid.grid).all()) # the regular forager grid should stay 
-
-        self.assertEqual(agent.group, group_over)
-        self.assertEqual(group_over.agents, old_group_over_agents + [agent])
-        self.assertEqual(group.agents, old_group_agents[:23] + old_group_agents[24:])
-
-        agent = group.agents[43]
-        agent.choose_square(probs=[0, 0, 0, 0, 1])
-        self.assertEqual(agent.foraging_direction, 4)
-        self.assertFalse(agent.just_migrated)
-        square_right = (square[0], sm.forager_grid.modular_add(square[1], 1))
-        self.assertEqual(agent.square, square_right)
-
-        old_forager_grid_next[square_right[0], square_right[1], 3] += 1 # agent coming from the left
-        self.assertTrue((old_forager_grid_next == sm.forager_grid_next.grid).all()) # increments forager_grid_next
-        self.assertTrue((old_forager_grid == sm.forager_grid.grid).all()) # unchanged
-
-        self.assertEqual(agent.group, group)
-        self.assertEqual(group.agents, old_group_agents[:23] + old_group_agents[24:])
-
-        agent = group.agents[12]
-        agent.choose_square(probs=[1, 0, 0, 0, 0])
-        self.assertEqual(agent.foraging_direction, 0)
-        self.assertEqual(agent.square, square)
-
-        old_forager_grid_next[square[0], square[1], 0] += 1 # agent coming from the right
-        self.assertTrue((old_forager_grid_next == sm.forager_grid_next.grid).all()) # increments forager_grid_next
-        self.assertTrue((old_forager_grid == sm.forager_grid.grid).all()) # unchanged
-
-        self.assertEqual(agent.group, group)
-        self.assertEqual(group.agents, old_group_agents[:23] + old_group_agents[24:])
-
-        # self.assertEqual(agent.foraging_direction, 4)        
-        up_counter = 0
-        right_counter = 0
-        stay_counter = 0
-        old_group_agents = group.agents.copy()
-        for agent in old_group_agents:
-            old_group_over_agents = group_over.agents.copy()
-            agent.choose_square(probs=[1/3, 1/3, 0, 0, 1/3])
-            self.assertIn(agent.foraging_direction, [0, 1, 4])
-            
-            if agent.foraging_direction == 1:
-                up_counter += 1
-                self.assertEqual(agent.square, square_up)
-                self.assertEqual(agent.group, group_over)
-                self.assertEqual(group_over.agents, old_group_over_agents + [agent])
-            elif agent.foraging_direction == 4:
-                right_counter +=1
-                self.assertEqual(agent.square, square_right)
-                self.assertEqual(agent.group, group)
-                self.assertEqual(len(group.agents), 49 - up_counter)
-            elif agent.foraging_direction == 0:
-                stay_counter += 1
-                self.assertEqual(agent.square, square)
-                
-            self.assertEqual(len(group.agents), 49 - up_counter)
-        
-        self.assertEqual(up_counter + right_counter + stay_counter, 49)
-        old_forager_grid_next[square_up[0], square_up[1], 0] += up_counter
-        old_forager_grid_next[square_right[0], square_right[1], 3] += right_counter
-        old_forager_grid_next[square[0], square[1], 0] += stay_counter
-
-        self.assertTrue((old_forager_grid_next == sm.forager_grid_next.grid).all())
-        self.assertTrue((old_forager_grid == sm.forager_grid.grid).all())
-        
-        self.assertEqual(len(group.agents), 49 - up_counter)
-        self.assertEqual(len(group_over.agents), 51 + up_counter)
-
     def testChooseCoop(self):
         sm = SpatialModel(n=100, g=80, size=10, epsilon=0.1, write_log=False)
         
@@ -2704,6 +2201,50 @@ class TestSpatialModelNew(unittest.TestCase):
                     else:
                         self.assertEqual(sg.grid[i, j, k], 15*i+5*j+k) # since we numbered the grid sequentially
 
+    # tests SpatialGrid.add_agents against adding the agents one at a time
+    def testGridAddAgents(self):
+        sm = SpatialModel(write_log=False)
+        one_by_one = SpatialGrid(5, model=sm)
+        bulk = SpatialGrid(5, model=sm)
+        bulk.grid = np.array(range(125), dtype=float).reshape((5, 5, 5))
+        one_by_one.grid = bulk.grid.copy()
+
+        rows, cols, directions = np.random.randint(5, size=200), np.random.randint(5, size=200), np.random.randint(5, size=200)
+        for row, col, direction in zip(rows, cols, directions):
+            one_by_one.add_agent((row, col), direction if direction != 0 else None)
+        bulk.add_agents(rows, cols, ARRIVAL_CHANNEL[directions])
+        self.assertTrue((bulk.grid == one_by_one.grid).all())
+
+        grid = bulk.grid
+        bulk.clear()
+        self.assertIs(bulk.grid, grid)
+        self.assertTrue((bulk.grid == 0).all())
+
+    # tests that square_decisions reuses the two forager grids, swapping them every round
+    def testForagerGridBuffers(self):
+        sm = SpatialModel(n=10, g=4, size=5, write_log=False)
+        grids = {id(sm.forager_grid.grid), id(sm.forager_grid_next.grid)}
+        for i in range(4):
+            sm.loop()
+            self.assertEqual({id(sm.forager_grid.grid), id(sm.forager_grid_next.grid)}, grids)
+            self.assertTrue((sm.forager_grid_next.grid == 0).all())
+
+            # every agent is counted once, on the square it foraged on
+            agents = [agent for group in sm.groups.values() for agent in group.agents]
+            self.assertEqual(sm.forager_grid.grid.sum(), len(agents))
+            for agent in agents:
+                channel = 0 if agent.just_migrated else ARRIVAL_CHANNEL[agent.foraging_direction]
+                self.assertGreater(sm.forager_grid.grid[agent.square[0], agent.square[1], channel], 0)
+
+    # tests the neighbor tables of SpatialGrid against direction_to_coord
+    def testNeighborTables(self):
+        sg = SpatialGrid(5, model=SpatialModel(write_log=False))
+        for row in range(5):
+            for col in range(5):
+                for direction in range(5):
+                    self.assertEqual((sg.neighbor_rows[row, col, direction], sg.neighbor_cols[row, col, direction]),
+                                     sg.direction_to_coord(row, col, direction))
+
     # tests SpatialGrid.group_to_bud, which gives the group that should bud given a forager_grid
     def testGroupToBud(self):
         print("testing group to bud")